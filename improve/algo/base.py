@@ -62,6 +62,19 @@ class Algo:
         self.model.load_state_dict(torch.load(path)["state_dict"], strict=False)
         self.model = self.acc.prepare(self.model, device_placement=[True])[0]
 
+    def embed_text(self, text, bs):
+        """language input for the model, repeated over the batch
+        uses cached CLIP embeddings when the model has a text cache
+        otherwise falls back to CLIP tokens
+        """
+
+        cache = getattr(self.model, "text_cache", None)
+        if cache is not None:
+            text = torch.from_numpy(cache.get([text])).to(self.device)
+        else:
+            text = self.tokenizer(text).to(self.device)
+        return text.view(1, -1).expand(bs, -1)
+
     def loss(self, x):
         raise NotImplementedError
 
@@ -135,8 +148,7 @@ class Algo:
                 action = torch.zeros(bs, 1, 7).to(self.device)
                 state = {"arm": action[..., :-1], "gripper": action[..., -1:]}
                 instruction = env.instruction
-                text = self.tokenizer("put eggplant in the sink").to(self.device)
-                text = text.view(1, -1).expand(bs, -1).to(self.device)
+                text = self.embed_text("put eggplant in the sink", bs)
                 attn_mask = torch.ones((bs, seq, 1)).to(self.device)
 
                 buffer = {
@@ -0,0 +1,347 @@
+"""
+purejaxrl style residual ppo on a jax surrogate of the reach task
+
+rollout, residual action composition, gae and ppo updates are one jitted lax.scan
+so algorithm changes can be compared at millions of steps per minute on cpu
+before they are tried with simpler and a real foundation model
+
+the surrogate mirrors ReachTaskWrapper: a point eef moves toward an object and
+succeeds when every axis of obj-wrt-eef is within thresh. a frozen proportional
+controller with a per episode bias stands in for the fm, the residual must fix its error
+"""
+
+import time
+from dataclasses import dataclass
+from pprint import pprint
+from typing import NamedTuple
+
+import flax.linen as nn
+import jax
+import jax.numpy as jnp
+import numpy as np
+import optax
+from flax import struct
+from flax.linen.initializers import constant, orthogonal
+from flax.training.train_state import TrainState
+
+# ActionRescaler clip strategy, per axis scale and max translation of the rtx space
+SCALE = 0.05
+MAX_TRANSLATION = float(np.linalg.norm([0.05, 0.05, 0.05]))
+
+
+@struct.dataclass
+class EnvState:
+    eef: jnp.ndarray  # [3]
+    obj: jnp.ndarray  # [3]
+    bias: jnp.ndarray  # [3] where the base policy thinks obj is
+    t: jnp.ndarray
+    ep_return: jnp.ndarray
+
+
+class PointMassReach:
+    """jax reach task with a frozen base policy, every method is pure and vmappable
+
+    :param thresh: per axis success distance, like ReachTaskWrapper
+    :param gain: base policy proportional gain
+    :param bias: std of the base policy target error, 0 is a perfect base
+    :param residual_scale: like ActionRescaler
+    """
+
+    obs_dim = 9  # obj-wrt-eef, eef-pose, fm action
+    action_dim = 3
+
+    def __init__(
+        self,
+        thresh=0.02,
+        use_sparse_reward=True,
+        reward_clip=0.5,
+        max_steps=60,
+        gain=0.5,
+        bias=0.05,
+        residual_scale=1.0,
+    ):
+        self.thresh = thresh
+        self.use_sparse_reward = use_sparse_reward
+        self.reward_clip = reward_clip
+        self.max_steps = max_steps
+        self.gain = gain
+        self.bias = bias
+        self.residual_scale = residual_scale
+
+    def reset(self, key):
+        k1, k2, k3 = jax.random.split(key, 3)
+        state = EnvState(
+            eef=jax.random.uniform(k1, (3,), minval=-0.2, maxval=0.2),
+            obj=jax.random.uniform(k2, (3,), minval=-0.2, maxval=0.2),
+            bias=self.bias * jax.random.normal(k3, (3,)),
+            t=jnp.array(0),
+            ep_return=jnp.array(0.0),
+        )
+        return self.obs(state), state
+
+    def base_act(self, state):
+        """frozen base policy in rtx space, stands in for the fm"""
+        return jnp.clip(self.gain * (state.obj + state.bias - state.eef), -SCALE, SCALE)
+
+    def obs(self, state):
+        return jnp.concatenate([state.obj - state.eef, state.eef, self.base_act(state) / SCALE])
+
+    def compose(self, base, residual):
+        """ActionRescaler clip strategy: residual to rtx space, add, clip the translation norm"""
+        total = base + jnp.clip(residual, -1, 1) * SCALE * self.residual_scale
+        norm = jnp.linalg.norm(total)
+        return total * jnp.minimum(1.0, MAX_TRANSLATION / (norm + 1e-8))
+
+    def reward(self, dist):
+        success = jnp.all(jnp.abs(dist) < self.thresh)
+        if self.use_sparse_reward:
+            return success.astype(jnp.float32), success
+        rew = jnp.clip(1 - jnp.tanh(10 * jnp.linalg.norm(dist)), -1, self.reward_clip)
+        return jnp.where(success, 1.0, rew), success
+
+    def step(self, key, state, residual):
+        """one step with auto reset, obs is the first obs of the next episode when done"""
+
+        action = self.compose(self.base_act(state), residual)
+        state = state.replace(eef=state.eef + action, t=state.t + 1)
+
+        reward, success = self.reward(state.obj - state.eef)
+        truncated = state.t >= self.max_steps
+        done = jnp.logical_or(success, truncated)
+        state = state.replace(ep_return=state.ep_return + reward)
+        info = {"return": state.ep_return, "success": success, "done": done}
+
+        reset_obs, reset_state = self.reset(key)
+        state = jax.tree.map(lambda a, b: jnp.where(done, a, b), reset_state, state)
+        obs = jnp.where(done, reset_obs, self.obs(state))
+        return obs, state, reward, done, info
+
+
+class ActorCritic(nn.Module):
+    action_dim: int
+    hidden: int = 64
+
+    @nn.compact
+    def __call__(self, x):
+        def mlp(x, out, scale):
+            for _ in range(2):
+                x = nn.tanh(nn.Dense(self.hidden, kernel_init=orthogonal(np.sqrt(2)), bias_init=constant(0.0))(x))
+            return nn.Dense(out, kernel_init=orthogonal(scale), bias_init=constant(0.0))(x)
+
+        mean = mlp(x, self.action_dim, 0.01)
+        log_std = self.param("log_std", nn.initializers.constant(-0.5), (self.action_dim,))
+        value = mlp(x, 1, 1.0)
+        return (mean, log_std), jnp.squeeze(value, axis=-1)
+
+
+def log_prob(mean, log_std, x):
+    return jnp.sum(
+        -0.5 * ((x - mean) / jnp.exp(log_std)) ** 2 - log_std - 0.5 * jnp.log(2 * jnp.pi),
+        axis=-1,
+    )
+
+
+def entropy(log_std):
+    return jnp.sum(log_std + 0.5 * jnp.log(2 * jnp.pi * jnp.e), axis=-1)
+
+
+class Transition(NamedTuple):
+    done: jnp.ndarray
+    action: jnp.ndarray
+    value: jnp.ndarray
+    reward: jnp.ndarray
+    log_prob: jnp.ndarray
+    obs: jnp.ndarray
+    info: dict
+
+
+@dataclass
+class PPOConfig:
+    num_envs: int = 1024
+    num_steps: int = 32  # rollout length per update
+    total_timesteps: int = int(1e7)
+    update_epochs: int = 4
+    num_minibatches: int = 8
+    lr: float = 3e-4
+    gamma: float = 0.99
+    gae_lambda: float = 0.95
+    clip_eps: float = 0.2
+    ent_coef: float = 0.0
+    vf_coef: float = 0.5
+    max_grad_norm: float = 0.5
+
+    @property
+    def num_updates(self):
+        return self.total_timesteps // self.num_steps // self.num_envs
+
+    @property
+    def minibatch_size(self):
+        return self.num_envs * self.num_steps // self.num_minibatches
+
+
+def make_train(cfg, env):
+    """
+    :returns: train(rng) -> {"runner_state", "metrics"}, jit it as a whole
+        metrics are per update means, so nothing per step leaves the device
+    """
+
+    network = ActorCritic(env.action_dim)
+    tx = optax.chain(
+        optax.clip_by_global_norm(cfg.max_grad_norm),
+        optax.adam(cfg.lr, eps=1e-5),
+    )
+    reset = jax.vmap(env.reset)
+    step = jax.vmap(env.step)
+
+    def _env_step(runner_state, _):
+        train_state, env_state, last_obs, rng = runner_state
+
+        rng, k_act, k_step = jax.random.split(rng, 3)
+        (mean, log_std), value = network.apply(train_state.params, last_obs)
+        action = mean + jnp.exp(log_std) * jax.random.normal(k_act, mean.shape)
+        logp = log_prob(mean, log_std, action)
+
+        keys = jax.random.split(k_step, cfg.num_envs)
+        obs, env_state, reward, done, info = step(keys, env_state, action)
+
+        transition = Transition(done, action, value, reward, logp, last_obs, info)
+        return (train_state, env_state, obs, rng), transition
+
+    def _gae(traj, last_val):
+        def _adv(carry, t):
+            gae, next_value = carry
+            delta = t.reward + cfg.gamma * next_value * (1 - t.done) - t.value
+            gae = delta + cfg.gamma * cfg.gae_lambda * (1 - t.done) * gae
+            return (gae, t.value), gae
+
+        _, adv = jax.lax.scan(_adv, (jnp.zeros_like(last_val), last_val), traj, reverse=True, unroll=16)
+        return adv, adv + traj.value
+
+    def _loss(params, traj, gae, targets):
+        (mean, log_std), value = network.apply(params, traj.obs)
+        logp = log_prob(mean, log_std, traj.action)
+
+        value_clipped = traj.value + (value - traj.value).clip(-cfg.clip_eps, cfg.clip_eps)
+        value_loss = 0.5 * jnp.maximum(jnp.square(value - targets), jnp.square(value_clipped - targets)).mean()
+
+        ratio = jnp.exp(logp - traj.log_prob)
+        gae = (gae - gae.mean()) / (gae.std() + 1e-8)
+        actor_loss = -jnp.minimum(ratio * gae, jnp.clip(ratio, 1 - cfg.clip_eps, 1 + cfg.clip_eps) * gae).mean()
+        ent = entropy(log_std).mean()
+
+        total = actor_loss + cfg.vf_coef * value_loss - cfg.ent_coef * ent
+        return total, {"value_loss": value_loss, "actor_loss": actor_loss, "entropy": ent}
+
+    def _update_minibatch(train_state, batch):
+        grads, info = jax.grad(_loss, has_aux=True)(train_state.params, *batch)
+        return train_state.apply_gradients(grads=grads), info
+
+    def _update_epoch(update_state, _):
+        train_state, batch, rng = update_state
+        rng, key = jax.random.split(rng)
+
+        size = cfg.num_envs * cfg.num_steps
+        perm = jax.random.permutation(key, size)
+        minibatches = jax.tree.map(
+            lambda x: jnp.take(x.reshape(size, *x.shape[2:]), perm, axis=0).reshape(
+                cfg.num_minibatches, -1, *x.shape[2:]
+            ),
+            batch,
+        )
+        train_state, info = jax.lax.scan(_update_minibatch, train_state, minibatches)
+        return (train_state, batch, rng), info
+
+    def _update_step(runner_state, _):
+        runner_state, traj = jax.lax.scan(_env_step, runner_state, None, cfg.num_steps)
+
+        train_state, env_state, last_obs, rng = runner_state
+        _, last_val = network.apply(train_state.params, last_obs)
+        adv, targets = _gae(traj, last_val)
+
+        # infos stay on device, only episode means are kept
+        batch = (traj._replace(info=None), adv, targets)
+        (train_state, _, rng), info = jax.lax.scan(
+            _update_epoch, (train_state, batch, rng), None, cfg.update_epochs
+        )
+
+        done = traj.info["done"]
+        n = jnp.maximum(done.sum(), 1)
+        metrics = {
+            **jax.tree.map(jnp.mean, info),
+            "return": (traj.info["return"] * done).sum() / n,
+            "success": (traj.info["success"] * done).sum() / n,
+            "episodes": done.sum(),
+        }
+        return (train_state, env_state, last_obs, rng), metrics
+
+    def train(rng):
+        rng, k_init, k_reset = jax.random.split(rng, 3)
+        params = network.init(k_init, jnp.zeros((env.obs_dim,)))
+        train_state = TrainState.create(apply_fn=network.apply, params=params, tx=tx)
+
+        obs, env_state = reset(jax.random.split(k_reset, cfg.num_envs))
+        runner_state = (train_state, env_state, obs, rng)
+        runner_state, metrics = jax.lax.scan(_update_step, runner_state, None, cfg.num_updates)
+        return {"runner_state": runner_state, "metrics": metrics}
+
+    return train
+
+
+def base_only(env, rng, num_envs=1024, num_steps=600):
+    """success rate of the frozen base policy, the residual should beat this"""
+
+    obs, state = jax.vmap(env.reset)(jax.random.split(rng, num_envs))
+
+    def _step(carry, key):
+        state = carry
+        keys = jax.random.split(key, num_envs)
+        _, state, _, done, info = jax.vmap(env.step)(keys, state, jnp.zeros((num_envs, env.action_dim)))
+        return state, (info["success"] * done, done)
+
+    _, (success, done) = jax.lax.scan(_step, state, jax.random.split(rng, num_steps))
+    return success.sum() / jnp.maximum(done.sum(), 1)
+
+
+def bench(cfg, env, seeds=1):
+    """env steps per minute of the compiled trainer, compile time is reported apart
+
+    :param seeds: independent runs vmapped into the same program
+    """
+
+    train = make_train(cfg, env)
+    train = jax.jit(jax.vmap(train)) if seeds > 1 else jax.jit(train)
+    rngs = jax.random.split(jax.random.PRNGKey(0), seeds) if seeds > 1 else jax.random.PRNGKey(0)
+
+    tic = time.time()
+    train = train.lower(rngs).compile()
+    compile_time = time.time() - tic
+
+    tic = time.time()
+    out = jax.block_until_ready(train(rngs))
+    elapsed = time.time() - tic
+
+    steps = cfg.num_updates * cfg.num_steps * cfg.num_envs * seeds
+    pprint(
+        {
+            "compile": f"{compile_time:.1f} s",
+            "train": f"{elapsed:.1f} s",
+            "steps/min": f"{steps / elapsed * 60:.3g}",
+        }
+    )
+    return out
+
+
+def main():
+    cfg = PPOConfig()
+    env = PointMassReach()
+
+    print(f"base policy success: {float(base_only(env, jax.random.PRNGKey(1))):.2f}")
+    out = bench(cfg, env)
+
+    metrics = jax.device_get(out["metrics"])
+    for i in np.linspace(0, cfg.num_updates - 1, 10).astype(int):
+        print(i, {k: round(float(v[i]), 3) for k, v in metrics.items()})
+
+
+if __name__ == "__main__":
+    main()
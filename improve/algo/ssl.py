@@ -35,8 +35,7 @@ class SelfSupervised(Algo):
         bs, seq = img.shape[:2]
         attn_mask = torch.ones((bs, seq, 1)).to(self.device)
 
-        text = self.tokenizer("put eggplant in the sink").to(self.device)
-        text = text.view(1, -1).expand(bs, -1).to(self.device)
+        text = self.embed_text("put eggplant in the sink", bs)
 
         action = batch["observation"]["agent_partial-action"].float()
         obs = {
@@ -16,6 +16,22 @@ class Buffer:
     size: int = int(1e6)
 
 
+@store
+@dataclass
+class VecHER(Buffer):
+    """vectorized HER, set algo.replay_buffer_class and kwargs from these"""
+
+    name: str = "vecher"
+
+    cls: Optional[str] = "${r_typeof:improve.sb3.custom.her.VecHerReplayBuffer}"
+    args: Optional[Any] = default(
+        {
+            "goal_selection_strategy": "future",  # or final, episode
+            "n_sampled_goal": 4,
+        }
+    )
+
+
 """
 # HER hindsight experience replay buffer
 # works with DQN, SAC, DDPG and TD3
@@ -51,12 +51,39 @@ class Env:
             "force": False,
             "value": "${job.seed}",
             "seeds": None,
+            "cache": False,
+            "schedule": {
+                "use": False,
+                "strategy": "failure",
+                "temperature": 1.0,
+                "staleness": 0.3,
+                "ema": 0.2,
+            },
         }
     )
 
     reward: str = "sparse"
     max_episode_steps: int = 60
     n_envs: int = 16
+    scenes: int = 1
+    pipeline: bool = False
+    recv_batch: Optional[int] = None
+
+    render: dict = default(
+        {
+            "backend": "auto",
+            "devices": None,
+            "assign": "round_robin",
+            "per_device": None,
+        }
+    )
+    replay: dict = default(
+        {
+            "record": False,
+            "dir": "${callback.log_path}/replay",
+            "every": 20,
+        }
+    )
     no_quarternion: bool = False
     reach: bool = False
     fm_loc: FMLoc = FMLoc.CENTRAL
@@ -25,6 +25,9 @@ class FoundationModel:
 
     batch_size: int = 8  # number of parallel environments
 
+    compile_cache: Optional[str] = None  # persistent xla cache dir, opt-in
+    warmup: Optional[list] = None  # batch sizes to compile at startup
+
     def __post_init__(self):
 
         # follow simpler.OctoInference
@@ -87,6 +90,7 @@ class RTX(FoundationModel):
     batch_size: int = 2
 
     cached: bool = True
+    precision: str = "fp32"  # fp32 | bf16 | int8 | int8-bf16, see fm.quant
 
     # def __post_init__(self): self.checkpoint_path = osp.join(improve.WEIGHTS, self.checkpoint_path)
     def __post_init__(self):
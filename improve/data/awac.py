@@ -15,6 +15,7 @@ from torchvision import transforms
 from tqdm import tqdm
 
 from improve import cn
+from improve.data.episode import split
 from improve.env.action_rescale import ActionRescaler
 from improve.wrapper import dict_util as du
 
@@ -176,24 +177,8 @@ def preprocess(x: dict, task=None):
 
 
 def ep2step(ep: Tuple[Any]):
-
-    epl = max([len(x) for x in ep])
-
-    # for all e in ep if e is dict, return the i-th item of each k in dict
-    # if e is a list, return the i-th item of each e
-    # if e is a np.array, return the i-th item of each e
-    # yield the i-th item of each e together at the same time
-
-    def select(e, i):
-        if isinstance(e, dict):
-            return du.apply_mappable(e, lambda x: x[i])
-        elif isinstance(e, list):
-            return e[i]
-        elif isinstance(e, np.ndarray):
-            return e[i]
-
-    for i in range(epl):
-        yield tuple(select(e, i) for e in ep)
+    """yields the i-th item of each e in ep together, for every step i"""
+    yield from split(ep)
 
 
 def mk_dataset(fnames, task=None):
@@ -11,6 +11,8 @@ from torch.utils.data import IterableDataset
 from tqdm import tqdm
 
 from improve import cn
+from improve.data.episode import mc_values, split
+from improve.data.relabel import load_overlay, overlaid
 from improve.env.action_rescale import ActionRescaler
 from improve.wrapper import dict_util as du
 
@@ -112,7 +114,7 @@ def steps2batch(dataset):
 
     queue = []
     for sample in dataset:
-        steps = list(ep2step(sample))
+        steps = split(sample)
         for s in steps:
             queue.append(s)
             if len(queue) == 8:
@@ -123,7 +125,7 @@ def steps2batch(dataset):
 
 
 class MyOfflineDS(IterableDataset):
-    def __init__(self, root=".", seq=2, transform=None, shift_reward=False):
+    def __init__(self, root=".", seq=2, transform=None, shift_reward=False, overlay=None):
         super(MyOfflineDS).__init__()
 
         self.root = root
@@ -137,10 +139,14 @@ class MyOfflineDS(IterableDataset):
         
         self.shift_reward = shift_reward
 
+        # relabeled rewards from improve.data.relabel, the episodes are left as they are
+        self.overlay = load_overlay(overlay) if overlay is not None else {}
+
     def decode(self, idx):
         # print(idx)
         path = osp.join(self.root, f"{idx}.pt")
         data = torch.load(path)
+        data = overlaid(data, self.overlay, str(idx))
         
         mp4_names = ["obs", "next_obs", "video"]
         
@@ -160,8 +166,7 @@ class MyOfflineDS(IterableDataset):
             data["rewards"] = data["rewards"] - 1.0
         
         # Add monte carlo reward
-        for i in range(len(data["rewards"]) -2, -1, -1):
-            data["rewards"][i] = 0.99 * data["rewards"][i+1]
+        data["rewards"] = mc_values(data["rewards"], 0.99)
 
         # TODO fix so that pt is written correctly
         infos = data["infos"].item()
@@ -170,12 +175,15 @@ class MyOfflineDS(IterableDataset):
         data["infos"] = du.nest(infos, delim="/")
 
         length = len(data["rewards"])
-        for i in range(length // self.seq):
-            if self.seq > 1:
-                out = du.apply(data, lambda x: x[i * self.seq : (i + 1) * self.seq])
-            else:
-                out = du.apply(data, lambda x: x[i])
+        if self.seq > 1:
+            chunks = (
+                du.apply(data, lambda x: x[i * self.seq : (i + 1) * self.seq])
+                for i in range(length // self.seq)
+            )
+        else:
+            chunks = split(data, n=length)
 
+        for out in chunks:
             out = self.transform(out) if self.transform is not None else out
             yield out
 
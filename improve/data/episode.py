@@ -0,0 +1,134 @@
+import time
+from pprint import pprint
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def future(x, horizon):
+    """windows of the next horizon steps for every step of an episode
+    zeros past the end of the episode, since the policy should predict 0s when done
+
+    :param x: [n, ...] array with time on the first axis
+    :returns: [n, horizon, ...] strided view
+    """
+
+    x = np.asarray(x)
+    pad = np.zeros((horizon - 1, *x.shape[1:]), dtype=x.dtype)
+    windows = sliding_window_view(np.concatenate([x, pad]), horizon, axis=0)
+    return np.moveaxis(windows, -1, 1)
+
+
+def mc_values(rewards, gamma=0.99):
+    """monte carlo values: the final reward discounted back to every step
+    value[i] = gamma ** (n - 1 - i) * rewards[-1]
+    same as the reverse loop rewards[i] = gamma * rewards[i + 1]
+
+    :param rewards: [n, ...] array
+    """
+
+    rewards = np.asarray(rewards)
+    dtype = rewards.dtype if np.issubdtype(rewards.dtype, np.floating) else np.float32
+    n = len(rewards)
+    discount = gamma ** np.arange(n - 1, -1, -1, dtype=np.float64)
+    discount = discount.reshape(-1, *[1] * (rewards.ndim - 1))
+    return (discount * rewards[-1]).astype(dtype)
+
+
+def length(ep):
+    """episode length, the longest leaf"""
+    if isinstance(ep, dict):
+        return max(length(v) for v in ep.values())
+    if isinstance(ep, tuple):
+        return max(length(e) for e in ep)
+    return 0 if ep is None else len(ep)
+
+
+def take(ep, idx):
+    """gathers idx along time for every leaf of ep
+    tuples and dicts are containers, lists are already per-step like infos
+    """
+
+    if isinstance(ep, dict):
+        return {k: take(v, idx) for k, v in ep.items()}
+    if isinstance(ep, tuple):
+        return tuple(take(e, idx) for e in ep)
+    if ep is None:
+        return None
+    if isinstance(ep, list):
+        return ep[idx] if np.isscalar(idx) else [ep[i] for i in idx]
+    return ep[idx]
+
+
+def split(ep, idx=None, n=None):
+    """splits an episode into a list of per-step samples
+    one gather for idx (all steps by default), then views of the gathered arrays
+
+    :param n: number of steps, the longest leaf by default
+    """
+
+    if idx is not None:
+        ep = take(ep, np.asarray(idx))
+        n = len(idx)
+    n = length(ep) if n is None else n
+    return [take(ep, i) for i in range(n)]
+
+
+def ep2samples(x, horizon=5, gamma=0.99, action="action", reward="reward"):
+    """episode dict -> list of samples with future action and value windows
+
+    :param x: dict with time as the leading axis of each leaf
+    """
+
+    x[action] = future(x[action], horizon)
+    x["value"] = future(mc_values(x[reward], gamma)[:, None], horizon)
+    return split(x)
+
+
+def _reference(x, horizon=5, gamma=0.99):
+    """per-step loops that ep2samples replaces, for parity and timing"""
+
+    def _future(things):
+        n = len(things)
+        rolled = lambda i: [np.roll(things, -s, axis=0)[i] for s in range(horizon)]
+        out = np.stack([np.stack(rolled(i)) for i in range(n)])
+        mask = np.arange(n).reshape(-1, 1) + np.arange(horizon) < n
+        return np.where(mask[:, :, None], out, np.zeros_like(things[-1]))
+
+    x = dict(x)
+    x["action"] = _future(x["action"])
+    rew = x["reward"].tolist()
+    for i in range(len(rew) - 2, -1, -1):
+        rew[i] = gamma * rew[i + 1]
+    x["value"] = _future(np.expand_dims(np.array(rew, dtype=np.float32), axis=-1))
+    return [take(x, i) for i in range(len(x["reward"]))]
+
+
+def main():
+    """samples/sec of ep2samples vs the per-step loops on 1000 step episodes"""
+
+    n = 1000
+    ep = lambda: {
+        "obs": {"eef-pose": np.random.rand(n, 7).astype(np.float32)},
+        "action": np.random.rand(n, 7).astype(np.float32),
+        "reward": np.random.rand(n).astype(np.float32),
+        "done": np.zeros(n, dtype=bool),
+    }
+
+    x = ep()
+    new, ref = ep2samples(dict(x)), _reference(x)
+    for k in ["action", "value"]:
+        stack = lambda samples: np.stack([s[k] for s in samples])
+        assert np.allclose(stack(new), stack(ref)), k
+
+    results = {}
+    for name, fn in [("ep2samples", ep2samples), ("reference", _reference)]:
+        tic = time.time()
+        for _ in range(3):
+            fn(ep())
+        results[name] = 3 * n / (time.time() - tic)
+    pprint({k: f"{v:.0f} samples/sec" for k, v in results.items()})
+
+
+if __name__ == "__main__":
+    main()
@@ -17,6 +17,8 @@ from tqdm import tqdm
 
 from improve import cn
 from improve.env.action_rescale import ActionRescaler
+from improve.data import stats
+from improve.data.episode import split
 from improve.wrapper import dict_util as du
 
 # decord last
@@ -109,12 +111,13 @@ def filter_keys(obs):
 # scaler = ActionRescaler(cn.Strategy.CLIP, residual_scale=1.0)
 
 
-def unscale(action):
-    """ this is un-scaling for Octo with widowX robot """
-    m = [0.00021161, 0.00012614, -0.00017022, -0.00015062, -0.00023831, 0.00025646, 0.0]
-    mean = np.array(m)
-    s = [0.00963721, 0.0135066, 0.01251861, 0.02806791, 0.03016905, 0.07632624, 1.0]
-    std = np.array(s)
+def unscale(action, action_stats=None):
+    """this is un-scaling for Octo with widowX robot
+    :param action_stats: {"mean", "std"} from data.stats.load, octo bridge stats by default
+    """
+    if action_stats is None:
+        action_stats = stats.octo("bridge_dataset")["action"]
+    mean, std = action_stats["mean"], action_stats["std"]
 
     out = (action - mean[None]) / std[None]
     return out
@@ -167,23 +170,8 @@ def preprocess(x: dict):
 
 
 def ep2step(ep: Tuple[Any]):
-
-    epl = max([len(x) for x in ep])
-
-    # for all e in ep if e is dict, return the i-th item of each k in dict
-    # if e is a list, return the i-th item of each e
-    # if e is a np.array, return the i-th item of each e
-    # yield the i-th item of each e together at the same time
-
-    def select(e, i):
-        if isinstance(e, dict):
-            return du.apply_mappable(e, lambda x: x[i])
-        elif isinstance(e, list):
-            return e[i]
-        elif isinstance(e, np.ndarray):
-            return e[i]
-
-    return [tuple(select(e, i) for e in ep) for i in range(epl)]
+    """the i-th item of each e in ep together, for every step i"""
+    return split(ep)
 
 
 def mk_dataset(fnames):
@@ -0,0 +1,352 @@
+"""
+offline reward relabeling of stored episodes
+
+reward ablations (thresholds, clips, shaping) used to mean new SAPIEN rollouts.
+the reward functions in improve.wrapper.simpler.reward run on stored episode
+arrays instead, so rewards and success flags are rewritten in seconds
+
+    .pt     VecRecord episodes, {obs, next_obs, rewards, infos, ...}
+    .h5     HDF5LoggerWrapper files, ep_*/steps/step_i/{observation, reward, info}
+    .tar    webdataset shards, members {key}.{field}.{pt,npz,npy,json}
+
+in place rewrites rewards and infos/success, an overlay leaves the data alone and
+writes {episode id}/rewards and {episode id}/success to one npz (see load_overlay)
+dones are kept, episodes are not cut short where a new success comes earlier
+
+HDF5LoggerWrapper does not store the observation after the last action, so the last
+step of an .h5 episode keeps its recorded reward and success (and so does the
+dataset_info summary). relabeling it from s_{T-1} would flip most successes
+"""
+
+import io
+import json
+import os
+import os.path as osp
+import tarfile
+import time
+from pprint import pprint
+
+import numpy as np
+import torch
+from tqdm import tqdm
+
+from improve.wrapper import dict_util as du
+from improve.wrapper.simpler import reward as R
+
+# lowdim obs the reward functions read, h5 files only load these
+OBS_KEYS = ["obj-wrt-eef", "obj-pose", "eef-pose"]
+
+
+#
+# episode rewards
+#
+
+
+def _dist(ep):
+    """obj-wrt-eef after each action, r_t is computed on s_{t+1}"""
+
+    obs = ep["next_obs"] or ep["obs"]
+    if "obj-wrt-eef" in obs:
+        return np.asarray(obs["obj-wrt-eef"], dtype=np.float32)
+    return R.wrt_eef(obs["obj-pose"], obs["eef-pose"])
+
+
+def reach(ep, thresh=0.1, sparse=True, clip=0.5):
+    return R.reach(_dist(ep), thresh, sparse, clip)
+
+
+def grasp_dense(ep, clip=0.2):
+    # the sparse env reward is the stored success flag
+    success = np.asarray(ep["infos"]["success"], dtype=bool)
+    is_grasped = np.asarray(ep["infos"]["is_grasped"], dtype=np.float32)
+    return R.grasp_dense(_dist(ep), success, is_grasped, clip), success
+
+
+def awac(ep):
+    return R.awac(ep["rewards"]), None
+
+
+REWARDS = {"reach": reach, "grasp_dense": grasp_dense, "awac": awac}
+
+
+def relabel_episode(ep, specs):
+    """
+    :param ep: {obs, next_obs, rewards, infos} with time on the first axis
+    :param specs: [(name, kwargs)] of REWARDS, applied in order so each sees the last rewards
+        ie: [("reach", {"thresh": 0.05}), ("awac", {})]
+    :returns: rewards, success
+    """
+
+    rewards = np.asarray(ep["rewards"], dtype=np.float32)
+    success = ep["infos"].get("success")
+    for name, kwargs in specs:
+        rewards, s = REWARDS[name]({**ep, "rewards": rewards}, **kwargs)
+        rewards = np.asarray(rewards, dtype=np.float32)
+        success = s if s is not None else success
+    success = None if success is None else np.asarray(success, dtype=bool)
+    return rewards, success
+
+
+#
+# formats
+# each relabels every episode of one file and returns {episode id: (rewards, success)}
+#
+
+
+def _save(path, write):
+    """write to a tmp file then rename so readers never see half a file"""
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        write(f)
+    os.replace(tmp, path)
+
+
+def _infos(infos):
+    """VecRecord saves infos as a 0-d object array of a dict of lists"""
+    if isinstance(infos, np.ndarray) and infos.dtype == object and infos.ndim == 0:
+        infos = infos.item()
+    return infos if isinstance(infos, dict) else {}
+
+
+def _pt(path, specs, write):
+    data = torch.load(path, weights_only=False)
+    infos = _infos(data.get("infos"))
+    ep = {"obs": data["obs"], "next_obs": data.get("next_obs"), "rewards": data["rewards"], "infos": infos}
+    rewards, success = relabel_episode(ep, specs)
+
+    if write:
+        data["rewards"] = rewards
+        if success is not None:
+            infos["success"] = success.tolist()
+            data["infos"] = np.array(infos)
+        _save(path, lambda f: torch.save(data, f))
+    return {osp.splitext(osp.basename(path))[0]: (rewards, success)}
+
+
+def _h5(path, specs, write):
+    import h5py
+
+    def read(h):
+        if isinstance(h, h5py.Group):
+            return {k: read(v) for k, v in h.items()}
+        return h[()]
+
+    out = {}
+    with h5py.File(path, "r+" if write else "r", libver="latest") as f:
+        for name in [k for k in f.keys() if k != "dataset_info"]:
+            steps = f[name]["steps"]
+            steps = [steps[k] for k in sorted(steps.keys(), key=lambda x: int(x.split("_")[1]))]
+            obs = du.stack([{k: s["observation"][k][()] for k in OBS_KEYS if k in s["observation"]} for s in steps], force=True)
+            infos = du.stack([read(s["info"]) for s in steps], force=True)
+            # only the obs that conditioned each action is stored, the last step reuses it
+            next_obs = {k: np.concatenate([v[1:], v[-1:]]) for k, v in obs.items()}
+            rewards = np.array([s["reward"][()] for s in steps])
+
+            ep = {"obs": obs, "next_obs": next_obs, "rewards": rewards, "infos": infos}
+            recorded = rewards, infos.get("success")
+            rewards, success = relabel_episode(ep, specs)
+
+            # no next obs for the last step, keep what the env recorded there
+            rewards[-1] = recorded[0][-1]
+            if success is not None and recorded[1] is not None:
+                success[-1] = bool(np.asarray(recorded[1])[-1])
+            out[f"{osp.basename(path)}:{name}"] = (rewards, success)
+
+            if write:
+                # the last step, and so the dataset_info summary, stay as recorded
+                for i, s in enumerate(steps[:-1]):
+                    s["reward"][()] = rewards[i]
+                    if success is not None and "success" in s["info"]:
+                        s["info"]["success"][()] = success[i]
+    return out
+
+
+DECODE = {
+    "pt": lambda b: torch.load(io.BytesIO(b), weights_only=False),
+    "npz": lambda b: np.load(io.BytesIO(b), allow_pickle=True)["arr_0"],
+    "npy": lambda b: np.load(io.BytesIO(b), allow_pickle=True),
+    "json": lambda b: json.loads(b),
+}
+
+
+def _encode(ext, x):
+    buf = io.BytesIO()
+    if ext == "pt":
+        torch.save(x, buf)
+    elif ext == "npz":
+        np.savez(buf, x)
+    elif ext == "npy":
+        np.save(buf, x)
+    else:
+        buf.write(json.dumps(x, default=lambda o: np.asarray(o).tolist()).encode())
+    return buf.getvalue()
+
+
+def _holder(fields, key):
+    """field that holds key, a member of its own or a key of a decoded dict like state.pt"""
+    if key in fields:
+        return key, fields
+    for field, v in fields.items():
+        if isinstance(v, dict) and key in v:
+            return field, v
+    return None, None
+
+
+def _tar_episode(fields, specs):
+    """relabels the decoded members of one sample, returns the fields it changed"""
+
+    view = du.nest({k: v for k, v in fields.items() if not isinstance(v, bytes)}, delim=".")
+    state = view.get("state", view)  # lorax packs the lowdim episode into state.pt
+    obs = lambda k: {**view.get(k, {}), **state.get(k, {})}
+
+    rc_field, rc = _holder(fields, "rewards")
+    ic_field, ic = _holder(fields, "infos")
+    infos = _infos(ic["infos"]) if ic is not None else {}
+    ep = {"obs": obs("obs"), "next_obs": obs("next_obs"), "rewards": rc["rewards"], "infos": infos}
+    rewards, success = relabel_episode(ep, specs)
+
+    changed = {rc_field}
+    rc["rewards"] = rewards
+    if success is not None and ic is not None:
+        infos["success"] = success.tolist()
+        ic["infos"] = np.array(infos) if isinstance(ic["infos"], np.ndarray) else infos
+        changed.add(ic_field)
+    return rewards, success, changed
+
+
+def _tar(path, specs, write):
+    with tarfile.open(path) as tar:
+        members = [(m, tar.extractfile(m).read()) for m in tar.getmembers() if m.isfile()]
+
+    samples = {}
+    for m, b in members:
+        key, field = m.name.split(".", 1)
+        samples.setdefault(key, {})[field] = b
+
+    out, encoded = {}, {}
+    for key, sample in samples.items():
+        # videos stay bytes and are copied as they are
+        fields = {}
+        for name, b in sample.items():
+            field, ext = name.rsplit(".", 1)
+            fields[field] = DECODE[ext](b) if ext in DECODE else b
+
+        rewards, success, changed = _tar_episode(fields, specs)
+        out[f"{osp.basename(path)}:{key}"] = (rewards, success)
+        for name in sample:
+            field, ext = name.rsplit(".", 1)
+            if field in changed:
+                encoded[f"{key}.{name}"] = _encode(ext, fields[field])
+
+    if write:
+
+        def _write(f):
+            with tarfile.open(fileobj=f, mode="w") as tar:
+                for m, b in members:
+                    b = encoded.get(m.name, b)
+                    m.size = len(b)
+                    tar.addfile(m, io.BytesIO(b))
+
+        _save(path, _write)
+    return out
+
+
+FORMATS = {".pt": _pt, ".h5": _h5, ".tar": _tar}
+
+
+def find(paths):
+    """episode files under paths, like lorax.find_tarballs for every format"""
+    paths = [paths] if isinstance(paths, str) else paths
+    for p in paths:
+        if osp.isfile(p):
+            yield p
+            continue
+        for root, dirs, files in os.walk(p):
+            for file in sorted(files):
+                if osp.splitext(file)[1] in FORMATS:
+                    yield osp.join(root, file)
+
+
+def relabel(paths, specs, overlay=None):
+    """rewrites rewards and success flags of every episode under paths
+
+    :param specs: [(name, kwargs)] of REWARDS, see relabel_episode
+    :param overlay: npz path, relabeled there instead of in place
+    :returns: {episode id: (rewards, success)}
+    """
+
+    out = {}
+    for path in tqdm(list(find(paths)), desc="relabel", leave=False):
+        out.update(FORMATS[osp.splitext(path)[1]](path, specs, write=overlay is None))
+
+    if overlay is not None:
+        arrays = {f"{k}/rewards": r for k, (r, s) in out.items()}
+        arrays.update({f"{k}/success": s for k, (r, s) in out.items() if s is not None})
+        _save(overlay, lambda f: np.savez(f, specs=json.dumps(specs), **arrays))
+    return out
+
+
+def load_overlay(path):
+    """{episode id: {"rewards", "success"}} written by relabel(overlay=path)"""
+    with np.load(path) as f:
+        return du.nest({k: f[k] for k in f.files if k != "specs"}, delim="/")
+
+
+def overlaid(data, overlay, id):
+    """a VecRecord episode with its rewards and success from overlay, if it has them"""
+
+    if id not in overlay:
+        return data
+    data["rewards"] = overlay[id]["rewards"]
+    if "success" in overlay[id]:
+        infos = _infos(data["infos"])
+        infos["success"] = overlay[id]["success"].tolist()
+        data["infos"] = np.array(infos)
+    return data
+
+
+#
+# bench
+#
+
+
+def fake(root, n=100, length=60, seed=0):
+    """n VecRecord-like .pt episodes with the obs the reward functions read"""
+
+    rng = np.random.default_rng(seed)
+    os.makedirs(root, exist_ok=True)
+    for i in range(n):
+        pose = lambda: rng.normal(0, 0.1, (length, 7)).astype(np.float32)
+        obs = {"obj-pose": pose(), "eef-pose": pose()}
+        obs["obj-wrt-eef"] = R.wrt_eef(obs["obj-pose"], obs["eef-pose"])
+        infos = {"success": [False] * length, "is_grasped": rng.random(length) < 0.2}
+        data = {
+            "obs": obs,
+            "next_obs": obs,
+            "rewards": np.zeros(length),
+            "actions": rng.normal(size=(length, 7)),
+            "dones": np.eye(length)[-1],
+            "infos": np.array(du.apply(infos, lambda x: np.asarray(x).tolist())),
+        }
+        torch.save(data, osp.join(root, f"{i}.pt"))
+
+
+def main():
+    """sparse reach threshold ablation over stored episodes"""
+
+    root = osp.join("/tmp", "relabel")
+    fake(root)
+
+    results = {}
+    for thresh in [0.2, 0.1, 0.05]:
+        tic = time.time()
+        out = relabel(root, [("reach", {"thresh": thresh})], overlay=osp.join(root, f"reach-{thresh}.npz"))
+        results[thresh] = {
+            "episodes/sec": round(len(out) / (time.time() - tic)),
+            "success/step": round(float(np.mean([s.mean() for r, s in out.values()])), 3),
+        }
+    pprint(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""
+action-replay episodes, see ActionReplayWrapper
+
+    {id}.npz
+        meta        json: task, simpler.make kwargs, seed, reset options, cfg.env
+        actions     [n, 7] what the sim executed, in the dtype it got them
+        rewards, terminated, truncated  [n]
+        steps       [k] steps of the sim state checkpoints, 0 is the reset state
+        states      [k, d] base.get_state() at those steps
+
+an episode is a few KiB instead of n rendered frames. replay() resets with the
+seed and steps the actions, so images come back at any camera or resolution.
+materialize() does it for many episodes in a background pool and caches the frames
+as one memory-mapped .npy per episode, which readers load without decoding video
+"""
+
+import json
+import multiprocessing as mp
+import os
+import os.path as osp
+import time
+from pprint import pprint
+
+import numpy as np
+
+from improve.wrapper.simpler.action_replay import ARRAYS
+
+
+def load(path):
+    with np.load(path) as f:
+        ep = {k: f[k] for k in ARRAYS}
+        ep["meta"] = json.loads(str(f["meta"]))
+    return ep
+
+
+def make_replay_env(meta, camera_cfgs=None, render=None, rank=0):
+    """the recorded env without the training wrappers
+
+    :param camera_cfgs: maniskill2 camera overrides, ie: {"width": 320, "height": 256}
+    :param render: cfg.env.render, see improve.env.render
+    """
+
+    import simpler_env as simpler
+
+    from improve.env.render import renderer_kwargs
+
+    kwargs = dict(meta["make_kwargs"])
+    if camera_cfgs:
+        kwargs["camera_cfgs"] = camera_cfgs
+    if render is not None:
+        kwargs["renderer_kwargs"] = renderer_kwargs(render, rank)
+    return simpler.make(meta["task"], **kwargs)
+
+
+def replay(env, ep, camera=None, start=0, stop=None):
+    """frames of steps start..stop, each the image the action at that step saw, plus the last one
+    resumes from the latest checkpoint at or before start
+
+    :param camera: camera name, the robot's default camera if None
+    :returns: frames [stop - start + 1, H, W, 3], max abs sim state error at later checkpoints
+    """
+
+    from simpler_env.utils.env.observation_utils import \
+        get_image_from_maniskill2_obs_dict
+
+    meta, base = ep["meta"], env.unwrapped
+    stop = len(ep["actions"]) if stop is None else stop
+    image = lambda obs: get_image_from_maniskill2_obs_dict(env, obs, camera_name=camera)
+
+    obs, _ = env.reset(seed=meta["seed"], options=meta["options"])
+    k = np.searchsorted(ep["steps"], start, side="right") - 1
+    t = int(ep["steps"][k])
+    if t > 0:
+        base.set_state(ep["states"][k])
+        # drive targets are not part of the sim state, see ResetCache.restore
+        base.agent.controller.reset()
+        obs = base.get_obs()
+
+    checkpoints = {int(s): i for i, s in enumerate(ep["steps"])}
+    frames, drift = [], 0.0
+    for i in range(t, stop):
+        if i >= start:
+            frames.append(image(obs))
+        obs, *_ = env.step(ep["actions"][i])
+        if i + 1 in checkpoints:
+            drift = max(drift, float(np.abs(base.get_state() - ep["states"][checkpoints[i + 1]]).max()))
+    frames.append(image(obs))
+    return np.stack(frames), drift
+
+
+#
+# parallel re-rendering
+#
+
+_ENVS = {}  # per worker, one env per (task, make kwargs, camera cfgs)
+
+
+def _env(meta, camera_cfgs, render):
+    key = json.dumps([meta["task"], meta["make_kwargs"], camera_cfgs], sort_keys=True)
+    if key not in _ENVS:
+        rank = mp.current_process()._identity[0] - 1 if mp.current_process()._identity else 0
+        _ENVS[key] = make_replay_env(meta, camera_cfgs, render, rank)
+    return _ENVS[key]
+
+
+def _rerender(args):
+    path, out, camera, camera_cfgs, render = args
+    ep = load(path)
+    frames, drift = replay(_env(ep["meta"], camera_cfgs, render), ep, camera=camera)
+    if out is None:
+        return path, frames, drift
+    os.makedirs(osp.dirname(out), exist_ok=True)
+    tmp = out + ".tmp.npy"  # readers never see half a file
+    np.save(tmp, frames)
+    os.replace(tmp, out)
+    return path, out, drift
+
+
+def _cache_path(cache_dir, path):
+    return osp.join(cache_dir, osp.splitext(osp.basename(path))[0] + ".npy")
+
+
+def find(paths):
+    """episode files under paths"""
+    paths = [paths] if isinstance(paths, str) else paths
+    for p in paths:
+        if osp.isfile(p):
+            yield p
+            continue
+        for root, dirs, files in os.walk(p):
+            yield from (osp.join(root, f) for f in sorted(files) if f.endswith(".npz"))
+
+
+def _pool(workers):
+    # sapien and vulkan do not survive a fork
+    return mp.get_context("spawn").Pool(workers)
+
+
+def rerender(paths, camera=None, size=None, render=None, workers=4):
+    """frames of every episode, rendered in parallel
+
+    :param size: (width, height) of every camera, recorded size if None
+    :returns: {path: (frames, drift)}
+    """
+
+    camera_cfgs = {"width": size[0], "height": size[1]} if size else None
+    jobs = [(p, None, camera, camera_cfgs, render) for p in find(paths)]
+    with _pool(workers) as pool:
+        return {p: (frames, drift) for p, frames, drift in pool.imap(_rerender, jobs)}
+
+
+def materialize(paths, cache_dir, camera=None, size=None, render=None, workers=4):
+    """writes the frames of every uncached episode to cache_dir in a background pool
+
+    :returns: AsyncResult, .wait() or .get() for [(path, npy, drift)]
+    """
+
+    camera_cfgs = {"width": size[0], "height": size[1]} if size else None
+    jobs = [
+        (p, _cache_path(cache_dir, p), camera, camera_cfgs, render)
+        for p in find(paths)
+        if not osp.exists(_cache_path(cache_dir, p))
+    ]
+    pool = _pool(workers)
+    result = pool.map_async(_rerender, jobs)
+    pool.close()  # workers exit once the jobs are done
+    return result
+
+
+def frames(path, cache_dir=None, camera=None, size=None, render=None):
+    """frames of one episode, memory-mapped from cache_dir when materialized"""
+
+    if cache_dir is not None and osp.exists(_cache_path(cache_dir, path)):
+        return np.load(_cache_path(cache_dir, path), mmap_mode="r")
+    camera_cfgs = {"width": size[0], "height": size[1]} if size else None
+    return _rerender((path, None, camera, camera_cfgs, render))[1]
+
+
+#
+# bench
+#
+
+
+import hydra
+import improve
+import improve.hydra.resolver
+
+
+@hydra.main(config_path=improve.CONFIG, config_name="config", version_base="1.3.2")
+def main(cfg):
+    """records random episodes, then checks replay against the recorded frames
+    and compares storage and re-render throughput
+    """
+
+    from improve.env import make_env
+
+    cfg.env.replay.record, cfg.env.replay.dir = True, osp.join("/tmp", "replay")
+    env = make_env(cfg, max_episode_steps=cfg.env.max_episode_steps)()
+    # base.get_obs has no images once the obs cache defers rendering (default obs_keys)
+    cache = env.get_wrapper_attr("obs_cache")
+    image = lambda: np.array(cache.image(), copy=True)
+
+    recorded = []
+    for seed in range(4):
+        env.reset(seed=seed)
+        images, done = [image()], False
+        while not done:
+            _, _, terminated, truncated, _ = env.step(env.action_space.sample())
+            images.append(image())
+            done = terminated or truncated
+        recorded.append(np.stack(images))
+    env.close()
+
+    paths = sorted(find(cfg.env.replay.dir))[-len(recorded) :]
+    tic = time.time()
+    out = rerender(paths, render=cfg.env.render, workers=2)
+    elapsed = time.time() - tic
+
+    replayed = [out[p][0] for p in paths]
+    nframes = sum(len(f) for f in replayed)
+    results = {
+        "episodes": len(paths),
+        "replay KiB/episode": sum(osp.getsize(p) for p in paths) / len(paths) / 2**10,
+        "image KiB/episode": sum(f.nbytes for f in replayed) / len(paths) / 2**10,
+        "frames/sec": nframes / elapsed,
+        "max drift": max(d for _, d in out.values()),
+        "max pixel diff": max(int(np.abs(a.astype(int) - b).max()) for a, b in zip(recorded, replayed)),
+    }
+    pprint(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+"""
+pre-decoded training shards for octo finetuning
+
+    root/
+        index.json              shard lengths, episode starts, horizon, task names
+        embeds.npy              [tasks, D] task embeddings
+        shard-00000/
+            image_primary.npy   [n, 256, 256, 3] uint8, already resized
+            action.npy          [n, horizon, 7] future actions
+            value.npy           [n, horizon, 1] future mc values
+            task.npy            [n] int32 row of embeds.npy
+        ...
+
+every .npy is memory-mapped by ShardDataset so random access never decodes video
+"""
+
+import json
+import os
+import os.path as osp
+import time
+from pprint import pprint
+
+import numpy as np
+from tqdm import tqdm
+
+from improve.data import episode
+
+KEYS = ["image_primary", "action", "value", "task"]
+
+
+def resize(image, size=(256, 256)):
+    """same lanczos3 resize as lora_octo._resize_image"""
+
+    import tensorflow as tf
+
+    image = tf.image.resize(image, size=size, method="lanczos3", antialias=True)
+    return tf.cast(tf.clip_by_value(tf.round(image), 0, 255), tf.uint8).numpy()
+
+
+def _save(path, arr):
+    """write to a tmp file then rename so readers never see half a shard"""
+    tmp = path + ".tmp.npy"
+    np.save(tmp, arr)
+    os.replace(tmp, path)
+
+
+class ShardWriter:
+    """buffers episodes and flushes them into shards of about chunk steps
+    episodes never cross shard boundaries
+
+    :param root: output directory
+    :param horizon: future action/value window
+    :param chunk: steps per shard
+    """
+
+    def __init__(self, root, horizon=5, gamma=0.99, chunk=2048):
+        self.root = root
+        self.horizon = horizon
+        self.gamma = gamma
+        self.chunk = chunk
+        os.makedirs(root, exist_ok=True)
+
+        self.tasks, self.embeds = [], []
+        self.shards = []  # {"name", "length", "starts"}
+        self.buffer, self.nbuffer = [], 0
+
+    def task_id(self, task, embed):
+        if task not in self.tasks:
+            self.tasks.append(task)
+            self.embeds.append(np.asarray(embed, dtype=np.float32).reshape(-1))
+        return self.tasks.index(task)
+
+    def add(self, image, action, reward, task, embed):
+        """adds one episode
+
+        :param image: [n, H, W, 3] frames, resized here if they are not 256x256
+        :param action: [n, 7]
+        :param reward: [n]
+        :param embed: task embedding, stored once per task
+        """
+
+        if image.shape[1:3] != (256, 256):
+            image = resize(image)
+
+        n = len(image)
+        value = episode.mc_values(reward, self.gamma)[:, None]
+        ep = {
+            "image_primary": np.asarray(image, dtype=np.uint8),
+            "action": episode.future(action, self.horizon).astype(np.float32),
+            "value": episode.future(value, self.horizon).astype(np.float32),
+            "task": np.full(n, self.task_id(task, embed), dtype=np.int32),
+        }
+
+        if self.nbuffer and self.nbuffer + n > self.chunk:
+            self.flush()
+        self.buffer.append(ep)
+        self.nbuffer += n
+
+    def flush(self):
+        if not self.buffer:
+            return
+
+        name = f"shard-{len(self.shards):05d}"
+        os.makedirs(osp.join(self.root, name), exist_ok=True)
+        for k in KEYS:
+            arr = np.concatenate([ep[k] for ep in self.buffer])
+            _save(osp.join(self.root, name, f"{k}.npy"), arr)
+
+        lengths = [len(ep["task"]) for ep in self.buffer]
+        starts = np.cumsum([0] + lengths[:-1]).tolist()
+        self.shards.append({"name": name, "length": self.nbuffer, "starts": starts})
+        self.buffer, self.nbuffer = [], 0
+
+    def close(self):
+        """flushes the last shard then writes embeds and the index"""
+
+        self.flush()
+        _save(osp.join(self.root, "embeds.npy"), np.stack(self.embeds))
+
+        index = {
+            "horizon": self.horizon,
+            "gamma": self.gamma,
+            "tasks": self.tasks,
+            "shards": self.shards,
+        }
+        tmp = osp.join(self.root, "index.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp, osp.join(self.root, "index.json"))
+
+
+class ShardDataset:
+    """random access over pre-decoded shards
+
+    a sample is a window of consecutive frames from one episode
+    with the future actions and values of its first step, like octo_dataset
+
+    :param root: directory written by ShardWriter
+    :param window: observation history length
+    """
+
+    def __init__(self, root, window=2):
+        self.root = root
+        self.window = window
+
+        with open(osp.join(root, "index.json"), "r") as f:
+            self.index = json.load(f)
+        self.embeds = np.load(osp.join(root, "embeds.npy"))
+
+        self.shards = [
+            {k: np.load(osp.join(root, s["name"], f"{k}.npy"), mmap_mode="r") for k in KEYS}
+            for s in self.index["shards"]
+        ]
+
+        # (shard, step) of every valid window start
+        self.starts = []
+        for i, s in enumerate(self.index["shards"]):
+            ends = s["starts"][1:] + [s["length"]]
+            for start, end in zip(s["starts"], ends):
+                steps = np.arange(start, end - window + 1)
+                self.starts.append(np.stack([np.full_like(steps, i), steps], -1))
+        self.starts = np.concatenate(self.starts)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def get(self, idx):
+        """batch of samples for an array of indices"""
+
+        idx = np.asarray(idx)
+        shard, step = self.starts[idx].T
+        window = np.arange(self.window)
+
+        out = {k: [] for k in KEYS}
+        order = []
+        for i in np.unique(shard):
+            mask = shard == i
+            s, t = self.shards[i], step[mask]
+            # one fancy-index gather per shard
+            out["image_primary"].append(s["image_primary"][t[:, None] + window])
+            out["action"].append(s["action"][t])
+            out["value"].append(s["value"][t])
+            out["task"].append(s["task"][t])
+            order.append(np.nonzero(mask)[0])
+
+        # restore the requested order
+        inv = np.argsort(np.concatenate(order))
+        out = {k: np.concatenate(v)[inv] for k, v in out.items()}
+
+        return {
+            "observation": {
+                "image_primary": out["image_primary"],
+                "pad_mask": np.ones((len(idx), self.window), dtype=np.int32),
+            },
+            "task": {"language_instruction": self.embeds[out["task"]]},
+            "action": out["action"],
+            "value": out["value"],
+        }
+
+    def __getitem__(self, i):
+        return episode.take(self.get([i]), 0)
+
+    def batches(self, batch_size, seed=0):
+        """infinite iterator of uniformly sampled batches"""
+
+        rng = np.random.default_rng(seed)
+        while True:
+            yield self.get(np.sort(rng.integers(0, len(self), batch_size)))
+
+
+def convert(fnames, root, task, horizon=5, gamma=0.99, chunk=2048):
+    """one-shot conversion of recorded webdataset tarballs into shards
+
+    :param fnames: tarballs, see data.lorax.find_tarballs
+    :param task: simpler task name, used for the task embedding
+    """
+
+    import webdataset as wds
+
+    from improve.data.lorax import preprocess
+    from improve.fm.cache import load_task_embedding
+
+    dataset = wds.DataPipeline(
+        wds.SimpleShardList(fnames),
+        wds.tarfile_to_samples(),
+        wds.decode(),
+        wds.map(preprocess),
+    )
+
+    embed = load_task_embedding(task)
+    writer = ShardWriter(root, horizon=horizon, gamma=gamma, chunk=chunk)
+    for obs, _, actions, rewards, _, _ in tqdm(dataset, desc="convert"):
+        writer.add(obs["simpler-img"], actions, rewards, task, embed)
+    writer.close()
+
+
+def bench(fnames, root, batch_size=8, nsamples=2000):
+    """samples/sec of the decode + resize path vs random access shards"""
+
+    import webdataset as wds
+
+    from improve.data.lorax import preprocess
+
+    results = {}
+
+    dataset = wds.DataPipeline(
+        wds.SimpleShardList(fnames),
+        wds.tarfile_to_samples(),
+        wds.decode(),
+        wds.map(preprocess),
+    )
+    n, tic = 0, time.time()
+    for obs, _, actions, rewards, _, _ in dataset:
+        resize(obs["simpler-img"])
+        episode.split((actions, rewards))
+        n += len(actions)
+        if n >= nsamples:
+            break
+    results["decode"] = n / (time.time() - tic)
+
+    ds = ShardDataset(root)
+    batches = ds.batches(batch_size)
+    tic = time.time()
+    for _ in range(nsamples // batch_size):
+        next(batches)
+    results["shards"] = nsamples / (time.time() - tic)
+
+    pprint({k: f"{v:.0f} samples/sec" for k, v in results.items()})
+    return results
+
+
+def main():
+
+    from improve.data.lorax import find_tarballs
+
+    HOME = os.environ["HOME"]
+    dataset = ["sunny-eon-12"]
+    task = "widowx_put_eggplant_in_basket"
+    exp_root = [osp.join(HOME, "improve_logs", x) for x in dataset]
+
+    dnames = [osp.join(e, "train") for e in exp_root]
+    fnames = list(find_tarballs(dnames))
+    root = osp.join(exp_root[0], "shards")
+
+    convert(fnames, root, task)
+    bench(fnames, root)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+"""
+streaming dataset statistics for action and observation normalization
+
+one pass over hdf5, .pt and webdataset episodes, parallel over files
+per key: count, mean, std (welford with chan's merge), min, max
+and quantiles from a mergeable reservoir sketch
+
+the result is a versioned json that loaders and LinearNormalizer.fit_stats read
+so normalization is never refit or hardcoded per run
+
+    {
+        "version": 1,
+        "hash": sha1 of the source files, their sizes and mtimes,
+        "sources": [...],
+        "quantiles": [0.01, ...],
+        "stats": {"action": {"count", "mean", "std", "min", "max", "quantiles"}, ...},
+    }
+"""
+
+import hashlib
+import io
+import json
+import os
+import os.path as osp
+import time
+from datetime import datetime
+from multiprocessing import Pool
+from pprint import pprint
+
+import numpy as np
+from tqdm import tqdm
+
+from improve.wrapper import dict_util as du
+
+VERSION = 1
+QUANTILES = [0.01, 0.05, 0.5, 0.95, 0.99]
+
+# released octo dataset statistics, these used to be pasted into every loader
+OCTO = {
+    "bridge_dataset": {
+        "action": {
+            "mean": [
+                0.00021161,
+                0.00012614,
+                -0.00017022,
+                -0.00015062,
+                -0.00023831,
+                0.00025646,
+                0.0,
+            ],
+            "std": [
+                0.00963721,
+                0.0135066,
+                0.01251861,
+                0.02806791,
+                0.03016905,
+                0.07632624,
+                1.0,
+            ],
+        }
+    },
+    "fractal20220817_data": {
+        "action": {
+            "mean": [
+                0.00696389,
+                0.00627008,
+                -0.01263256,
+                0.04330839,
+                -0.00570499,
+                0.00089247,
+                0.0,
+            ],
+            "std": [
+                0.06925472,
+                0.06019009,
+                0.07354742,
+                0.15605888,
+                0.1316399,
+                0.14593437,
+                1.0,
+            ],
+        }
+    },
+}
+
+
+class RunningStats:
+    """mergeable per-dimension statistics of [n, ...] batches
+    dims are the trailing last_n_dims, like LinearNormalizer.fit
+
+    :param sketch: reservoir rows kept for quantiles
+    """
+
+    def __init__(self, last_n_dims=1, sketch=4096, seed=0):
+        self.last_n_dims = last_n_dims
+        self.sketch = sketch
+        self.rng = np.random.default_rng(seed)
+
+        self.n = 0
+        self.mean = self.m2 = self.min = self.max = None
+        self.reservoir = None
+
+    def _rows(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        shape = x.shape[1:]  # per sample, scalars like rewards are one dim
+        dim = int(np.prod(shape[len(shape) - self.last_n_dims :])) if self.last_n_dims else 1
+        return x.reshape(-1, dim)
+
+    def update(self, x):
+        """adds a batch with samples on the first axis"""
+
+        x = self._rows(x)
+        if not len(x):
+            return self
+
+        other = RunningStats(self.last_n_dims, self.sketch)
+        other.n = len(x)
+        other.mean = x.mean(0)
+        other.m2 = ((x - other.mean) ** 2).sum(0)
+        other.min, other.max = x.min(0), x.max(0)
+        keep = self.rng.choice(len(x), min(len(x), self.sketch), replace=False)
+        other.reservoir = x[keep]
+        return self.merge(other)
+
+    def merge(self, other):
+        """chan et al. parallel update, reservoirs are resampled by the counts they stand for"""
+
+        if other.n == 0:
+            return self
+        if self.n == 0:
+            self.n, self.mean, self.m2 = other.n, other.mean, other.m2
+            self.min, self.max, self.reservoir = other.min, other.max, other.reservoir
+            return self
+
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.n / n
+        self.m2 = self.m2 + other.m2 + delta**2 * self.n * other.n / n
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+
+        rows = np.concatenate([self.reservoir, other.reservoir])
+        if len(rows) > self.sketch:
+            w = np.concatenate(
+                [
+                    np.full(len(self.reservoir), self.n / len(self.reservoir)),
+                    np.full(len(other.reservoir), other.n / len(other.reservoir)),
+                ]
+            )
+            keep = self.rng.choice(len(rows), self.sketch, replace=False, p=w / w.sum())
+            rows = rows[keep]
+        self.reservoir = rows
+        self.n = n
+        return self
+
+    @property
+    def std(self):
+        return np.sqrt(self.m2 / max(self.n, 1))
+
+    def quantile(self, q):
+        return np.quantile(self.reservoir, q, axis=0)
+
+    def todict(self, quantiles=QUANTILES):
+        return {
+            "count": self.n,
+            "mean": self.mean.tolist(),
+            "std": self.std.tolist(),
+            "min": self.min.tolist(),
+            "max": self.max.tolist(),
+            "quantiles": {str(q): self.quantile(q).tolist() for q in quantiles},
+        }
+
+
+#
+# sources, each yields episodes as flat {key: [n, ...]} dicts
+#
+
+
+def _numeric(ep):
+    ep = du.flatten(ep, delim="/")
+    ep = {k: np.asarray(v) for k, v in ep.items() if v is not None}
+    return {
+        k: v
+        for k, v in ep.items()
+        if v.ndim and (np.issubdtype(v.dtype, np.number) or v.dtype == bool)
+    }
+
+
+def _rename(ep):
+    """one name per quantity whatever the recorder called it"""
+    names = {"actions": "action", "rewards": "reward", "dones": "done"}
+    skip = ("next_obs/", "infos", "info/")
+    ep = {k: v for k, v in ep.items() if not k.startswith(skip)}
+    return {names.get(k, k).replace("observation/", "obs/"): v for k, v in ep.items()}
+
+
+def pt_episodes(fname):
+    """episodes saved by wandb.record as torch .pt"""
+    import torch
+
+    ep = torch.load(fname, weights_only=False)
+    yield _rename(_numeric(du.apply_mappable(ep, _tonumpy)))
+
+
+def wds_episodes(fname):
+    """recorded webdataset tarballs, only the .pt state is read, videos are skipped"""
+    import torch
+    import webdataset as wds
+
+    for sample in wds.DataPipeline(wds.SimpleShardList([fname]), wds.tarfile_to_samples()):
+        for k, v in sample.items():
+            if k.endswith("state.pt"):
+                ep = torch.load(io.BytesIO(v), weights_only=False)
+                yield _rename(_numeric(du.apply_mappable(ep, _tonumpy)))
+
+
+def hdf5_episodes(fname):
+    """episodes written by HDF5LoggerWrapper, ep_*/steps/step_i/..."""
+    import h5py
+
+    with h5py.File(fname, "r") as f:
+        for name, group in f.items():
+            if not name.startswith("ep_"):
+                continue
+            steps = group["steps"]
+            order = sorted(steps.keys(), key=lambda s: int(s.split("_")[-1]))
+            ep = {}
+
+            def _append(k, v):
+                if isinstance(v, h5py.Dataset):
+                    ep.setdefault(k, []).append(v[()])
+
+            for s in order:
+                steps[s].visititems(_append)
+            # keys missing from some steps (ie: final infos) are dropped
+            ep = {k: np.stack(v) for k, v in ep.items() if len(v) == len(order)}
+            yield _rename(_numeric(ep))
+
+
+def _tonumpy(x):
+    return x.numpy() if hasattr(x, "numpy") else x
+
+
+SOURCES = {".pt": pt_episodes, ".tar": wds_episodes, ".h5": hdf5_episodes, ".hdf5": hdf5_episodes}
+
+
+def episodes(fname):
+    return SOURCES[osp.splitext(fname)[-1]](fname)
+
+
+#
+# job
+#
+
+
+def _file_stats(args):
+    fname, keys, sketch = args
+    out = {}
+    for ep in episodes(fname):
+        for k, v in ep.items():
+            if keys is None or k in keys:
+                out.setdefault(k, RunningStats(sketch=sketch)).update(v)
+    return out
+
+
+def compute(fnames, keys=None, workers=4, sketch=4096):
+    """statistics of every key over all episodes in fnames
+
+    :param keys: only these flat keys, ie: ["action", "obs/agent/qpos"]. None is all
+    :returns: {key: RunningStats}
+    """
+
+    stats = {}
+    jobs = [(f, keys, sketch) for f in fnames]
+    with Pool(workers) as pool:
+        for out in tqdm(pool.imap_unordered(_file_stats, jobs), total=len(jobs)):
+            for k, s in out.items():
+                stats[k] = stats[k].merge(s) if k in stats else s
+    return stats
+
+
+def source_hash(fnames):
+    h = hashlib.sha1()
+    for f in sorted(fnames):
+        st = os.stat(f)
+        h.update(f"{f}:{st.st_size}:{st.st_mtime_ns}".encode())
+    return h.hexdigest()
+
+
+def write(stats, path, fnames, quantiles=QUANTILES):
+    """atomic write of the versioned stats file"""
+
+    out = {
+        "version": VERSION,
+        "hash": source_hash(fnames),
+        "created": datetime.now().isoformat(),
+        "sources": sorted(fnames),
+        "quantiles": quantiles,
+        "stats": {k: s.todict(quantiles) for k, s in sorted(stats.items())},
+    }
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(out, f)
+    os.replace(tmp, path)
+    return out
+
+
+def load(path):
+    """{key: {"mean", "std", "min", "max", "quantiles": {q: ...}}} as float32 arrays"""
+
+    with open(path, "r") as f:
+        out = json.load(f)
+    assert out["version"] == VERSION, f"stats version {out['version']} != {VERSION}"
+
+    def _arr(x):
+        return np.asarray(x, dtype=np.float32) if isinstance(x, list) else x
+
+    return {k: du.apply_mappable(v, _arr) for k, v in out["stats"].items()}
+
+
+def octo(dataset_id):
+    """released octo statistics in the same layout as load()"""
+    if dataset_id not in OCTO:
+        msg = f"{dataset_id} not supported yet for custom octo model checkpoints."
+        raise NotImplementedError(msg)
+    return du.apply_mappable(OCTO[dataset_id], lambda x: np.array(x))
+
+
+def main():
+    """stats for the recorded rollouts, then parity against an in-memory pass"""
+
+    from improve.data.lorax import find_tarballs
+
+    HOME = os.environ["HOME"]
+    dataset = ["sunny-eon-12"]
+    exp_root = [osp.join(HOME, "improve_logs", x) for x in dataset]
+    fnames = list(find_tarballs([osp.join(e, "train") for e in exp_root]))
+
+    tic = time.time()
+    stats = compute(fnames)
+    path = osp.join(exp_root[0], f"stats-v{VERSION}.json")
+    write(stats, path, fnames)
+    print(f"{len(fnames)} files in {time.time() - tic:.1f}s -> {path}")
+
+    actions = np.concatenate([ep["action"] for f in fnames for ep in episodes(f)])
+    s = load(path)["action"]
+    pprint({"mean": np.abs(s["mean"] - actions.mean(0)).max(), "std": np.abs(s["std"] - actions.std(0)).max()})
+
+
+if __name__ == "__main__":
+    main()
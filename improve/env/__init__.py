@@ -1,12 +1,18 @@
 import os.path as osp
 
 import gymnasium as gym
+from omegaconf import OmegaConf as OC
 import simpler_env as simpler
 from stable_baselines3.common.vec_env import (DummyVecEnv, SubprocVecEnv,
                                               VecMonitor, VecVideoRecorder)
 import improve.wrapper as W  # TODO add all the wrappers to wrapper.__init__.py
 
 from improve.env.action_rescale import ActionRescaler
+from improve.env.async_vec import AsyncVecEnv
+from improve.env.multi_scene import make_multi_scene
+from improve.env.pipelined import PipelinedVecEnv
+from improve.env.render import renderer_kwargs
+from improve.wrapper.seed_scheduler import SeedScheduler, SeedScheduleVecEnv
 
 MULTI_OBJ_ENVS = [
     "google_robot_move_near_v0",
@@ -33,7 +39,11 @@ class ContinuousTaskWrapper(gym.Wrapper):
         return ob, rew, False, truncated, info
 
 
-def make_env(cfg, max_episode_steps: int = None, record_dir: str = None):
+def make_env(cfg, max_episode_steps: int = None, record_dir: str = None, rank: int = 0):
+    """
+    :param rank: worker index, places the renderer, see improve.env.render
+    """
+
     def _init() -> gym.Env:
         # NOTE: Import envs here so that they are registered with gym in subprocesses
         # import mani_skill2.envs
@@ -45,17 +55,25 @@ def make_env(cfg, max_episode_steps: int = None, record_dir: str = None):
         if cfg.env.task == "google_robot_pick_horizontal_coke_can":
             extra["success_from_episode_stats"] = False
 
+        # cant find simpler-img if you specify the mode
+        kwargs = dict(render_mode="cameras", max_episode_steps=max_episode_steps, **extra)
         env = simpler.make(
             cfg.env.foundation.task,
-            # cant find simpler-img if you specify the mode
-            render_mode="cameras",
-            max_episode_steps=max_episode_steps,
-            renderer_kwargs={
-                "offscreen_only": True,
-                "device": "cuda:0",
-            },
-            **extra,
+            renderer_kwargs=renderer_kwargs(cfg.env.render, rank),
+            **kwargs,
         )
+        # innermost so images and poses are computed once per step
+        env = W.ObsCacheWrapper(env)
+
+        if cfg.env.replay.record:  # sees the actions the sim executes
+            env = W.ActionReplayWrapper(
+                env,
+                root=cfg.env.replay.dir,
+                task=cfg.env.foundation.task,
+                make_kwargs=kwargs,
+                every=cfg.env.replay.every,
+                config=OC.to_container(cfg.env, resolve=True),
+            )
 
         if cfg.algo.name == "awac" or cfg.env.foundation.name is None:
             env = W.ActionRescaleWrapper(env)
@@ -74,6 +92,8 @@ def make_env(cfg, max_episode_steps: int = None, record_dir: str = None):
                     ckpt=cfg.env.foundation.ckpt,
                     residual_scale=cfg.env.residual_scale,
                     strategy=cfg.env.scale_strategy,
+                    compile_cache=cfg.env.foundation.compile_cache,
+                    warmup=cfg.env.foundation.warmup,
                 )
 
             if cfg.env.action_mask_dims:
@@ -95,9 +115,9 @@ def make_env(cfg, max_episode_steps: int = None, record_dir: str = None):
 
         if cfg.env.seed.force:
             if cfg.env.seed.seeds is not None:
-                env = W.ForceSeedWrapper(env, seeds=cfg.env.seed.seeds, verbose=True)
+                env = W.ForceSeedWrapper(env, seeds=cfg.env.seed.seeds, verbose=True, cache=cfg.env.seed.cache)
             else:
-                env = W.ForceSeedWrapper(env, seed=cfg.env.seed.value, verbose=True)
+                env = W.ForceSeedWrapper(env, seed=cfg.env.seed.value, verbose=True, cache=cfg.env.seed.cache)
 
         env = W.FlattenKeysWrapper(env)
         if cfg.env.obs_keys:
@@ -157,11 +177,29 @@ def make_envs(cfg, log_dir, eval_only=False, num_envs=1, max_episode_steps=60):
     record_dir = osp.join(log_dir, f"videos/{suffix}") if cfg.job.wandb.use else None
 
     if cfg.env.foundation.name is None or cfg.env.fm_loc.value == "central":
-        venv = SubprocVecEnv(
-            [make_env(cfg, record_dir=record_dir) for _ in range(num_envs)]
-        )
+        # scenes of a multi-scene worker share its renderer
+        fns = [
+            make_env(cfg, record_dir=record_dir, rank=i // cfg.env.scenes)
+            for i in range(num_envs)
+        ]
+        if cfg.env.scenes > 1:  # scenes per process, shares renderer and model
+            venv = make_multi_scene(fns, cfg.env.scenes)
+        elif cfg.env.recv_batch:  # off-policy collection does not wait on stragglers
+            assert not cfg.env.pipeline, "recv_batch and pipeline do not combine"
+            assert not cfg.env.seed.schedule.use and not cfg.env.record, "vec env wrappers do not see async steps"
+            venv = AsyncVecEnv(fns, batch_size=cfg.env.recv_batch)
+        elif cfg.env.pipeline:  # terminal steps do not wait on the reset
+            venv = PipelinedVecEnv(fns)
+        else:
+            venv = SubprocVecEnv(fns)
         venv = VecMonitor(venv)  # attach this so SB3 can log reward metrics
 
+        if cfg.env.seed.schedule.use:  # next to VecMonitor for the episode returns
+            assert cfg.env.seed.force and cfg.env.seed.seeds is not None, "scheduling needs env.seed.force and env.seed.seeds"
+            schedule = OC.to_container(cfg.env.seed.schedule, resolve=True)
+            del schedule["use"]
+            venv = SeedScheduleVecEnv(venv, SeedScheduler(cfg.env.seed.seeds, seed=cfg.job.seed, **schedule))
+
         venv.seed(cfg.job.seed)
         venv.reset()
 
@@ -0,0 +1,197 @@
+"""
+straggler tolerant vec env for off-policy collection, like envpool's send / recv
+
+SubprocVecEnv.step_wait blocks on every worker, so one slow worker (a reset, a long
+contact solve, a video flush) stalls all 16. off-policy algos do not need the
+transitions of one step together. AsyncVecEnv.recv returns the first M of the
+N workers that are done, tagged with their env ids, and send steps only those
+
+    env.send(actions, env_ids)
+    obs, rewards, dones, infos, env_ids = env.recv()
+
+send / recv go around VecEnvWrappers, so episode stats are kept here like VecMonitor.
+step_async / step_wait still work for evaluation, they drop the steps in flight
+"""
+
+import multiprocessing as mp
+import time
+from collections import OrderedDict
+from pprint import pprint
+
+import numpy as np
+from stable_baselines3.common.vec_env import SubprocVecEnv
+
+
+def _stack(obs):
+    if isinstance(obs[0], dict):
+        return OrderedDict([(k, np.stack([o[k] for o in obs])) for k in obs[0]])
+    return np.stack(obs)
+
+
+class AsyncVecEnv(SubprocVecEnv):
+    """
+    :param env_fns: one env fn per worker
+    :param batch_size: M, envs returned by recv, num_envs is a plain SubprocVecEnv
+    """
+
+    def __init__(self, env_fns, batch_size=None, start_method=None):
+        super().__init__(env_fns, start_method)
+        self.batch_size = batch_size or self.num_envs
+        assert 0 < self.batch_size <= self.num_envs, f"batch_size must be in [1, {self.num_envs}]"
+
+        self.busy = np.zeros(self.num_envs, dtype=bool)  # sent, not returned by recv yet
+        self.sent = np.zeros(self.num_envs, dtype=np.int64)  # send order, oldest first in recv
+        self.stash = {}  # replies read early, ie: to make room for env_method
+        self.count = 0
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self.returns = np.zeros(self.num_envs, dtype=np.float32)
+        self.lengths = np.zeros(self.num_envs, dtype=np.int32)
+        self.tstart = time.time()
+
+    def send(self, actions, env_ids):
+        for action, i in zip(actions, env_ids):
+            assert not self.busy[i], f"env {i} is already stepping"
+            self.remotes[i].send(("step", action))
+            self.busy[i] = True
+            self.sent[i] = self.count
+            self.count += 1
+
+    def _pull(self, i):
+        """reads the step reply of env i into the stash"""
+        if self.busy[i] and i not in self.stash:
+            self.stash[i] = self.remotes[i].recv()
+
+    def recv(self, batch_size=None):
+        """the first batch_size envs to finish their step, fewer if not that many are stepping
+
+        :returns: obs, rewards, dones, infos, env_ids
+        """
+
+        n = min(batch_size or self.batch_size, int(self.busy.sum()))
+        waiting = {self.remotes[i]: i for i in np.flatnonzero(self.busy) if i not in self.stash}
+        while len(self.stash) < n:
+            for remote in mp.connection.wait(list(waiting)):
+                self._pull(waiting.pop(remote))
+
+        # oldest first so a fast worker does not starve the others
+        ids = sorted(self.stash, key=lambda i: self.sent[i])[:n]
+        results = [self.stash.pop(i) for i in ids]
+        self.busy[ids] = False
+
+        obs, rews, dones, infos = zip(*[r[:4] for r in results])
+        rews, dones, infos = np.array(rews, dtype=np.float32), np.array(dones), list(infos)
+        self.reset_infos = list(self.reset_infos)  # a tuple after reset and step_wait
+        for j, i in enumerate(ids):
+            if len(results[j]) > 4:  # sb3 >= 2.1 sends reset infos
+                self.reset_infos[i] = results[j][4]
+            self.returns[i] += rews[j]
+            self.lengths[i] += 1
+            if dones[j]:
+                t = round(time.time() - self.tstart, 6)
+                infos[j] = {**infos[j], "episode": {"r": self.returns[i], "l": self.lengths[i], "t": t}}
+                self.returns[i], self.lengths[i] = 0, 0
+        return _stack(obs), rews, dones, infos, np.array(ids)
+
+    def drain(self):
+        """waits for every step in flight and drops it, returns how many"""
+        for i in np.flatnonzero(self.busy):
+            self._pull(i)
+        n = len(self.stash)
+        self.stash = {}
+        self.busy[:] = False
+        return n
+
+    def step_async(self, actions):
+        self.drain()
+        super().step_async(actions)
+
+    def reset(self):
+        self.drain()
+        self._reset_stats()
+        return super().reset()
+
+    def close(self):
+        if not self.closed:
+            self.drain()
+        super().close()
+
+    def _get_target_remotes(self, indices):
+        # a reply in the pipe would be read as the answer to get_attr or env_method
+        for i in self._get_indices(indices):
+            self._pull(i)
+        return super()._get_target_remotes(indices)
+
+
+#
+# bench
+#
+
+
+def bench(make, n=500, batch_size=None, think=0.0):
+    """env steps per second and per call wait of a sync or async vec env
+
+    :param make: builds the vec env
+    :param n: step or recv calls timed
+    :param batch_size: M for AsyncVecEnv, None steps every env together
+    :param think: seconds the main process spends per call, ie: policy inference
+    """
+
+    venv = make()
+    venv.reset()
+    actions = np.stack([venv.action_space.sample() for _ in range(venv.num_envs)])
+
+    waits, steps = [], 0
+    tic = time.time()
+    if batch_size is None:
+        for _ in range(n):
+            time.sleep(think)
+            t = time.time()
+            venv.step(actions)
+            waits.append(time.time() - t)
+            steps += venv.num_envs
+    else:
+        venv.send(actions, np.arange(venv.num_envs))
+        for _ in range(n):
+            t = time.time()
+            *_, ids = venv.recv(batch_size)
+            waits.append(time.time() - t)
+            time.sleep(think)
+            venv.send(actions[ids], ids)
+            steps += len(ids)
+        venv.drain()
+    elapsed = time.time() - tic
+    venv.close()
+
+    waits = 1e3 * np.array(waits)
+    return {
+        "steps/sec": f"{steps / elapsed:.1f}",
+        "wait mean": f"{waits.mean():.1f}ms",
+        "wait std": f"{waits.std():.1f}ms",
+        "wait p99": f"{np.percentile(waits, 99):.1f}ms",
+    }
+
+
+import hydra
+import improve
+import improve.hydra.resolver
+
+
+@hydra.main(config_path=improve.CONFIG, config_name="config", version_base="1.3.2")
+def main(cfg):
+    """SubprocVecEnv vs AsyncVecEnv returning half and three quarters of the envs"""
+
+    from improve.env import make_env
+
+    n = cfg.env.n_envs
+    fns = lambda: [make_env(cfg, max_episode_steps=cfg.env.max_episode_steps) for _ in range(n)]
+
+    results = {"subproc": bench(lambda: SubprocVecEnv(fns()))}
+    for m in [n // 2, 3 * n // 4]:
+        results[f"async {m}/{n}"] = bench(lambda: AsyncVecEnv(fns(), batch_size=m), batch_size=m)
+    pprint(results)
+
+
+if __name__ == "__main__":
+    main()
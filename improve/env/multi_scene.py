@@ -0,0 +1,358 @@
+"""
+multi-scene vec envs for SIMPLER
+
+make_envs runs one process per env, each with its own SAPIEN engine, renderer,
+assets and with fm_loc=env its own foundation model. MultiSceneVecEnv hosts K scenes
+in one process instead: one engine and renderer (so one asset cache), one model
+and the physics of every scene stepped in a loop
+
+cameras of all scenes are submitted before any image is read, so rendering
+overlaps across scenes instead of being one blocking render per env step
+
+MultiProcVecEnv runs P of them in worker processes for K x P envs
+both are SB3 VecEnvs and take VecMonitor, VecRecord, etc. like SubprocVecEnv
+"""
+
+import multiprocessing as mp
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from copy import deepcopy
+from pprint import pprint
+
+import numpy as np
+from stable_baselines3.common.vec_env import DummyVecEnv, SubprocVecEnv, VecEnv
+from stable_baselines3.common.vec_env.base_vec_env import CloudpickleWrapper
+
+from improve.wrapper.simpler.obs_cache import LazyObs
+
+# obs key that holds the rendered image, see ExtraObservationWrapper
+IMAGE_KEY = "simpler-img"
+
+
+@contextmanager
+def shared_sapien():
+    """envs built inside share one sapien engine and one renderer per renderer kwargs
+    maniskill2 creates both in BaseEnv.__init__ with sapien.Engine() and sapien.SapienRenderer()
+    the renderer owns the mesh and texture cache, so scenes load each asset once
+    """
+
+    import sapien.core as sapien
+
+    Engine, Renderer = sapien.Engine, sapien.SapienRenderer
+    shared = {}
+
+    def _memo(cls):
+        def _make(*args, **kwargs):
+            key = (cls.__name__, repr(args), repr(sorted(kwargs.items())))
+            if key not in shared:
+                shared[key] = cls(*args, **kwargs)
+            return shared[key]
+
+        return _make
+
+    sapien.Engine, sapien.SapienRenderer = _memo(Engine), _memo(Renderer)
+    try:
+        yield shared
+    finally:
+        sapien.Engine, sapien.SapienRenderer = Engine, Renderer
+
+
+def _plain(obs):
+    """computes the thunks of a LazyObs"""
+    return dict(obs.items()) if isinstance(obs, LazyObs) else obs
+
+
+class MultiSceneVecEnv(DummyVecEnv):
+    """K SIMPLER scenes in this process
+    images are batched when the obs cache can defer rendering, ie: obs_keys are set
+    and no foundation model reads the image inside the env (fm_loc=central)
+    otherwise it behaves like DummyVecEnv with shared sapien and model
+
+    :param env_fns: make_env(cfg) for each scene
+    """
+
+    def __init__(self, env_fns):
+        with shared_sapien() as shared:
+            super().__init__(env_fns)
+        self.shared = shared
+
+        self.caches = []
+        for env in self.envs:
+            try:
+                self.caches.append(env.get_wrapper_attr("obs_cache"))
+            except AttributeError:
+                self.caches.append(None)
+        self.batched = [c is not None and c.batch() for c in self.caches]
+
+    def _render(self, obs):
+        """submits the cameras of every scene whose image is still pending"""
+        for o, cache, batched in zip(obs, self.caches, self.batched):
+            if batched and IMAGE_KEY in getattr(o, "pending", list)():
+                cache.submit()
+
+    def step_wait(self):
+        out = [env.step(a) for env, a in zip(self.envs, self.actions)]
+        self._render([o[0] for o in out])
+
+        for i, (obs, rew, terminated, truncated, info) in enumerate(out):
+            obs = _plain(obs)  # before a reset invalidates the cache
+            self.buf_rews[i] = rew
+            self.buf_infos[i] = info
+            self.buf_dones[i] = terminated or truncated
+            self.buf_infos[i]["TimeLimit.truncated"] = truncated and not terminated
+
+            if self.buf_dones[i]:
+                self.buf_infos[i]["terminal_observation"] = obs
+                obs, self.reset_infos[i] = self.envs[i].reset()
+                obs = _plain(obs)
+            self._save_obs(i, obs)
+
+        return (
+            self._obs_from_buf(),
+            np.copy(self.buf_rews),
+            np.copy(self.buf_dones),
+            deepcopy(self.buf_infos),
+        )
+
+    def reset(self):
+        obs = []
+        for i, env in enumerate(self.envs):
+            options = {"options": self._options[i]} if self._options[i] else {}
+            o, self.reset_infos[i] = env.reset(seed=self._seeds[i], **options)
+            obs.append(o)
+        self._render(obs)
+
+        for i, o in enumerate(obs):
+            self._save_obs(i, _plain(o))
+        self._reset_seeds()
+        self._reset_options()
+        return self._obs_from_buf()
+
+
+def _worker(remote, parent_remote, env_fns):
+    parent_remote.close()
+    venv = MultiSceneVecEnv(env_fns.var)
+    while True:
+        try:
+            cmd, data = remote.recv()
+            if cmd == "step":
+                venv.step_async(data)
+                remote.send(venv.step_wait())
+            elif cmd == "reset":
+                venv._seeds, venv._options = data
+                obs = venv.reset()
+                remote.send((obs, venv.reset_infos))
+            elif cmd == "close":
+                venv.close()
+                remote.close()
+                break
+            elif cmd == "get_spaces":
+                remote.send((venv.observation_space, venv.action_space))
+            elif cmd == "env_method":
+                name, args, kwargs, indices = data
+                remote.send(venv.env_method(name, *args, indices=indices, **kwargs))
+            elif cmd == "get_attr":
+                remote.send(venv.get_attr(*data))
+            elif cmd == "set_attr":
+                remote.send(venv.set_attr(*data))
+            elif cmd == "is_wrapped":
+                remote.send(venv.env_is_wrapped(*data))
+            elif cmd == "render":
+                remote.send(venv.get_images())
+            else:
+                raise NotImplementedError(f"`{cmd}` is not implemented in the worker")
+        except EOFError:
+            break
+
+
+class MultiProcVecEnv(VecEnv):
+    """P worker processes with K scenes each, like SubprocVecEnv over MultiSceneVecEnvs
+    env i lives in worker i // K
+
+    :param env_fns: K x P env fns
+    :param scenes: K, scenes per worker
+    """
+
+    def __init__(self, env_fns, scenes, start_method=None):
+        assert len(env_fns) % scenes == 0, f"{len(env_fns)} envs do not split into {scenes} scenes"
+        self.scenes = scenes
+        self.waiting = False
+        self.closed = False
+
+        if start_method is None:
+            forkserver = "forkserver" in mp.get_all_start_methods()
+            start_method = "forkserver" if forkserver else "spawn"
+        ctx = mp.get_context(start_method)
+
+        chunks = [env_fns[i : i + scenes] for i in range(0, len(env_fns), scenes)]
+        self.remotes, self.work_remotes = zip(*[ctx.Pipe() for _ in chunks])
+        self.processes = []
+        for work_remote, remote, fns in zip(self.work_remotes, self.remotes, chunks):
+            args = (work_remote, remote, CloudpickleWrapper(fns))
+            process = ctx.Process(target=_worker, args=args, daemon=True)
+            process.start()
+            self.processes.append(process)
+            work_remote.close()
+
+        self.remotes[0].send(("get_spaces", None))
+        observation_space, action_space = self.remotes[0].recv()
+        super().__init__(len(env_fns), observation_space, action_space)
+
+    def _split(self, x):
+        return [x[i : i + self.scenes] for i in range(0, self.num_envs, self.scenes)]
+
+    def _by_worker(self, indices):
+        """{worker: [local index]} for global env indices"""
+        out = OrderedDict()
+        for i in self._get_indices(indices):
+            out.setdefault(i // self.scenes, []).append(i % self.scenes)
+        return out
+
+    def _concat(self, obs):
+        if isinstance(obs[0], dict):
+            return OrderedDict([(k, np.concatenate([o[k] for o in obs])) for k in obs[0]])
+        return np.concatenate(obs)
+
+    def step_async(self, actions):
+        for remote, action in zip(self.remotes, self._split(actions)):
+            remote.send(("step", action))
+        self.waiting = True
+
+    def step_wait(self):
+        results = [remote.recv() for remote in self.remotes]
+        self.waiting = False
+        obs, rews, dones, infos = zip(*results)
+        infos = [info for chunk in infos for info in chunk]
+        return self._concat(obs), np.concatenate(rews), np.concatenate(dones), infos
+
+    def reset(self):
+        seeds, options = self._split(self._seeds), self._split(self._options)
+        for remote, s, o in zip(self.remotes, seeds, options):
+            remote.send(("reset", (s, o)))
+        results = [remote.recv() for remote in self.remotes]
+        obs, reset_infos = zip(*results)
+        self.reset_infos = [info for chunk in reset_infos for info in chunk]
+        self._reset_seeds()
+        self._reset_options()
+        return self._concat(obs)
+
+    def close(self):
+        if self.closed:
+            return
+        if self.waiting:
+            for remote in self.remotes:
+                remote.recv()
+        for remote in self.remotes:
+            remote.send(("close", None))
+        for process in self.processes:
+            process.join()
+        self.closed = True
+
+    def get_images(self):
+        for remote in self.remotes:
+            remote.send(("render", None))
+        return [img for remote in self.remotes for img in remote.recv()]
+
+    def _call(self, cmd, indices, fn):
+        workers = self._by_worker(indices)
+        for w, local in workers.items():
+            self.remotes[w].send((cmd, fn(local)))
+        return [x for w in workers for x in self.remotes[w].recv()]
+
+    def get_attr(self, attr_name, indices=None):
+        return self._call("get_attr", indices, lambda local: (attr_name, local))
+
+    def set_attr(self, attr_name, value, indices=None):
+        workers = self._by_worker(indices)
+        for w, local in workers.items():
+            self.remotes[w].send(("set_attr", (attr_name, value, local)))
+        for w in workers:
+            self.remotes[w].recv()
+
+    def env_method(self, method_name, *method_args, indices=None, **method_kwargs):
+        return self._call(
+            "env_method", indices, lambda local: (method_name, method_args, method_kwargs, local)
+        )
+
+    def env_is_wrapped(self, wrapper_class, indices=None):
+        return self._call("is_wrapped", indices, lambda local: (wrapper_class, local))
+
+
+def make_multi_scene(env_fns, scenes):
+    """K scenes per process, in this process if that is all of them"""
+    if scenes >= len(env_fns):
+        return MultiSceneVecEnv(env_fns)
+    return MultiProcVecEnv(env_fns, scenes)
+
+
+#
+# bench
+#
+
+
+def memory(venv):
+    """resident and unique bytes per env of the worker processes"""
+    import psutil
+
+    procs = [psutil.Process(p.pid) for p in venv.processes]
+    mem = [p.memory_full_info() for p in procs]
+    return {
+        "rss": sum(m.rss for m in mem) / venv.num_envs,
+        "uss": sum(m.uss for m in mem) / venv.num_envs,
+    }
+
+
+def bench(make, n=200):
+    """steps/sec and memory per env of a vec env layout
+
+    :param make: builds the vec env
+    :param n: vec steps timed after one warmup step
+    """
+
+    tic = time.time()
+    venv = make()
+    startup = time.time() - tic
+
+    venv.reset()
+    actions = np.stack([venv.action_space.sample() for _ in range(venv.num_envs)])
+    venv.step(actions)
+
+    tic = time.time()
+    for _ in range(n):
+        venv.step(actions)
+    steps = n * venv.num_envs / (time.time() - tic)
+
+    mem = memory(venv)
+    venv.close()
+    return {
+        "envs": venv.num_envs,
+        "startup": f"{startup:.1f}s",
+        "steps/sec": f"{steps:.1f}",
+        **{f"{k}/env": f"{v / 2**20:.0f}MiB" for k, v in mem.items()},
+    }
+
+
+import hydra
+import improve
+import improve.hydra.resolver
+
+
+@hydra.main(config_path=improve.CONFIG, config_name="config", version_base="1.3.2")
+def main(cfg):
+    """one process per env (current layout) vs K scenes per process for the same env count"""
+
+    from improve.env import make_env
+
+    n, k = cfg.env.n_envs, max(cfg.env.scenes, 2)
+    fns = lambda: [make_env(cfg) for _ in range(n)]
+
+    results = {
+        "subproc": bench(lambda: SubprocVecEnv(fns())),
+        f"{k}x{n // k}": bench(lambda: MultiProcVecEnv(fns(), scenes=k)),
+    }
+    pprint(results)
+
+
+if __name__ == "__main__":
+    main()
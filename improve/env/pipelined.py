@@ -0,0 +1,204 @@
+"""
+pipelined auto-reset for SIMPLER vec envs
+
+SubprocVecEnv resets a finished env inside the step that ended it: the ManiSkill2
+reset, the first render and with fm_loc=env the model reset. every other worker
+waits for it, so a terminal step costs several regular ones
+
+PipelinedVecEnv keeps a spare env per worker with its next episode already reset.
+a terminal step swaps the spare in and returns its reset obs right away. the
+finished env is reset after the worker replies to a later step, while the main
+process runs the policy, so the reset hides behind inference instead of the batch
+
+the spare is a second env in the worker process. it shares the sapien engine and
+renderer (see multi_scene.shared_sapien) but with fm_loc=env it loads its own model
+"""
+
+import multiprocessing as mp
+import time
+from pprint import pprint
+
+import numpy as np
+from stable_baselines3.common.env_util import is_wrapped
+from stable_baselines3.common.vec_env import SubprocVecEnv, VecEnv
+from stable_baselines3.common.vec_env.base_vec_env import CloudpickleWrapper
+from stable_baselines3.common.vec_env.patch_gym import _patch_env
+
+from improve.env.multi_scene import _plain, shared_sapien
+
+# env methods that go to the spare as well, they set up the next reset
+BROADCAST = ["set_next_seed"]
+
+
+def _spare_seed(seed):
+    """seed of the spare's first reset, apart from the seeds of every other worker"""
+    return None if seed is None else int(np.random.SeedSequence(seed).generate_state(1)[0])
+
+
+def _worker(remote, parent_remote, env_fn_wrapper):
+    parent_remote.close()
+    with shared_sapien():
+        active = _patch_env(env_fn_wrapper.var())
+        spare = _patch_env(env_fn_wrapper.var())
+
+    # the spare is reset after the reply to a step that is not a done, so the env_method
+    # calls the main process makes for a done (ie: SeedScheduleVecEnv queueing a seed)
+    # land before the reset they are for
+    stale, spare_seed = True, None
+    spare_obs = spare_info = None
+    reset_info = {}
+
+    while True:
+        try:
+            cmd, data = remote.recv()
+            if cmd == "step":
+                obs, reward, terminated, truncated, info = active.step(data)
+                done = terminated or truncated
+                info["TimeLimit.truncated"] = truncated and not terminated
+                if done:
+                    info["terminal_observation"] = _plain(obs)
+                    if stale:  # episode ended before the spare was ready
+                        obs, reset_info = active.reset()
+                        obs = _plain(obs)
+                    else:
+                        active, spare = spare, active
+                        obs, reset_info = spare_obs, spare_info
+                        stale = True
+                remote.send((obs, reward, done, info, reset_info))
+
+                if stale and not done:
+                    spare_obs, spare_info = spare.reset(seed=spare_seed)
+                    spare_obs, spare_seed, stale = _plain(spare_obs), None, False
+
+            elif cmd == "reset":
+                maybe_options = {"options": data[1]} if data[1] else {}
+                obs, reset_info = active.reset(seed=data[0], **maybe_options)
+                remote.send((obs, reset_info))
+                stale, spare_seed = True, _spare_seed(data[0])
+            elif cmd == "render":
+                remote.send(active.render())
+            elif cmd == "close":
+                active.close()
+                spare.close()
+                remote.close()
+                break
+            elif cmd == "get_spaces":
+                remote.send((active.observation_space, active.action_space))
+            elif cmd == "env_method":
+                if data[0] in BROADCAST:
+                    spare.get_wrapper_attr(data[0])(*data[1], **data[2])
+                remote.send(active.get_wrapper_attr(data[0])(*data[1], **data[2]))
+            elif cmd == "get_attr":
+                remote.send(active.get_wrapper_attr(data))
+            elif cmd == "has_attr":
+                try:
+                    active.get_wrapper_attr(data)
+                    remote.send(True)
+                except AttributeError:
+                    remote.send(False)
+            elif cmd == "set_attr":
+                setattr(spare, data[0], data[1])
+                remote.send(setattr(active, data[0], data[1]))
+            elif cmd == "is_wrapped":
+                remote.send(is_wrapped(active, data))
+            else:
+                raise NotImplementedError(f"`{cmd}` is not implemented in the worker")
+        except EOFError:
+            break
+        except KeyboardInterrupt:
+            break
+
+
+class PipelinedVecEnv(SubprocVecEnv):
+    """SubprocVecEnv whose workers reset a spare episode in the background
+    terminal steps cost the same as regular ones as long as the main process spends
+    at least a reset between steps, otherwise the rest of the reset lands on the next step
+
+    env_method and get_attr see the active env, set_attr and BROADCAST methods both
+    """
+
+    def __init__(self, env_fns, start_method=None):
+        self.waiting = False
+        self.closed = False
+        n_envs = len(env_fns)
+
+        if start_method is None:
+            forkserver = "forkserver" in mp.get_all_start_methods()
+            start_method = "forkserver" if forkserver else "spawn"
+        ctx = mp.get_context(start_method)
+
+        self.remotes, self.work_remotes = zip(*[ctx.Pipe() for _ in range(n_envs)])
+        self.processes = []
+        for work_remote, remote, env_fn in zip(self.work_remotes, self.remotes, env_fns):
+            args = (work_remote, remote, CloudpickleWrapper(env_fn))
+            process = ctx.Process(target=_worker, args=args, daemon=True)
+            process.start()
+            self.processes.append(process)
+            work_remote.close()
+
+        self.remotes[0].send(("get_spaces", None))
+        observation_space, action_space = self.remotes[0].recv()
+        VecEnv.__init__(self, n_envs, observation_space, action_space)
+
+
+#
+# bench
+#
+
+
+def bench(make, n=300, think=0.0):
+    """per step wall time of a vec env, terminal steps apart
+
+    :param make: builds the vec env
+    :param n: vec steps timed after one warmup step
+    :param think: seconds the main process spends between steps, ie: policy inference
+    """
+
+    venv = make()
+    venv.reset()
+    actions = np.stack([venv.action_space.sample() for _ in range(venv.num_envs)])
+    venv.step(actions)
+
+    times, dones = [], []
+    for _ in range(n):
+        time.sleep(think)
+        tic = time.time()
+        _, _, done, _ = venv.step(actions)
+        times.append(time.time() - tic)
+        dones.append(done.any())
+    venv.close()
+
+    times, dones = 1e3 * np.array(times), np.array(dones)
+    fmt = lambda x: f"{x:.1f}ms"
+    return {
+        "mean": fmt(times.mean()),
+        "std": fmt(times.std()),
+        "p99": fmt(np.percentile(times, 99)),
+        "max": fmt(times.max()),
+        "done step": fmt(times[dones].mean()) if dones.any() else None,
+        "regular step": fmt(times[~dones].mean()),
+    }
+
+
+import hydra
+import improve
+import improve.hydra.resolver
+
+
+@hydra.main(config_path=improve.CONFIG, config_name="config", version_base="1.3.2")
+def main(cfg):
+    """step time of SubprocVecEnv vs PipelinedVecEnv, with and without policy time"""
+
+    from improve.env import make_env
+
+    fns = lambda: [make_env(cfg, max_episode_steps=cfg.env.max_episode_steps) for _ in range(cfg.env.n_envs)]
+
+    results = {}
+    for think in [0.0, 0.05]:
+        results[f"subproc think={think}"] = bench(lambda: SubprocVecEnv(fns()), think=think)
+        results[f"pipelined think={think}"] = bench(lambda: PipelinedVecEnv(fns()), think=think)
+    pprint(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+renderer placement for SIMPLER envs
+
+every env used to render on cuda:0. cfg.env.render picks a backend and device per worker
+
+    backend     gpu, cpu or auto (gpu when one is visible)
+    devices     gpu ids, null is every visible gpu
+    assign      round_robin: worker i on devices[i % n]
+                explicit: worker i on devices[i]
+    per_device  max workers per gpu, with auto the rest use the cpu rasterizer
+
+the cpu backend is sapien's vulkan renderer on a software driver (mesa lavapipe
+or swiftshader), so image configs also run on gpu-less nodes, only slower
+"""
+
+import glob
+import os
+import subprocess
+
+BACKENDS = ["auto", "gpu", "cpu"]
+
+# software vulkan drivers, the first one found is used
+CPU_ICDS = [
+    "/usr/share/vulkan/icd.d/lvp_icd.*.json",
+    "/etc/vulkan/icd.d/lvp_icd.*.json",
+    "/usr/share/vulkan/icd.d/vk_swiftshader_icd.json",
+    "/usr/local/share/vulkan/icd.d/*swiftshader*.json",
+]
+
+
+def gpus():
+    """visible cuda devices as ids for cuda:i, [] on gpu-less machines"""
+
+    visible = os.environ.get("CUDA_VISIBLE_DEVICES")
+    if visible is not None:
+        ids = [d for d in visible.split(",") if d.strip() not in ["", "-1"]]
+        return list(range(len(ids)))
+    try:
+        out = subprocess.run(["nvidia-smi", "-L"], capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return []
+    return list(range(sum(line.startswith("GPU") for line in out.splitlines())))
+
+
+def cpu_icd():
+    for pattern in CPU_ICDS:
+        found = sorted(glob.glob(pattern))
+        if found:
+            return found[0]
+    return None
+
+
+def place(render, rank=0):
+    """backend and device of worker rank
+
+    :param render: cfg.env.render
+    :returns: ("gpu", "cuda:i") or ("cpu", None)
+    """
+
+    backend = render.backend
+    assert backend in BACKENDS, f"render.backend must be one of {BACKENDS}"
+
+    devices = list(render.devices) if render.devices is not None else gpus()
+    if backend == "cpu" or not devices:
+        if backend == "gpu":
+            raise RuntimeError("render.backend=gpu but no gpu is visible")
+        return "cpu", None
+
+    if render.assign == "explicit":
+        assert rank < len(devices), f"worker {rank} has no device in render.devices={devices}"
+        device = devices[rank]
+        slot = devices[:rank].count(device)
+    elif render.assign == "round_robin":
+        device = devices[rank % len(devices)]
+        slot = rank // len(devices)
+    else:
+        raise ValueError(f"unknown render.assign {render.assign}")
+
+    if render.per_device is not None and slot >= render.per_device:
+        if backend == "gpu":
+            raise RuntimeError(f"worker {rank} is over render.per_device={render.per_device} on {device}")
+        return "cpu", None
+
+    device = str(device)
+    return "gpu", device if device.startswith("cuda") else f"cuda:{device}"
+
+
+def renderer_kwargs(render, rank=0):
+    """sapien renderer kwargs for worker rank
+    the cpu backend selects the software driver, which vulkan reads once per process
+    so call this in the env process before its first renderer is created
+    """
+
+    backend, device = place(render, rank)
+    if backend == "cpu":
+        icd = cpu_icd()
+        if icd is None:
+            raise RuntimeError("no gpu and no software vulkan driver, install mesa-vulkan-drivers")
+        os.environ["VK_ICD_FILENAMES"] = icd
+        print(f"worker {rank} renders on cpu with {icd}")
+        return {"offscreen_only": True, "device": ""}  # the only vulkan device left
+
+    print(f"worker {rank} renders on {device}")
+    return {"offscreen_only": True, "device": device}
@@ -3,13 +3,16 @@ import os.path as osp
 from dataclasses import asdict
 
 from improve import cn
-from improve.fm.batch_octo import BatchedOctoInference
 from improve.fm.rtx import RT1Policy
+from improve.fm.warmup import init_compile_cache
 
 
 def build_foundation_model(fmcn: cn.FoundationModel):
     """Builds the model."""
 
+    # before anything is jitted
+    init_compile_cache(fmcn.compile_cache)
+
     if fmcn.policy in ["rt1", "rtx"]:
         from simpler_env.policies.rt1.rt1_model import RT1Inference
 
@@ -22,11 +25,15 @@ def build_foundation_model(fmcn: cn.FoundationModel):
             policy_setup=fmcn.policy_setup,
             cached=fmcn.cached,
             task=fmcn.task,
+            precision=fmcn.precision,
         )
 
     elif "octo" in fmcn.policy:
         from simpler_env.policies.octo.octo_model import OctoInference
 
+        # octo pulls in tensorflow, rt1 workers should not pay for it
+        from improve.fm.batch_octo import BatchedOctoInference
+
         model = BatchedOctoInference(
             batch_size=fmcn.batch_size,
             model_type=fmcn.ckpt,
@@ -6,6 +6,7 @@ import improve
 import jax
 import numpy as np
 import tensorflow as tf
+from improve.fm import warmup
 from improve.wrapper import dict_util as du
 from jax.sharding import Mesh, NamedSharding, PartitionSpec
 from octo.model.octo_model import OctoModel
@@ -108,6 +109,37 @@ class BatchedOctoInference(OctoInference):
         # self.gripper_is_closed = False
         self.previous_gripper_action = np.full((8,), np.nan)
 
+    def warmup(self, batch_sizes=None, n=5):
+        """compiles the forward for each batch size before the first env step
+        sample_actions is jitted inside octo so this warms its cache by calling it
+        needs a task, call reset first
+
+        :param batch_sizes: defaults to the configured batch size
+        """
+
+        batch_sizes = [self.batch_size] if batch_sizes is None else batch_sizes
+
+        def args(bs):
+            images = np.zeros(
+                (bs, self.horizon, self.image_size, self.image_size, 3), dtype=np.uint8
+            )
+            pad_mask = np.ones((bs, self.horizon), dtype=np.float64)
+            task = du.apply(self.task, lambda x: np.repeat(x[:1], bs, axis=0))
+            _, key = jax.random.split(self.rng)
+            return (
+                self.model,
+                images,
+                pad_mask,
+                task,
+                self.automatic_task_creation,
+                self.rng,
+                key,
+            )
+
+        report = warmup.warmup(self.fwd, args, batch_sizes, n=n)
+        warmup.show(type(self).__name__, report)
+        return report
+
     def _obtain_image_history_and_mask(self) -> tuple[np.ndarray, np.ndarray]:
         ax = 1  # 0 if self.batch_size == 1 else 1
         images = np.stack(self.image_history, axis=ax)
@@ -11,14 +11,22 @@ from simpler_env.utils.action.action_ensemble import ActionEnsembler
 from transformers import AutoTokenizer
 from transforms3d.euler import euler2axangle
 
+from improve.data import stats
+from improve.fm import warmup
 from improve.fm.batch_octo import BatchedActionEnsembler
 
 
 class PolicyStepper:
 
-    def __init__(self, model_type, dataset_id, func=None, transform=None, task=None):
+    def __init__(
+        self, model_type, dataset_id, func=None, transform=None, task=None, stats=None
+    ):
+        """
+        :param stats: optional path to a data.stats file for custom checkpoints
+        """
         self.model_type = model_type
         self.dataset_id = dataset_id
+        self.stats = stats
 
         if self.model_type == "func":
             self.init_data_stats()
@@ -62,57 +70,12 @@ class PolicyStepper:
             self.init_data_stats()
 
     def init_data_stats(self):
-        if self.dataset_id == "bridge_dataset":
-            self.action_mean = np.array(
-                [
-                    0.00021161,
-                    0.00012614,
-                    -0.00017022,
-                    -0.00015062,
-                    -0.00023831,
-                    0.00025646,
-                    0.0,
-                ]
-            )
-            self.action_std = np.array(
-                [
-                    0.00963721,
-                    0.0135066,
-                    0.01251861,
-                    0.02806791,
-                    0.03016905,
-                    0.07632624,
-                    1.0,
-                ]
-            )
-
-        elif self.dataset_id == "fractal20220817_data":
-            self.action_mean = np.array(
-                [
-                    0.00696389,
-                    0.00627008,
-                    -0.01263256,
-                    0.04330839,
-                    -0.00570499,
-                    0.00089247,
-                    0.0,
-                ]
-            )
-            self.action_std = np.array(
-                [
-                    0.06925472,
-                    0.06019009,
-                    0.07354742,
-                    0.15605888,
-                    0.1316399,
-                    0.14593437,
-                    1.0,
-                ]
-            )
-
+        """action mean/std from a stats file, or the released octo stats"""
+        if self.stats is not None:
+            action = stats.load(self.stats)["action"]
         else:
-            msg = f"{self.dataset_id} not supported yet for custom octo model checkpoints."
-            raise NotImplementedError(msg)
+            action = stats.octo(self.dataset_id)["action"]
+        self.action_mean, self.action_std = action["mean"], action["std"]
 
     @property
     def task(self):
@@ -263,6 +226,28 @@ class OXESimplerInference:
         # pad_mask[:self.horizon - self.num_image_history] = 0
         return images, pad_mask
 
+    def warmup(self, batch_sizes=None, n=5):
+        """compiles the stepper for each batch size before the first env step
+        reports compile time separately from steady state latency
+
+        :param batch_sizes: defaults to the configured batch size
+        """
+
+        batch_sizes = [self.batch_size] if batch_sizes is None else batch_sizes
+
+        def args(bs):
+            images = np.zeros(
+                (bs, self.horizon, self.image_size, self.image_size, 3), dtype=np.uint8
+            )
+            pad_mask = np.ones((bs, self.horizon), dtype=np.float64)
+            batch = {"observation": {"image_primary": images, "pad_mask": pad_mask}}
+            _, key = jax.random.split(self.rng)
+            return batch, self.rng, key
+
+        report = warmup.warmup(self.stepper, args, batch_sizes, n=n)
+        warmup.show(type(self).__name__, report)
+        return report
+
     def reset(self, task_description: str) -> None:
         # self.task = self.stepper.task
 
@@ -0,0 +1,114 @@
+"""reduced precision and int8 weight-only quantization of flax variables
+
+weights are stored as int8 with one float scale per output channel
+and dequantized inside the jitted forward, so XLA fuses the dequant into the consumer
+"""
+
+import jax
+import jax.numpy as jnp
+import numpy as np
+from flax import struct
+
+# precision modes for RT1Policy
+PRECISIONS = ["fp32", "bf16", "int8", "int8-bf16"]
+
+# kernels whose output channel is not the last axis
+CHANNEL_AXIS = {"depthwise_kernel": -2}
+
+# attention projections, DenseGeneral kernels [embed, heads, head_dim]
+# every (head, head_dim) is an output channel, only embed is reduced
+HEAD_AXES = {"query": (1, 2), "key": (1, 2), "value": (1, 2)}
+
+
+@struct.dataclass
+class QTensor:
+    """int8 weights with one scale per output channel"""
+
+    q: jnp.ndarray
+    scale: jnp.ndarray
+
+    def dequantize(self, dtype=jnp.float32):
+        return self.q.astype(dtype) * self.scale.astype(dtype)
+
+
+def is_q(x):
+    return isinstance(x, QTensor)
+
+
+def quantize(x, axis=-1):
+    """symmetric per channel int8 quantization
+
+    :param axis: output channel axis or axes, reduced over every other axis
+    """
+
+    x = np.asarray(x, dtype=np.float32)
+    axes = [a % x.ndim for a in np.atleast_1d(axis)]
+    reduce = tuple(i for i in range(x.ndim) if i not in axes)
+
+    scale = np.max(np.abs(x), axis=reduce, keepdims=True) / 127.0
+    scale = np.where(scale == 0, 1.0, scale).astype(np.float32)
+    q = np.clip(np.round(x / scale), -127, 127).astype(np.int8)
+    return QTensor(q=q, scale=scale)
+
+
+def quantize_params(params, min_size=4096):
+    """int8 weight-only quantization of dense and conv kernels
+    biases, norms and tiny kernels stay in float since they are not worth the error
+
+    :param min_size: kernels with fewer elements are kept as is
+    """
+
+    def _quantize(path, x):
+        name = getattr(path[-1], "key", None)
+        if name in ["kernel", "depthwise_kernel"] and x.ndim >= 2 and x.size >= min_size:
+            module = getattr(path[-2], "key", None) if len(path) > 1 else None
+            if x.ndim == 3 and module in HEAD_AXES:
+                return quantize(x, axis=HEAD_AXES[module])
+            return quantize(x, axis=CHANNEL_AXIS.get(name, -1))
+        return x
+
+    return jax.tree_util.tree_map_with_path(_quantize, params)
+
+
+def cast(params, dtype):
+    """casts floating leaves, quantized kernels keep their int8 values"""
+
+    def _cast(x):
+        if is_q(x) or not jnp.issubdtype(x.dtype, jnp.floating):
+            return x
+        return jnp.asarray(x, dtype)
+
+    return jax.tree.map(_cast, params, is_leaf=is_q)
+
+
+def dequantize(params, dtype=jnp.float32):
+    """jittable, replaces every QTensor with its float weights"""
+    return jax.tree.map(
+        lambda x: x.dequantize(dtype) if is_q(x) else x, params, is_leaf=is_q
+    )
+
+
+def prepare(variables, precision="fp32"):
+    """converts fp32 variables for a precision mode
+    batch_stats stay in fp32, they are tiny and normalize every conv
+
+    :returns: (variables, computation dtype)
+    """
+
+    assert precision in PRECISIONS, precision
+    dtype = jnp.bfloat16 if "bf16" in precision else jnp.float32
+
+    params = variables["params"]
+    if "int8" in precision:
+        params = quantize_params(params)
+    if dtype != jnp.float32:
+        params = cast(params, dtype)
+
+    variables = {**variables, "params": params}
+    return jax.device_put(variables), dtype
+
+
+def nbytes(variables):
+    """size of the variables in bytes, quantized kernels count their scales"""
+    leaves = jax.tree.leaves(variables)
+    return sum(x.size * x.dtype.itemsize for x in leaves)
@@ -1,6 +1,7 @@
 import copy
 import enum
 import math
+from functools import partial
 from typing import Any, Callable, Dict, Optional, Sequence, Tuple, Union
 
 import flax.linen as nn
@@ -24,6 +25,7 @@ class FilmConditioning(nn.Module):
     """FiLM conditioning layer."""
 
     num_channels: int
+    dtype: jnp.dtype = jnp.float32
 
     @nn.compact
     def __call__(self, conv_filters, context):
@@ -39,10 +41,16 @@ class FilmConditioning(nn.Module):
         """
         zero_init = nn.initializers.zeros_init()
         project_cond_add = nn.Dense(
-            self.num_channels, kernel_init=zero_init, bias_init=zero_init
+            self.num_channels,
+            kernel_init=zero_init,
+            bias_init=zero_init,
+            dtype=self.dtype,
         )(context)
         project_cond_mul = nn.Dense(
-            self.num_channels, kernel_init=zero_init, bias_init=zero_init
+            self.num_channels,
+            kernel_init=zero_init,
+            bias_init=zero_init,
+            dtype=self.dtype,
         )(context)
 
         project_cond_add = project_cond_add[:, None, None, :]
@@ -642,7 +650,9 @@ class EfficientNetWithFilm(nn.Module):
 
             x = MBConvBlock(block=block, config=config, train=train)(x)
 
-            x = FilmConditioning(num_channels=x.shape[-1])(x, context_input)
+            x = FilmConditioning(num_channels=x.shape[-1], dtype=self.dtype)(
+                x, context_input
+            )
 
             block_num += 1
             if block.num_repeat > 1:
@@ -653,11 +663,13 @@ class EfficientNetWithFilm(nn.Module):
                     drop_rate = drop_connect_rate * float(block_num) / num_blocks_total
                     config.drop_connect_rate = drop_rate
                     x = MBConvBlock(block=block, config=config, train=train)(x)
-                    x = FilmConditioning(num_channels=x.shape[-1])(x, context_input)
+                    x = FilmConditioning(num_channels=x.shape[-1], dtype=self.dtype)(
+                        x, context_input
+                    )
 
                     block_num += 1
 
-        x = Head(self.config, train=train)(x)
+        x = Head(config, train=train)(x)
 
         return x
 
@@ -726,6 +738,7 @@ class TokenLearnerModuleV11(nn.Module):
     num_tokens: int
     bottleneck_dim: int = 64
     dropout_rate: float = 0.0
+    dtype: jnp.dtype = jnp.float32
 
     @nn.compact
     def __call__(self, inputs: jnp.ndarray, deterministic: bool) -> jnp.ndarray:
@@ -747,7 +760,7 @@ class TokenLearnerModuleV11(nn.Module):
 
         selected = inputs
 
-        selected = nn.LayerNorm()(selected)
+        selected = nn.LayerNorm(dtype=self.dtype)(selected)
 
         selected = MlpBlock(
             mlp_dim=self.bottleneck_dim,
@@ -755,6 +768,7 @@ class TokenLearnerModuleV11(nn.Module):
             dropout_rate=self.dropout_rate,
             activation_fn=nn.gelu,
             name="token_masking",
+            dtype=self.dtype,
         )(selected, deterministic=deterministic)
 
         selected = jnp.reshape(
@@ -794,28 +808,31 @@ class TransformerBlock(nn.Module):
     feed_forward_output_size: int = 512
     ffn_option: FFNOptions = FFNOptions.SWIGLU
     dropout_rate: float = 0.1
+    dtype: jnp.dtype = jnp.float32
 
     @nn.compact
     def __call__(self, x: jnp.ndarray, attn_mask: jnp.ndarray, *, train: bool):
-        x1 = nn.LayerNorm()(x)
+        dense = partial(nn.Dense, use_bias=False, dtype=self.dtype)
+        x1 = nn.LayerNorm(dtype=self.dtype)(x)
 
         x1 = nn.MultiHeadDotProductAttention(
             num_heads=self.num_heads,
             qkv_features=(self.layer_size * self.num_heads),
             dropout_rate=self.dropout_rate,
+            dtype=self.dtype,
         )(x1, x1, mask=attn_mask, deterministic=not train)
 
         x = x + x1
 
-        y = nn.LayerNorm()(x)
+        y = nn.LayerNorm(dtype=self.dtype)(x)
 
         if self.ffn_option == FFNOptions.SWIGLU:
-            h1 = nn.Dense(self.feed_forward_hidden_size, use_bias=False)(y)
+            h1 = dense(self.feed_forward_hidden_size)(y)
             h1 = nn.swish(h1)
-            gate = nn.Dense(self.feed_forward_hidden_size, use_bias=False)(y)
-            ff_y = nn.Dense(self.feed_forward_output_size, use_bias=False)(h1 * gate)
+            gate = dense(self.feed_forward_hidden_size)(y)
+            ff_y = dense(self.feed_forward_output_size)(h1 * gate)
         elif self.ffn_option == FFNOptions.LINEAR:
-            ff_y = nn.Dense(self.feed_forward_output_size, use_bias=False)(y)
+            ff_y = dense(self.feed_forward_output_size)(y)
         else:
             raise ValueError(f"Unknown FFN option: {self.ffn_option}")
 
@@ -840,6 +857,7 @@ class Transformer(nn.Module):
     ffn_option: FFNOptions = FFNOptions.SWIGLU
     dropout_rate: float = 0.1
     vocab_size: int = 256
+    dtype: jnp.dtype = jnp.float32
 
     @nn.compact
     def __call__(self, x: jnp.ndarray, attn_mask: jnp.ndarray, *, train: bool):
@@ -847,10 +865,10 @@ class Transformer(nn.Module):
 
         pos = jnp.expand_dims(jnp.arange(0, seqlen, 1), 0)
         pos = jnp.tile(pos, [bs, 1])
-        pos = jax.nn.one_hot(pos, seqlen)
+        pos = jax.nn.one_hot(pos, seqlen, dtype=self.dtype)
 
-        x = nn.Dense(self.feed_forward_output_size)(x)
-        pos_emb = nn.Dense(self.feed_forward_output_size)(pos)
+        x = nn.Dense(self.feed_forward_output_size, dtype=self.dtype)(x)
+        pos_emb = nn.Dense(self.feed_forward_output_size, dtype=self.dtype)(pos)
         x += pos_emb
 
         for _ in range(self.num_layers):
@@ -861,9 +879,10 @@ class Transformer(nn.Module):
                 feed_forward_output_size=self.feed_forward_output_size,
                 dropout_rate=self.dropout_rate,
                 ffn_option=self.ffn_option,
+                dtype=self.dtype,
             )(x, attn_mask, train=train)
 
-        output_tokens = nn.Dense(self.vocab_size)(x)
+        output_tokens = nn.Dense(self.vocab_size, dtype=self.dtype)(x)
         return output_tokens
 
 
@@ -885,6 +904,7 @@ class TokenLearnerModuleV11(nn.Module):
     num_tokens: int
     bottleneck_dim: int = 64
     dropout_rate: float = 0.0
+    dtype: jnp.dtype = jnp.float32
 
     @nn.compact
     def __call__(self, inputs: jnp.ndarray, deterministic: bool) -> jnp.ndarray:
@@ -906,7 +926,7 @@ class TokenLearnerModuleV11(nn.Module):
 
         selected = inputs
 
-        selected = nn.LayerNorm()(selected)
+        selected = nn.LayerNorm(dtype=self.dtype)(selected)
 
         selected = MlpBlock(
             mlp_dim=self.bottleneck_dim,
@@ -914,6 +934,7 @@ class TokenLearnerModuleV11(nn.Module):
             dropout_rate=self.dropout_rate,
             activation_fn=nn.gelu,
             name="token_masking",
+            dtype=self.dtype,
         )(selected, deterministic=deterministic)
 
         selected = jnp.reshape(
@@ -950,6 +971,7 @@ class ImageTokenizer(nn.Module):
     num_features: int = 512
 
     use_token_learner: bool = True
+    dtype: jnp.dtype = jnp.float32
 
     @nn.compact
     def __call__(self, image: jnp.ndarray, context_input: jnp.ndarray, *, train: bool):
@@ -974,7 +996,7 @@ class ImageTokenizer(nn.Module):
         image /= jnp.array(STDDEV_RGB)
 
         # Apply film in EfficientNet.
-        x = EfficientNetWithFilm(efficientnet_config)(
+        x = EfficientNetWithFilm(efficientnet_config, dtype=self.dtype)(
             image, context_input=context_input, train=train
         )
 
@@ -992,12 +1014,15 @@ class ImageTokenizer(nn.Module):
             padding="SAME",
             use_bias=False,
             kernel_init=var_init,
+            dtype=self.dtype,
         )(x)
 
-        x = FilmConditioning(num_channels=self.num_features)(x, context_input)
+        x = FilmConditioning(num_channels=self.num_features, dtype=self.dtype)(
+            x, context_input
+        )
 
         if self.use_token_learner:
-            x = TokenLearnerModuleV11(num_tokens=self.num_tokens)(
+            x = TokenLearnerModuleV11(num_tokens=self.num_tokens, dtype=self.dtype)(
                 x, deterministic=not train
             )
 
@@ -1131,11 +1156,15 @@ class RT1(nn.Module):
 
     sow_intermediates: bool = False
 
+    # computation dtype, params stay in whatever dtype they are passed in
+    dtype: jnp.dtype = jnp.float32
+
     def setup(self):
         self.image_tokenizer = ImageTokenizer(
             num_tokens=self.num_image_tokens,
             num_features=self.image_num_features,
             use_token_learner=self.use_token_learner,
+            dtype=self.dtype,
         )
 
     def tokenize_image(self, image: jnp.ndarray, context: jnp.ndarray, *, train: bool):
@@ -1201,7 +1230,8 @@ class RT1(nn.Module):
             # the action tokens. We do it here to ensure tokens are consistently
             # zero regardless of the input actions passed to the function.
             action_tokens = jnp.zeros(
-                (bs, seqlen, self.num_action_tokens, self.image_num_features)
+                (bs, seqlen, self.num_action_tokens, self.image_num_features),
+                dtype=context_image_tokens.dtype,
             )
 
         # Assemble the input tokens into a single sequence.
@@ -1225,6 +1255,7 @@ class RT1(nn.Module):
             dropout_rate=self.dropout_rate,
             vocab_size=self.vocab_size,
             ffn_option=self.ffn_option,
+            dtype=self.dtype,
         )(full_tokens, attn_mask=attn_mask, train=train)
 
         return output_tokens
@@ -1,5 +1,6 @@
-import copy
-from collections import deque
+import os
+import os.path as osp
+import sys
 from pprint import pprint
 from typing import List, Optional
 
@@ -7,8 +8,6 @@ import jax
 import jax.numpy as jnp
 import numpy as np
 import simpler_env as simpler
-import tensorflow as tf
-import tensorflow_hub as hub
 from flax.training import checkpoints
 from stable_baselines3.common.vec_env import SubprocVecEnv
 from transforms3d.euler import euler2axangle
@@ -17,10 +16,48 @@ import hydra
 import improve
 import improve.hydra.resolver
 from improve import cn
-from improve.fm.cache import load_task_embedding, store_task_embedding
+from improve.fm import quant, warmup
+from improve.fm.cache import TextEmbeddingCache, load_task_embedding
 from improve.fm.rt1_model import RT1, detokenize_action
 from improve.wrapper import dict_util as du
 
+# main camera (H, W, 3) of each policy_setup, the shape step sees
+CAMERA = {"google_robot": (512, 640, 3), "widowx_bridge": (480, 640, 3)}
+
+
+def _jnp_rescale(actions, low, high, post_scaling_min, post_scaling_max):
+    """jnp version of RT1Policy._rescale_action_with_bound"""
+    resc = (actions - low) / (high - low) * (
+        post_scaling_max - post_scaling_min
+    ) + post_scaling_min
+    return jnp.clip(resc, post_scaling_min, post_scaling_max)
+
+
+def _jnp_euler2axangle(rpy):
+    """batched transforms3d.euler.euler2axangle (sxyz) scaled by the angle
+    :param rpy: [B, 3] roll, pitch, yaw
+    :returns: [B, 3] axis * angle
+    """
+
+    ai, aj, ak = rpy[:, 0] / 2.0, rpy[:, 1] / 2.0, rpy[:, 2] / 2.0
+    ci, si = jnp.cos(ai), jnp.sin(ai)
+    cj, sj = jnp.cos(aj), jnp.sin(aj)
+    ck, sk = jnp.cos(ak), jnp.sin(ak)
+    cc, cs = ci * ck, ci * sk
+    sc, ss = si * ck, si * sk
+
+    w = cj * cc + sj * ss
+    xyz = jnp.stack([cj * sc - sj * cs, cj * ss + sj * cc, cj * cs - sj * sc], -1)
+
+    # quat2axangle. euler quats are unit norm so no renormalization
+    len2 = jnp.sum(xyz**2, axis=-1, keepdims=True)
+    identity = len2 < (jnp.finfo(xyz.dtype).eps * 3) ** 2
+    # 2 * atan2(|xyz|, w) == 2 * acos(w) but keeps float32 precision near identity
+    norm = jnp.sqrt(jnp.where(identity, 1.0, len2))
+    theta = 2 * jnp.arctan2(norm, w[:, None])
+    ax = xyz / norm
+    return jnp.where(identity, 0.0, ax * theta)
+
 
 class RT1Policy:
     """Runs inference with a RT-1 policy."""
@@ -37,6 +74,7 @@ class RT1Policy:
         policy_setup: str = "google_robot",
         cached=True,
         task=None,
+        precision="fp32",
     ):
         """Initializes the policy.
 
@@ -49,6 +87,8 @@ class RT1Policy:
             ckpt.
           seqlen: The history length to use for observations.
           rng: a jax.random.PRNGKey to use for the random number generator.
+          precision: one of quant.PRECISIONS. bf16 activations and/or
+            int8 weight-only kernels, dequantized inside the jitted forward.
         """
 
 
@@ -56,6 +96,10 @@ class RT1Policy:
         if not variables and not ckpt:
             raise ValueError("At least one of `variables` or `ckpt` must be defined.")
 
+        assert precision in quant.PRECISIONS, precision
+        self.precision = precision
+        self.dtype = jnp.bfloat16 if "bf16" in precision else jnp.float32
+
         self.model = RT1(
             num_image_tokens=model.num_image_tokens,
             num_action_tokens=model.num_action_tokens,
@@ -63,6 +107,7 @@ class RT1Policy:
             vocab_size=model.vocab_size,
             use_token_learner=model.use_token_learner,
             world_vector_range=model.world_vector_range,
+            dtype=self.dtype,
         )
 
         self._checkpoint_path = ckpt
@@ -76,6 +121,13 @@ class RT1Policy:
         self.action_rotation_mode = "axis_angle"
 
         self._run_action_inference_jit = jax.jit(self._run_action_inference)
+        # inference + postprocessing in one program so only [B, 7] leaves the device
+        # the image history lives on device and is updated in place
+        self._act_jit = jax.jit(self._act, donate_argnums=0)
+        # image shape -> aot compiled _act, see warmup
+        self.compiled = {}
+        self._preprocess_jit = jax.jit(self._preprocess)
+        self._postprocess_jit = jax.jit(self._postprocess)
         # for debugging
         # self._run_action_inference_jit = self._run_action_inference
 
@@ -97,21 +149,31 @@ class RT1Policy:
             # print('batch_stats', variables['batch_stats'])
             self.variables = variables
 
-        # following BatchedOctoInference
-        self.hist = deque(maxlen=self.seqlen)
-        self.num_image_history = 0
+        self.variables, _ = quant.prepare(self.variables, precision)
+
+        # [B, seqlen, 300, 300, 3] zero padded history of preprocessed frames
+        self.hist = None
 
         self.cached = cached
         self.task = task
         if self.cached:
             # tensorflow might be taking the memory?
             # but need it if using T5
-            tf.config.experimental.set_visible_devices([], "GPU")
+            if "tensorflow" in sys.modules:
+                tf = sys.modules["tensorflow"]
+                tf.config.experimental.set_visible_devices([], "GPU")
+            encode = None
 
         else:
+            import tensorflow_hub as hub
+
             self.llm = hub.load(
                 "https://tfhub.dev/google/universal-sentence-encoder-large/5"
             )
+            encode = lambda texts: self.llm(texts).numpy()
+
+        # USE is never finetuned so the hub version identifies it
+        self.text_cache = TextEmbeddingCache("use-large-5", encode=encode)
 
         self.policy_setup = policy_setup
         if self.policy_setup == "google_robot":
@@ -129,36 +191,36 @@ class RT1Policy:
 
     def _small_action_filter_google_robot(
         self,
-        raw_action: dict[str, np.ndarray | tf.Tensor],
+        raw_action: dict[str, np.ndarray],
         arm_movement: bool = False,
         gripper: bool = True,
-    ) -> dict[str, np.ndarray | tf.Tensor]:
+    ) -> dict[str, np.ndarray]:
         # small action filtering for google robot
         if arm_movement:
-            raw_action["world_vector"] = tf.where(
-                tf.abs(raw_action["world_vector"]) < 5e-3,
-                tf.zeros_like(raw_action["world_vector"]),
+            raw_action["world_vector"] = np.where(
+                np.abs(raw_action["world_vector"]) < 5e-3,
+                np.zeros_like(raw_action["world_vector"]),
                 raw_action["world_vector"],
             )
-            raw_action["rotation_delta"] = tf.where(
-                tf.abs(raw_action["rotation_delta"]) < 5e-3,
-                tf.zeros_like(raw_action["rotation_delta"]),
+            raw_action["rotation_delta"] = np.where(
+                np.abs(raw_action["rotation_delta"]) < 5e-3,
+                np.zeros_like(raw_action["rotation_delta"]),
                 raw_action["rotation_delta"],
             )
-            raw_action["base_displacement_vector"] = tf.where(
+            raw_action["base_displacement_vector"] = np.where(
                 raw_action["base_displacement_vector"] < 5e-3,
-                tf.zeros_like(raw_action["base_displacement_vector"]),
+                np.zeros_like(raw_action["base_displacement_vector"]),
                 raw_action["base_displacement_vector"],
             )
-            raw_action["base_displacement_vertical_rotation"] = tf.where(
+            raw_action["base_displacement_vertical_rotation"] = np.where(
                 raw_action["base_displacement_vertical_rotation"] < 1e-2,
-                tf.zeros_like(raw_action["base_displacement_vertical_rotation"]),
+                np.zeros_like(raw_action["base_displacement_vertical_rotation"]),
                 raw_action["base_displacement_vertical_rotation"],
             )
         if gripper:
-            raw_action["gripper_closedness_action"] = tf.where(
-                tf.abs(raw_action["gripper_closedness_action"]) < 1e-2,
-                tf.zeros_like(raw_action["gripper_closedness_action"]),
+            raw_action["gripper_closedness_action"] = np.where(
+                np.abs(raw_action["gripper_closedness_action"]) < 1e-2,
+                np.zeros_like(raw_action["gripper_closedness_action"]),
                 raw_action["gripper_closedness_action"],
             )
         return raw_action
@@ -167,44 +229,59 @@ class RT1Policy:
 
         if not self.cached:
             assert instructions is not None
-            self.embeds = []
-            for instr in set(instructions): # only the unique ones
-
-                embeds = self.llm([instr]).numpy()
-                self.embeds.append(embeds)
-                store_task_embedding(embeds, instruction=instr)
-
-                print(embeds.shape)
-
-            print("not cached!")
-            self.embeds = np.array(self.embeds)
-            print(self.embeds.shape)
 
+        # one embedding per env so move near can have different instructions
+        known = instructions is not None and (
+            not self.cached or all(i in self.text_cache for i in instructions)
+        )
+        if known:
+            embeds = self.text_cache.get(instructions)
         else:
-            print("cached!")
-            # self.embeds = np.array([load_task_embedding(instr) for instr in instructions])
             # this is a mess... because of move near task
-            self.embeds = np.array(load_task_embedding(self.task))
-            print(self.embeds.shape)
+            embeds = np.array(load_task_embedding(self.task))
+
+        if len(embeds) == 1:
+            embeds = np.repeat(embeds, self.batch_size, axis=0)
+        assert len(embeds) == self.batch_size, embeds.shape
 
-        self.embeds = np.expand_dims(self.embeds, 1)
+        self.embeds = np.expand_dims(embeds, 1)
         self.embeds = np.repeat(self.embeds, self.seqlen, axis=1)
-        self.embeds = np.repeat(self.embeds, self.batch_size, axis=0)
+        self.embeds = jax.device_put(self.embeds)
 
         print(self.embeds.shape)
 
-        self.hist.clear()
-        self.num_image_history = 0
+        self.hist = jnp.zeros((self.batch_size, self.seqlen, 300, 300, 3))
+
+    def _run_action_inference(self, observation, rng, variables=None):
+        """A jittable function for running inference.
+        batch size comes from the observation so one policy can serve many sizes
+        """
+
+        action_token = self._action_tokens(observation, rng, variables)
+
+        # Detokenize the full action sequence.
+        detokenized = detokenize_action(
+            action_token, self.model.vocab_size, self.model.world_vector_range
+        )
+
+        # if self.batch_size == 1:
+        # detokenized = jax.tree_map(lambda x: x[0], detokenized)
+
+        return detokenized
+
+    def _action_tokens(self, observation, rng, variables=None):
+        """jittable forward up to the [B, 11] action tokens"""
 
-    def _run_action_inference(self, observation, rng):
-        """A jittable function for running inference."""
+        variables = self.variables if variables is None else variables
+        variables = quant.dequantize(variables, self.dtype)
+        bs = observation["image"].shape[0]
 
         # We add zero action tokens so that the shape is (seqlen, 11).
         # Note that in the vanilla RT-1 setup, where
         # `include_prev_timesteps_actions=False`, the network will not use the
         # input tokens and instead uses zero action tokens, thereby not using the
         # action history. We still pass it in for simplicity.
-        act_tokens = jnp.zeros((self.batch_size, 6, 11))
+        act_tokens = jnp.zeros((bs, 6, 11))
 
         # Add a batch dim to the observation.
         # batch_obs = jax.tree_map(lambda x: jnp.expand_dims(x, 0), observation)
@@ -223,7 +300,7 @@ class RT1Policy:
         # pprint(du.apply(observation, lambda x: x.shape))
 
         output_logits = self.model.apply(
-            self.variables,
+            variables,
             observation,
             act=None,
             act_tokens=act_tokens,
@@ -233,88 +310,215 @@ class RT1Policy:
 
         time_step_tokens = self.model.num_image_tokens + self.model.num_action_tokens
         output_logits = jnp.reshape(
-            output_logits, (self.batch_size, self.seqlen, time_step_tokens, -1)
+            output_logits, (bs, self.seqlen, time_step_tokens, -1)
         )
         action_logits = output_logits[:, -1, ...]
         action_logits = action_logits[:, self.model.num_image_tokens - 1 : -1]
+        action_logits = action_logits.astype(jnp.float32)
 
         action_logp = jax.nn.softmax(action_logits)
         action_token = jnp.argmax(action_logp, axis=-1)
+        return action_token
 
-        # Detokenize the full action sequence.
-        detokenized = detokenize_action(
-            action_token, self.model.vocab_size, self.model.world_vector_range
-        )
+    def _preprocess(self, image):
+        """jittable replacement for tf.image.resize(image, (300, 300)) / 225.0
+        tf2 resizes bilinearly with half-pixel centers and no antialiasing
 
-        # if self.batch_size == 1:
-        # detokenized = jax.tree_map(lambda x: x[0], detokenized)
+        :param image: [B, H, W, 3] uint8
+        """
 
-        return detokenized
+        image = jnp.asarray(image, dtype=jnp.float32)
+        shape = (image.shape[0], 300, 300, image.shape[-1])
+        image = jax.image.resize(image, shape, "bilinear", antialias=False)
+        # following OXE
+        return image / 225.0
 
-    def _add_to_history(self, image: np.ndarray) -> None:
-        self.hist.append(image)
-        self.num_image_history = min(self.num_image_history + 1, self.seqlen)
-
-    def _obtain_history(self) -> tuple[np.ndarray, np.ndarray]:
-        ax = 1  # 0 if self.batch_size == 1 else 1
-        observation = np.stack(self.hist, axis=1)  # [: -self.seqlen]
-        if observation.shape[1] < self.seqlen:
-            pad = np.zeros(
-                (
-                    self.batch_size,
-                    self.seqlen - observation.shape[1],
-                    *observation.shape[2:],
-                )
-            )
-            observation = np.concatenate([pad, observation], axis=1)
-        return observation[:, -self.seqlen :]
+    def _act(self, hist, variables, image, embeds, rng):
+        """jittable preprocessing, inference and batched postprocessing
+        variables are an argument, not a closure constant,
+        so the program stays small enough for the persistent compile cache
 
-    def step(self, image):
-        """Outputs the action given observation from the env."""
+        :returns: (hist, raw_action, action)
+        """
 
-        image = copy.deepcopy(image)
+        frame = self._preprocess(image)
+        hist = jnp.concatenate([hist[:, 1:], frame[:, None]], axis=1)
 
-        # Resize using TF image resize to avoid any issues with using different
-        # resize implementation, since we also use tf.image.resize in the data
-        # pipeline. Also scale image to [0, 1].
+        observation = {"image": hist, "natural_language_embedding": embeds}
+        raw_action = self._run_action_inference(observation, rng, variables)
+        return (hist, *self._postprocess(raw_action))
 
-        # following OXE
-        image = tf.image.resize(image, (300, 300)).numpy() / 225.0
+    def _postprocess(self, raw_action):
+        """batched jax version of simpler_postprocessing
 
-        self._add_to_history(image)
-        images = self._obtain_history()
+        :param raw_action: detokenized actions, each value is [B, ...]
+        :returns: (filtered raw_action, [B, 7] world_vector|rot_axangle|gripper)
+        """
 
-        # i think this is for batch? idk
-        # obs, pad_mask = obs[None], pad_mask[None]
+        raw_action = dict(raw_action)
+        if self.policy_setup == "google_robot":
+            gripper = raw_action["gripper_closedness_action"]
+            raw_action["gripper_closedness_action"] = jnp.where(
+                jnp.abs(gripper) < 1e-2, 0.0, gripper
+            )
+        if self.unnormalize_action:
+            raw_action["world_vector"] = _jnp_rescale(
+                raw_action["world_vector"], -1.75, 1.75, -0.05, 0.05
+            )
+            raw_action["rotation_delta"] = _jnp_rescale(
+                raw_action["rotation_delta"], -1.4, 1.4, -0.25, 0.25
+            )
+
+        world_vector = raw_action["world_vector"] * self.action_scale
 
-        observation = {"image": images, "natural_language_embedding": self.embeds}
+        rot = raw_action["rotation_delta"]
+        if self.action_rotation_mode == "axis_angle":
+            angle = jnp.linalg.norm(rot, axis=-1, keepdims=True)
+            ax = jnp.where(
+                angle > 1e-6, rot / jnp.maximum(angle, 1e-6), jnp.array([0.0, 1.0, 0.0])
+            )
+            rot_axangle = ax * angle * self.action_scale
+        elif self.action_rotation_mode in ["rpy", "ypr", "pry"]:
+            order = {"rpy": [0, 1, 2], "ypr": [2, 1, 0], "pry": [1, 0, 2]}
+            rpy = rot[:, order[self.action_rotation_mode]]
+            rot_axangle = _jnp_euler2axangle(rpy) * self.action_scale
+        else:
+            raise NotImplementedError()
+
+        gripper = raw_action["gripper_closedness_action"]
+        if self.invert_gripper_action:
+            gripper = -gripper
+        if self.policy_setup == "widowx_bridge":
+            # binarize gripper action to be -1 or 1
+            gripper = 2.0 * (gripper > 0.0) - 1.0
+
+        action = jnp.concatenate([world_vector, rot_axangle, gripper], axis=-1)
+        return raw_action, action
+
+    def step(self, image, ids=None):
+        """Outputs the action given observation from the env.
+        :param image: [B, H, W, 3] uint8 images, resized on device
+        :param ids: envs of the images, only their history moves (see AsyncVecEnv)
+            every env if None, warm up len(ids) as a batch size
+        """
 
         self.rng, rng = jax.random.split(self.rng)
-        action = self._run_action_inference_jit(observation, rng)
-        action = jax.device_get(action)
+        act = self.compiled.get(image.shape, self._act_jit)
+        if ids is None:
+            self.hist, raw_action, action = act(
+                self.hist, self.variables, image, self.embeds, rng
+            )
+        else:
+            ids = jnp.asarray(ids)
+            hist, raw_action, action = act(
+                self.hist[ids], self.variables, image, self.embeds[ids], rng
+            )
+            self.hist = self.hist.at[ids].set(hist)
+
+        # raw_action stays on device, only the env action is transferred
+        action = np.asarray(jax.device_get(action), dtype=np.float64)
+        action = {
+            "world_vector": action[:, :3],
+            "rot_axangle": action[:, 3:6],
+            "gripper": action[:, 6:],
+            "terminate_episode": raw_action["terminate_episode"],
+        }
+        return raw_action, action
+
+    def warmup(self, batch_sizes=None, image_shape=None, n=5):
+        """aot compiles _act for each batch size so the first env step is not a compile
+        reports compile time separately from steady state latency
 
+        :param batch_sizes: defaults to the configured batch size
+        :param image_shape: camera resolution (H, W, 3), defaults to the policy_setup camera
+            step only hits the compiled cache for this exact shape
         """
-        # Use the base pose mode if the episode if the network outputs an invalid
-        # `terminate_episode` action.
-        if np.sum(action["terminate_episode"]) == 0:
-            action["terminate_episode"] = np.zeros_like(action["terminate_episode"])
-            action["terminate_episode"][-1] = 1
+
+        batch_sizes = [self.batch_size] if batch_sizes is None else batch_sizes
+        image_shape = tuple(image_shape or CAMERA[self.policy_setup])
+        embed_dim = 512  # universal sentence encoder
+
+        def args(bs):
+            hist = jnp.zeros((bs, self.seqlen, 300, 300, 3))
+            image = np.zeros((bs, *image_shape), dtype=np.uint8)
+            embeds = jnp.zeros((bs, self.seqlen, embed_dim))
+            return hist, self.variables, image, embeds, self.rng
+
+        compiled, report = warmup.aot(self._act_jit, args, batch_sizes, n=n)
+        for bs, c in compiled.items():
+            self.compiled[(bs, *image_shape)] = c
+
+        warmup.show(type(self).__name__, report)
+        return report
+
+    def _replay(self, variables, frames, embeds, rng):
+        """jittable, action tokens for every frame of a recorded episode
+        frames go through the same rolling history as step
+
+        :param frames: [T, H, W, 3] uint8
+        :param embeds: [seqlen, D] task embedding
+        :returns: [T, 11] action tokens
         """
 
-        raw_action = action
+        hist = jnp.zeros((1, self.seqlen, 300, 300, 3))
+        embeds = embeds[None]
 
-        # do the postprocessing itemwise without rewriting everything for now
-        a = [du.apply(raw_action, lambda x: x[i]) for i in range(self.batch_size)]
-        b = [du.apply(action, lambda x: x[i]) for i in range(self.batch_size)]
-        raw_action, action = zip(
-            *[self.simpler_postprocessing(_a, _b) for _a, _b in zip(a, b)]
+        def _step(hist, frame):
+            frame = self._preprocess(frame[None])
+            hist = jnp.concatenate([hist[:, 1:], frame[:, None]], axis=1)
+            observation = {"image": hist, "natural_language_embedding": embeds}
+            return hist, self._action_tokens(observation, rng, variables)[0]
+
+        _, tokens = jax.lax.scan(_step, hist, frames)
+        return tokens
+
+    def check_postprocessing(self, n=256, seed=0, atol=1e-5):
+        """parity of the batched jax postprocessing against simpler_postprocessing
+        on n random action tokens
+
+        :returns: max abs difference in the [n, 7] env action
+        """
+
+        tokens = jax.random.randint(
+            jax.random.PRNGKey(seed), (n, 11), 0, self.model.vocab_size
+        )
+        raw = detokenize_action(
+            tokens, self.model.vocab_size, self.model.world_vector_range
         )
-        raw_action, action = du.stack(raw_action), du.stack(action)
+        _, action = jax.device_get(self._postprocess_jit(raw))
+
+        raw = jax.device_get(raw)
+        ref = []
+        for i in range(n):
+            _a = du.apply(raw, lambda x: np.array(x[i]))
+            _, a = self.simpler_postprocessing(_a, None)
+            ref.append(
+                np.concatenate([a["world_vector"], a["rot_axangle"], a["gripper"]])
+            )
+        ref = np.stack(ref)
 
-        return raw_action, action
+        diff = float(np.max(np.abs(ref - action)))
+        assert diff < atol, f"postprocessing mismatch: {diff}"
+        return diff
+
+    def check_preprocessing(self, image, atol=1e-5):
+        """parity of the jax image preprocessing against the tf.image.resize path
+
+        :param image: [B, H, W, 3] uint8
+        :returns: max abs difference of the preprocessed frames
+        """
+
+        import tensorflow as tf
+
+        ref = tf.image.resize(image, (300, 300)).numpy() / 225.0
+        out = jax.device_get(self._preprocess_jit(image))
+
+        diff = float(np.max(np.abs(ref - out)))
+        assert diff < atol, f"preprocessing mismatch: {diff}"
+        return diff
 
     def _unnormalize_action_widowx_bridge(
-        self, action: dict[str, np.ndarray | tf.Tensor]
+        self, action: dict[str, np.ndarray]
     ) -> dict[str, np.ndarray]:
         action["world_vector"] = self._rescale_action_with_bound(
             action["world_vector"],
@@ -334,7 +538,7 @@ class RT1Policy:
 
     @staticmethod
     def _rescale_action_with_bound(
-        actions: np.ndarray | tf.Tensor,
+        actions: np.ndarray,
         low: float,
         high: float,
         safety_margin: float = 0.0,
@@ -423,3 +627,98 @@ class RT1Policy:
         # self.policy_state = policy_step.state
 
         return raw_action, action
+
+
+def compare_precision(
+    variables,
+    frames,
+    embed,
+    model=cn.RT1Model(),
+    precisions=quant.PRECISIONS,
+    batch_sizes=(1, 8),
+):
+    """action token agreement with fp32 and throughput for each precision mode
+
+    :param variables: fp32 RT-1-X variables
+    :param frames: [T, H, W, 3] uint8 recorded observations, replayed through every mode
+    :param embed: [D] task embedding
+    :returns: {precision: {"agreement", "exact", "MiB", "bs=n steps/sec"}}
+    """
+
+    rng = jax.random.PRNGKey(0)
+    tokens, results = {}, {}
+    for precision in precisions:
+        policy = RT1Policy(
+            model=model, variables=variables, batch_size=1, precision=precision
+        )
+        embeds = jnp.broadcast_to(jnp.asarray(embed), (policy.seqlen, len(embed)))
+        replay = jax.jit(policy._replay)
+        tokens[precision] = np.asarray(replay(policy.variables, frames, embeds, rng))
+
+        ref = tokens[precisions[0]]
+        same = tokens[precision] == ref
+        report = policy.warmup(batch_sizes, image_shape=frames.shape[1:])
+        results[precision] = {
+            "agreement": float(same.mean()),  # per action token
+            "exact": float(same.all(-1).mean()),  # whole action
+            "MiB": quant.nbytes(policy.variables) / 2**20,
+            **{f"bs={bs} steps/sec": bs / r["latency"] for bs, r in report.items()},
+        }
+
+    pprint(results)
+    return results
+
+
+def recorded_frames(fnames, n=64):
+    """first n simpler-img frames of recorded rollouts, see data.lorax.find_tarballs"""
+
+    import webdataset as wds
+
+    from improve.data.lorax import preprocess
+
+    dataset = wds.DataPipeline(
+        wds.SimpleShardList(fnames),
+        wds.tarfile_to_samples(),
+        wds.decode(),
+        wds.map(preprocess),
+    )
+    frames = []
+    for obs, *_ in dataset:
+        frames.append(obs["simpler-img"])
+        if sum(len(f) for f in frames) >= n:
+            break
+    return np.concatenate(frames)[:n]
+
+
+@hydra.main(config_path=improve.CONFIG, config_name="config", version_base="1.3.2")
+def main(cfg):
+    """parity check of the batched jax postprocessing for each policy setup"""
+
+    for setup in ["google_robot", "widowx_bridge"]:
+        # postprocessing never touches the weights
+        policy = RT1Policy(
+            model=cn.RT1Model(), variables={"params": None}, policy_setup=setup
+        )
+        print(setup, "max abs diff", policy.check_postprocessing())
+
+    # google robot and widowx camera resolutions
+    for shape in [(2, 512, 640, 3), (2, 480, 640, 3)]:
+        image = np.random.randint(0, 256, shape, dtype=np.uint8)
+        print(shape, "max abs diff", policy.check_preprocessing(image))
+
+    # precision modes on recorded rollouts, needs the rt-1-x checkpoint
+    fm = cfg.env.foundation
+    if fm.name == "rtx" and osp.exists(fm.ckpt):
+        from improve.data.lorax import find_tarballs
+
+        state = checkpoints.restore_checkpoint(fm.ckpt, None)
+        variables = {"params": state["params"], "batch_stats": state["batch_stats"]}
+
+        dname = osp.join(os.environ["HOME"], "improve_logs", "sunny-eon-12", "train")
+        frames = recorded_frames(list(find_tarballs([dname])))
+        embed = np.array(load_task_embedding(fm.task)).reshape(-1)
+        compare_precision(variables, frames, embed)
+
+
+if __name__ == "__main__":
+    main()
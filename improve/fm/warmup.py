@@ -0,0 +1,88 @@
+"""persistent xla compilation cache and startup warmup for fm inference"""
+
+import os
+import os.path as osp
+import time
+from pprint import pprint
+
+import jax
+
+
+def init_compile_cache(cache_dir):
+    """opt-in persistent xla cache shared by every process on the machine
+    subproc workers and reruns load executables from disk instead of recompiling
+
+    :param cache_dir: None leaves the jax defaults alone
+    """
+
+    if cache_dir in [None, "None"]:
+        return
+
+    cache_dir = osp.expanduser(cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    jax.config.update("jax_compilation_cache_dir", cache_dir)
+    # cache every program, not only the ones jax thinks are slow
+    jax.config.update("jax_persistent_cache_min_compile_time_secs", 0)
+    jax.config.update("jax_persistent_cache_min_entry_size_bytes", -1)
+
+
+def latency(fn, args_fn, bs, n=5):
+    """mean steady state seconds per call
+    args are rebuilt outside the timer since they may be donated
+    """
+
+    total = 0.0
+    for _ in range(n):
+        args = jax.block_until_ready(args_fn(bs))
+        tic = time.time()
+        jax.block_until_ready(fn(*args))
+        total += time.time() - tic
+    return total / n
+
+
+def aot(fn, args_fn, batch_sizes, n=5):
+    """lowers and compiles a jitted fn for each batch size, then times the executables
+
+    :param fn: jax.jit wrapped function
+    :param args_fn: batch size -> example args
+    :returns: ({bs: compiled}, {bs: {"compile": s, "latency": s}})
+    """
+
+    compiled, report = {}, {}
+    for bs in batch_sizes:
+        tic = time.time()
+        compiled[bs] = fn.lower(*args_fn(bs)).compile()
+        report[bs] = {
+            "compile": time.time() - tic,
+            "latency": latency(compiled[bs], args_fn, bs, n),
+        }
+    return compiled, report
+
+
+def warmup(fn, args_fn, batch_sizes, n=5):
+    """for python functions that only call jitted code, like octo sample_actions
+    the first call traces and compiles so compile = first call - steady latency
+
+    :returns: {bs: {"compile": s, "latency": s}}
+    """
+
+    report = {}
+    for bs in batch_sizes:
+        tic = time.time()
+        jax.block_until_ready(fn(*args_fn(bs)))
+        first = time.time() - tic
+
+        lat = latency(fn, args_fn, bs, n)
+        report[bs] = {"compile": max(first - lat, 0.0), "latency": lat}
+    return report
+
+
+def show(name, report):
+    pprint(
+        {
+            name: {
+                bs: {k: f"{v * 1e3:.1f} ms" for k, v in r.items()}
+                for bs, r in report.items()
+            }
+        }
+    )
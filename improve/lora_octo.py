@@ -1,5 +1,6 @@
 import os
 import os.path as osp
+import time
 import warnings
 from dataclasses import asdict, dataclass, field
 from functools import partial
@@ -33,10 +34,14 @@ from transformers import FlaxGPT2LMHeadModel
 
 import improve
 import improve.wrapper.dict_util as du
+from improve.data import episode
 from improve.data.lorax import find_tarballs, mk_dataset, preprocess
+from improve.data.shards import ShardDataset
 from improve.env import make_env, make_envs
 from improve.fm.batch_octo import BatchedOctoInference
 from improve.fm.cache import load_task_embedding
+from improve.util.ckpt import LoraCheckpointer
+from improve.util.prefetch import JaxPrefetcher
 
 # prevent tensorflow from using GPU memory since it's only used for data loading
 tf.config.set_visible_devices([], "GPU")
@@ -52,6 +57,17 @@ class MyConfig:
 
     sweep_id: str = "lora"
 
+    scan: int = 4  # updates per dispatch
+    prefetch: int = 2  # stacked batches kept on device
+    log_interval: int = 20
+    eval_interval: int = 100
+    dummy: bool = True  # BUG: dataset is not ready, train on dummy batches
+    shards: Optional[str] = None  # pre-decoded data.shards root, skips decoding
+    bench: bool = False  # report steps/sec before training
+    save_interval: int = 1000
+    save_dir: Optional[str] = None  # lora delta checkpoints, see util.ckpt
+    resume: bool = False  # continue from the latest delta in save_dir
+
     # foundation: Dict[str, Any] = field(default_factory=lambda: {'name': 'octo-base', 'ckpt': None, 'task': 'widowx_put_eggplant_in_basket', 'noact': [-1, -2, -3, -4], 'strategy': 'clip', 'residual_scale': 1.0, 'batch_size': 8})
     # obs_mode: Dict[str, Any] = field(default_factory=lambda: {'name': 'oracle-central', 'mode': 'rgb', 'obs_keys': ['obj-wrt-eef', 'agent_qpos-sin', 'agent_qpos-cos', 'agent_qvel', 'eef-pose', 'agent_partial-action', 'simpler-img']})
     # task: str = '${.foundation.task}'
@@ -77,129 +93,175 @@ class MyConfig:
 cfg = MyConfig()
 
 
-def run(train_state, train_data_iter, train_step, lang, rollout_callback):
+def dummy_batches(lang, batch_size):
+    """BUG: Dummy Data"""
+    while True:
+        yield {
+            "action": np.zeros((batch_size, 5, 7), dtype="float32"),
+            "observation": {
+                "image_primary": np.zeros((batch_size, 2, 256, 256, 3), dtype="uint8"),
+                "pad_mask": np.zeros((batch_size, 2), dtype="int32"),
+            },
+            "task": {"language_instruction": lang},
+        }
+
+
+def stack_batches(it, n):
+    """groups n host batches into one with a leading scan axis"""
+    while True:
+        batches = [next(it) for _ in range(n)]
+        yield jax.tree.map(lambda *x: np.stack(x), *batches)
+
+
+def jit_train_many(train_step, devices):
+    """jits cfg.scan updates per dispatch with lax.scan, data parallel over devices
+    the train state is replicated and donated, batches are split along the batch axis
+
+    :returns: (train_many, replicated sharding, stacked batch sharding)
+    """
+
+    # create a 1D mesh with a single axis named "batch"
+    mesh = Mesh(devices, axis_names="batch")
+    replicated = NamedSharding(mesh, PartitionSpec())
+    # stacked batches are (scan, batch, ...)
+    dp = NamedSharding(mesh, PartitionSpec(None, "batch"))
+
+    def train_many(state, batches):
+        return jax.lax.scan(train_step, state, batches)
+
+    train_many = jax.jit(
+        train_many,
+        in_shardings=(replicated, dp),
+        out_shardings=(replicated, replicated),
+        donate_argnums=0,
+    )
+    return train_many, replicated, dp
+
+
+def bench(train_step, train_state, batch, nsteps=10):
+    """steps/sec of the scanned, sharded train step on cpu and the accelerator
+    more cpu devices with XLA_FLAGS=--xla_force_host_platform_device_count=N
+    """
+
+    backends = ["cpu"]
+    if jax.default_backend() != "cpu":
+        backends.append(jax.default_backend())
+
+    host_state = jax.device_get(train_state)
+    results = {}
+    for backend in backends:
+        devices = jax.devices(backend)
+        train_many, replicated, dp = jit_train_many(train_step, devices)
+        for n in sorted({1, cfg.scan}):
+            batches = jax.device_put(next(stack_batches(iter([batch] * n), n)), dp)
+            state = jax.device_put(host_state, replicated)
+
+            tic = time.time()
+            state, info = jax.block_until_ready(train_many(state, batches))
+            compile_time = time.time() - tic
+
+            tic = time.time()
+            for _ in range(nsteps):
+                state, info = train_many(state, batches)
+            jax.block_until_ready(info)
+            results[f"{backend}x{len(devices)}/scan{n}"] = {
+                "steps/sec": nsteps * n / (time.time() - tic),
+                "compile": compile_time,
+            }
+
+    pprint(results)
+    return results
+
+
+def log_info(update_info, step):
+    """one device_get per log interval, metrics are averaged over the scan"""
+
+    update_info = jax.device_get(update_info)
+    actions = update_info.pop("actions", None)
+    wandb.log(jax.tree.map(np.mean, update_info), step=step)
+
+    if actions is not None:
+        # Log histograms for each component
+        components = ["x", "y", "z", "yaw", "pitch", "roll", "gripper_state"]
+        flattened_actions = actions.reshape(-1, 7)
+        wandb.log(
+            {
+                f"prediction/actions/{component}": wandb.Histogram(
+                    flattened_actions[:, j]
+                )
+                for j, component in enumerate(components)
+            },
+            step=step,
+        )
+
+
+def run(train_state, train_data_iter, train_many, sharding, rollout_callback, ckpt=None):
+    """
+    :param train_many: jitted scan over cfg.scan train steps
+    :param sharding: device sharding for the stacked batches
+    :param ckpt: util.ckpt.LoraCheckpointer, None does not save
+    """
+
+    batches = JaxPrefetcher(
+        stack_batches(train_data_iter, cfg.scan), sharding, size=cfg.prefetch
+    )
+
+    # a resumed state goes on from its step, so saves keep increasing and are not pruned
+    start = int(jax.device_get(train_state.step))
 
     timer = Timer()
     for i in tqdm(
-        range(0, int(cfg.num_steps)),
-        total=int(cfg.num_steps),
+        range(start, int(cfg.num_steps), cfg.scan),
+        total=max(int(cfg.num_steps) - start, 0) // cfg.scan,
         dynamic_ncols=True,
     ):
         timer.tick("total")
 
         with timer("dataset"):
-            # batch = next(train_data_iter)
-            # BUG: Dummy Data
-            batch = {
-                "action": np.zeros((8, 5, 7), dtype="float32"),
-                "observation": {
-                    "image_primary": np.zeros((8, 2, 256, 256, 3), dtype="uint8"),
-                    "pad_mask": np.zeros((8, 2), dtype="int32"),
-                },
-                "task": {
-                    "language_instruction": {
-                        "attention_mask": np.zeros((8, 16), dtype="int64"),
-                        "input_ids": np.zeros((8, 16), dtype="int64"),
-                    }
-                },
-            }
-            batch["task"] = {"language_instruction": lang}
-
-            # print("batch shape:", batch)
-            # batch_spec = jax.tree.map(
-            #     lambda arr: (arr.shape, str(arr.dtype)), batch
-            # )
-            # breakpoint()
-            # {'action': ((8, 5, 7), 'float32'), 'observation': {'image_primary': ((8, 2, 256, 256, 3), 'uint8'), 'pad_mask': ((8, 2), 'int32')}, 'task': {'language_instruction': {'attention_mask': ((8, 16), 'int64'), 'input_ids': ((8, 16), 'int64')}}}
-
-            # print(batch.items())
-            # print(batch["action"])
-            # action': ((8, 5, 7)
+            batch = next(batches)
 
         with timer("train"):
-            train_state, update_info = train_step(train_state, batch)
-            print("-----------\nIn Run function")
-            print(update_info["actions"].shape)
-            # print(update_info)
-            flattened_actions = update_info["actions"].reshape(-1, 7)
-
-            loggedInfo = {x: update_info[x] for x in update_info if x != "actions"}
-
-            wandb.log(loggedInfo, step=i)
-            # wandb.log(update_info, step=i)
-            print("wandb logged for loggedInfo")
-
-            # Log histograms for each component
-            components = ["x", "y", "z", "yaw", "pitch", "roll", "gripper_state"]
-
-            for j, component in enumerate(components):
-                wandb.log(
-                    {
-                        f"prediction/actions/{component}": wandb.Histogram(
-                            flattened_actions[:, j]
-                        )
-                    },
-                    step=i,
-                )
-                print("wandb logged for", component)
+            train_state, update_info = train_many(train_state, batch)
 
         timer.tock("total")
 
-        cfg.eval_interval = 10
-        if (i + 1) % cfg.eval_interval == 0:
+        # steps that end in this dispatch
+        step = i + cfg.scan
+        if step % cfg.log_interval < cfg.scan:
+            log_info(update_info, step)
+            wandb.log({"timer": timer.get_average_times()}, step=step)
+
+        if step % cfg.eval_interval < cfg.scan:
             print("Evaluating...")
             if rollout_callback is not None:
                 with timer("rollout"):
-                    rollout_metrics = rollout_callback(train_state, i + 1)
-                    wandb.log(rollout_metrics, step=i)
-
-        """
-        if (i + 1) % cfg.log_interval == 0:
-            update_info = jax.device_get(update_info)
-            wandb_log(
-                {"training": update_info, "timer": timer.get_average_times()}, step=i
-            )
+                    rollout_metrics = rollout_callback(train_state, step)
+                    wandb.log(rollout_metrics, step=step)
 
-        if (i + 1) % cfg.eval_interval == 0:
-            logging.info("Evaluating...")
+        if ckpt is not None and step % cfg.save_interval < cfg.scan:
+            # must finish before the next dispatch donates the state
+            with timer("save"):
+                ckpt.save(step, train_state.params, train_state.opt_state)
 
-            with timer("val"):
-                val_metrics = val_callback(train_state, i + 1)
-                wandb_log(val_metrics, step=i)
-
-            with timer("visualize"):
-                viz_metrics = viz_callback(train_state, i + 1)
-                wandb_log(viz_metrics, step=i)
-
-            if rollout_callback is not None:
-                with timer("rollout"):
-                    rollout_metrics = rollout_callback(train_state, i + 1)
-                    wandb_log(rollout_metrics, step=i)
-
-        if (i + 1) % cfg.save_interval == 0 and save_dir is not None:
-            logging.info("Saving checkpoint...")
-            save_callback(train_state, i + 1)
-        """
+    if ckpt is not None:
+        ckpt.wait()
+    return train_state
 
 
 def tuple2dict(x):
+    # stay on host, the prefetcher moves whole batches to device
     return {
-        "obs": jax.tree.map(lambda a: jnp.array(a), x[0]),
-        "next_obs": jax.tree.map(lambda a: jnp.array(a), x[1]),
-        "action": jnp.array(x[2]),
-        "reward": jnp.array(x[3]),
-        "done": jnp.array(x[4]),
+        "obs": jax.tree.map(lambda a: np.asarray(a), x[0]),
+        "next_obs": jax.tree.map(lambda a: np.asarray(a), x[1]),
+        "action": np.asarray(x[2]),
+        "reward": np.asarray(x[3]),
+        "done": np.asarray(x[4]),
         # "info": x[5],
     }
 
 
 def make_values(x: dict):
-    rew = x["reward"].tolist()
-
-    for i in range(len(rew) - 2, -1, -1):
-        rew[i] = 0.99 * rew[i + 1]
-    x["value"] = jnp.expand_dims(jnp.array(rew), axis=-1)
-
+    x["value"] = episode.mc_values(x["reward"], 0.99)[:, None]
     return x
 
 
@@ -208,51 +270,13 @@ def future_actions(x: dict):
 
 
 def mk_horizon(x: dict, horizon, key):
-
-    things = x[key]
-    n = things.shape[0]
-    dims = list(things.shape[1:])
-
-    # Create a new array of zeros with shape (n, horizon, 7)
-    new = jnp.zeros([n, horizon] + dims)
-
-    # Use roll to shift the array and vmap to apply it over a range of shifts
-    def get_future(idx):
-        return jnp.stack(
-            [jnp.roll(things, -shift, axis=0)[idx] for shift in range(horizon)], axis=0
-        )
-
-    get_future_vmap = jax.vmap(get_future, in_axes=(0,))
-    new = get_future_vmap(jnp.arange(n))
-
-    # Handle edge cases where we roll beyond the length of the array
-    mask = jnp.arange(n).reshape(-1, 1) + jnp.arange(horizon) < n
-    # new = jnp.where(mask[:, :, None], new, actions[-1])
-
     # should predict 0s when done
-    new = jnp.where(mask[:, :, None], new, jnp.zeros_like(things[-1]))
-
-    x[key] = new
+    x[key] = episode.future(x[key], horizon)
     return x
 
 
-"""
-def split_sample(x, n=8):
-    l = len(x["done"])
-    out = []
-    for i in range(l // n):
-        stop, start = -i * n, -(i + 1) * n
-        out.append(jax.tree.map(lambda a: a[start:stop], x))
-    yield out
-"""
-
-
-def split_sample(x, n=8):
-    l = len(x["done"])
-    out = []
-    for i in range(l):
-        out.append(jax.tree.map(lambda a: a[i], x))
-    return out
+def split_sample(x):
+    return episode.split(x)
 
 
 def dict_collate(samples, combine_tensors=True, combine_scalars=True):
@@ -361,11 +385,8 @@ def octo_dataset(batch_size):
         # wds.to_tuple("png", "json"),
         wds.map(preprocess),
         wds.map(tuple2dict),  # not needed if already dict
-        wds.map(lambda x: mk_horizon(x, 5, "action")),
-        wds.map(make_values),
         # wds.select(lambda x: x['reward'].sum() > 0 ), # only successful episode
-        wds.map(lambda x: mk_horizon(x, 5, "value")),
-        wds.map(split_sample),
+        wds.map(partial(episode.ep2samples, horizon=5)),
         wds.filters.unlisted(),  # (split_sample)
         # wds.to_tuple(),
         # For IterableDataset objects, the batching needs to happen in the dataset.
@@ -391,7 +412,8 @@ def octo_dataset(batch_size):
 @struct.dataclass
 class MyTrainState:
     rng: PRNGKey
-    model: OctoModel
+    # lorax.lora(model) is a callable, not a pytree
+    model: OctoModel = struct.field(pytree_node=False)
     params: Any
     step: int
     opt_state: optax.OptState
@@ -428,7 +450,7 @@ def main():
     # add value readout
 
     # 1. load the dataset
-    dataset = octo_dataset()
+    dataset = octo_dataset(cfg.batch_size)
 
     # dataset = dataset.map(process)
     example_batch = next(iter(dataset))
@@ -455,13 +477,6 @@ def main():
 
     # 2. build the model
 
-    # create a 1D mesh with a single axis named "batch"
-    mesh = Mesh(jax.devices(), axis_names="batch")
-    # Our batches will be data-parallel sharded -- each device will get a slice of the batch
-    dp_sharding = NamedSharding(mesh, PartitionSpec("batch"))
-    # Our model will be replicated across devices (we are only doing data parallelism, not model parallelism)
-    replicated_sharding = NamedSharding(mesh, PartitionSpec())
-
     model_type = "octo-small"
     model_type = f"hf://rail-berkeley/{model_type}"
     pretrained = OctoModel.load_pretrained(model_type)
@@ -616,6 +631,16 @@ def main():
 
     print(type(train_state))
 
+    ckpt = None
+    if cfg.save_dir is not None:
+        ckpt = LoraCheckpointer(cfg.save_dir, lora_spec, model.params)
+        if cfg.resume:
+            step, params, opt_state = ckpt.restore(train_state.params, train_state.opt_state)
+            train_state = train_state.replace(
+                params=params, opt_state=opt_state, step=jnp.asarray(step, dtype=jnp.int32)
+            )
+            print(f"resumed from step {step}")
+
     # lora_transformer = lorax.lora(model.module.octo_transformer)
     # lora_head = lorax.lora(model.module.heads['action'].loss)
 
@@ -639,8 +664,7 @@ def main():
 
     # Data parallelism
     # Model is replicated across devices, data is split across devices
-    # @jax.jit
-    # @partial(jax.jit, in_shardings=[replicated_sharding, dp_sharding])
+    # jitted and scanned by jit_train_many
     def train_step(state, batch):
         rng, dropout_rng = jax.random.split(state.rng)
         (loss, info), grads = jax.value_and_grad(loss_fn, has_aux=True)(
@@ -665,6 +689,20 @@ def main():
         new_state = state.apply_gradients(grads=grads, rng=rng)
         return new_state, info
 
+    if cfg.shards is not None:
+        data = ShardDataset(cfg.shards).batches(cfg.batch_size, seed=cfg.seed)
+    elif cfg.dummy:
+        data = dummy_batches(lang, cfg.batch_size)
+    else:
+        data = iter(dataset)
+    if cfg.bench:
+        bench(train_step, train_state, next(data))
+
+    train_many, replicated, dp = jit_train_many(train_step, jax.devices())
+    # restored leaves are host numpy, place every leaf before the first donated train_many
+    train_state = jax.device_put(train_state, replicated)
+    assert all(isinstance(x, jax.Array) for x in jax.tree.leaves(train_state))
+
     # 4. run the training loop
 
     # TODO: CREATE ENVIRONMENT HERE TO PASS TO RUN
@@ -694,7 +732,7 @@ def main():
         ),
     )
 
-    run(train_state, iter(dataset), train_step, lang, rollout_callback)
+    train_state = run(train_state, data, train_many, dp, rollout_callback, ckpt)
 
     print("ready for lora")
 
@@ -42,6 +42,31 @@ class LinearNormalizer(DictOfTensorMixin):
                     range_eps=range_eps,
                     fit_offset=fit_offset)
     
+    @torch.no_grad()
+    def fit_stats(self,
+        stats: Dict,
+        keys=None,
+        dtype=torch.float32,
+        mode='limits',
+        output_max=1.,
+        output_min=-1.,
+        range_eps=1e-4,
+        fit_offset=True):
+        """fit from precomputed stats instead of the full dataset
+        stats: {key: {'min', 'max', 'mean', 'std'}} see improve.data.stats.load
+        """
+        keys = stats.keys() if keys is None else keys
+        for key in keys:
+            s = {k: torch.as_tensor(np.asarray(stats[key][k]), dtype=dtype)
+                for k in ['min', 'max', 'mean', 'std']}
+            self.params_dict[key] = _fit_stats(
+                s['min'], s['max'], s['mean'], s['std'],
+                mode=mode,
+                output_max=output_max,
+                output_min=output_min,
+                range_eps=range_eps,
+                fit_offset=fit_offset)
+
     def __call__(self, x: Union[Dict, torch.Tensor, np.ndarray]) -> torch.Tensor:
         return self.normalize(x)
     
@@ -211,6 +236,23 @@ def _fit(data: Union[torch.Tensor, np.ndarray, zarr.Array],
     input_mean = data.mean(axis=0)
     input_std = data.std(axis=0)
 
+    return _fit_stats(input_min, input_max, input_mean, input_std,
+        mode=mode,
+        output_max=output_max,
+        output_min=output_min,
+        range_eps=range_eps,
+        fit_offset=fit_offset)
+
+
+def _fit_stats(input_min, input_max, input_mean, input_std,
+        mode='limits',
+        output_max=1.,
+        output_min=-1.,
+        range_eps=1e-4,
+        fit_offset=True):
+    assert mode in ['limits', 'gaussian']
+    assert output_max > output_min
+
     # compute scale and offset
     if mode == 'limits':
         if fit_offset:
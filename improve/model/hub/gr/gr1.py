@@ -28,6 +28,7 @@ from transformers import GPT2Model
 
 import improve
 import improve.model.vision_transformer as vits
+from improve.model.modules.extractor import clip_text_cache
 from improve.model.transformer_utils import get_2d_sincos_pos_embed
 from improve.model.vision_transformer import Block
 from improve.util.loss.mask import masked_loss
@@ -137,9 +138,11 @@ class GR1(nn.Module):
     def init_clip_model(self, model_clip):
         """Initialize CLIP model and freeze its parameters."""
         self.model_clip = model_clip
+        self.text_cache = None
         if self.model_clip is not None:
             for _, param in self.model_clip.named_parameters():
                 param.requires_grad = False
+            self.text_cache = clip_text_cache(self.model_clip)
 
     def init_mae_model(self, model_mae):
         """Initialize MAE model and freeze its parameters."""
@@ -236,7 +239,11 @@ class GR1(nn.Module):
         return self.embed_state(state_emb)
 
     def embed_language_info(self, language):
-        lang_emb = self.model_clip.encode_text(language)
+        """language is either CLIP tokens (long) or cached embeddings (float)"""
+        if language.is_floating_point():
+            lang_emb = language
+        else:
+            lang_emb = self.model_clip.encode_text(language)
         lang_emb = lang_emb / (lang_emb.norm(dim=1, keepdim=True) + 1e-6)
         return self.embed_lang(lang_emb.float())
 
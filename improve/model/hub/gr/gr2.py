@@ -599,6 +599,11 @@ class GR2(nn.Module):
             n_patch_latents=self.n_patch_latents,
         )
 
+    @property
+    def text_cache(self):
+        """cached CLIP text embeddings of the language extractor"""
+        return self.MI.extractor["language"].cache
+
     @classmethod
     def from_hydra(cls, cn, pretrained=None):
 
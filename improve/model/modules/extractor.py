@@ -4,14 +4,31 @@ import torch.nn.functional as F
 import transformers
 from clip import clip
 from flamingo_pytorch import PerceiverResampler
+from improve.fm.cache import TextEmbeddingCache, fingerprint
 from improve.wrapper import dict_util as du
 from omegaconf import OmegaConf as OC
 from transformers import GPT2Model
 
 
+def clip_text_cache(llm):
+    """TextEmbeddingCache for a frozen CLIP model
+    keyed by a hash of its weights so different backbones never collide
+    """
+
+    named = ((k, v.detach().float().cpu().numpy()) for k, v in llm.state_dict().items())
+
+    @torch.no_grad()
+    def encode(texts):
+        device = next(llm.parameters()).device
+        tokens = clip.tokenize(texts).to(device)
+        return llm.encode_text(tokens).float().cpu().numpy()
+
+    return TextEmbeddingCache(f"clip-{fingerprint(named)}", encode=encode)
+
+
 class LanguageExtractor(nn.Module):
 
-    def __init__(self, llm, lang_feat_dim, hidden_size):
+    def __init__(self, llm, lang_feat_dim, hidden_size, cache=None):
         super(LanguageExtractor, self).__init__()
 
         self.hidden_size = hidden_size
@@ -26,11 +43,25 @@ class LanguageExtractor(nn.Module):
             for _, param in self.llm.named_parameters():
                 param.requires_grad = False
 
+        # CLIP is frozen so text embeddings are looked up instead of recomputed
+        if cache is None and self.llm is not None:
+            cache = clip_text_cache(self.llm)
+        self.cache = cache
+
     def tokenize(self, str):
         return self.tokenizer(str)
 
+    def lookup(self, texts, device=None):
+        """cached CLIP text embeddings for a list of instructions"""
+        return torch.from_numpy(self.cache.get(texts)).to(device)
+
     def forward(self, language):
-        lang = self.llm.encode_text(language)
+        """language is either CLIP tokens (long) or precomputed embeddings (float)"""
+
+        if language.is_floating_point():
+            lang = language
+        else:
+            lang = self.llm.encode_text(language)
         lang = lang / (lang.norm(dim=1, keepdim=True) + 1e-6)
         return self.embed(lang.float())
 
@@ -32,12 +32,74 @@ def advantage_loss(
 from functools import partial
 
 
-def mk_octo_adv_loss(model, beta):
-    return partial(octo_adv_loss_fn, model=model, beta=beta)
+def mk_octo_adv_loss(model, beta, **kwargs):
+    """
+    :param kwargs: num_samples, num_steps, fused, return_candidates
+    see octo_adv_loss_fn
+    """
+    return partial(octo_adv_loss_fn, model=model, beta=beta, **kwargs)
+
+
+def sample_candidates(head, embeds, rng, num_samples=3, num_steps=None):
+    """diffusion proposals for the advantage baseline
+    every denoising step of every sample is a candidate
+
+    :param num_steps: keep only the last (least noisy) num_steps, None keeps all
+    :returns: (n, b, w, p, a) with n = num_samples * num_steps
+    """
+
+    candidates = predict_actions(
+        head,
+        embeds,
+        rng=rng,
+        train=False,
+        sample_shape=(num_samples),
+    )
+    if num_steps is not None:
+        candidates = candidates[:, :, -num_steps:]
+    return rearrange(candidates, "s b d w p a -> (s d) b w p a")
+
+
+def score_candidates(head, embeds, actions, candidates):
+    """chunk-level values of the dataset actions and the candidates
+    in a single batched value head call
+
+    :param actions: (b, w, p, a) chunked dataset actions or None
+    :param candidates: (n, b, w, p, a)
+    :returns: q (b,) or None, values (n, b)
+    """
+
+    both = candidates if actions is None else jnp.concatenate([actions[None], candidates])
+    values = head(embeds, both, train=False)  # (1 + n, b, w, p, 1)
+    values = values.squeeze(-1).mean(-1)[:, :, -1]  # (1 + n, b)
+
+    if actions is None:
+        return None, values
+    return values[0], values[1:]
 
 
 @lorax.lora
-def octo_adv_loss_fn(params, batch, rng, train, model, beta, dist_fn=jnp.exp):
+def octo_adv_loss_fn(
+    params,
+    batch,
+    rng,
+    train,
+    model,
+    beta,
+    dist_fn=jnp.exp,
+    num_samples=3,
+    num_steps=None,
+    fused=True,
+    return_candidates=False,
+):
+    """
+    :param num_samples: diffusion samples per step, see sample_candidates
+    :param num_steps: denoising steps kept per sample, see sample_candidates
+    :param fused: score dataset actions and candidates in one value head call
+    :param return_candidates: adds metrics["candidates"]. pass them back as
+        batch["candidates"] to skip resampling on the next step
+    """
+
     bound = model.module.bind({"params": params}, rngs={"dropout": rng})
 
     embeds = bound.octo_transformer(
@@ -56,27 +118,26 @@ def octo_adv_loss_fn(params, batch, rng, train, model, beta, dist_fn=jnp.exp):
         train=train,
     )
 
-    candidates = predict_actions(
-        bound.heads["action"],
-        embeds,
-        rng=rng,
-        train=False,
-        sample_shape=(3),
-    )
-
-    # final = candidates[-1]  # or something like this
+    candidates = batch.get("candidates")
+    if candidates is None:
+        candidates = sample_candidates(
+            bound.heads["action"], embeds, rng, num_samples, num_steps
+        )
+    candidates = jax.lax.stop_gradient(candidates)
 
-    def toval(x):
-        return bound.heads["value"](embeds, x, train=False)
+    chunked = chunk_actions(batch["action"], bound.heads["action"].pred_horizon)
+    if fused:
+        q, values = score_candidates(bound.heads["value"], embeds, chunked, candidates)
+    else:
 
-    candidates = rearrange(candidates, "s b d w p a -> (s d) b w p a")
+        def toval(x):
+            return bound.heads["value"](embeds, x, train=False)
 
-    values = jax.vmap(toval)(candidates)  # (60, 64, 2, 4, 1)
-    values = values.squeeze(-1).mean(-1)[:, :, -1]  # (60,64)
+        values = jax.vmap(toval)(candidates)  # (60, 64, 2, 4, 1)
+        values = values.squeeze(-1).mean(-1)[:, :, -1]  # (60,64)
 
-    chunked = chunk_actions(batch["action"], bound.heads["action"].pred_horizon)
-    q = bound.heads["value"](embeds, chunked, train=False)
-    q = q.squeeze(-1).mean(-1)[:, -1]  # (64)
+        q = bound.heads["value"](embeds, chunked, train=False)
+        q = q.squeeze(-1).mean(-1)[:, -1]  # (64)
 
     action_metrics["q"] = q.mean()
     action_metrics["value"] = values.mean()
@@ -103,9 +164,48 @@ def octo_adv_loss_fn(params, batch, rng, train, model, beta, dist_fn=jnp.exp):
 
     loss = action_loss + value_loss
     metrics = {"action": action_metrics, "value": value_metrics}
+    if return_candidates:
+        metrics["candidates"] = candidates
     return loss, metrics
 
 
+def bench_adv_loss(model, params, batch, settings=((1, 5), (3, 5), (3, None), (5, None)), n=10):
+    """time and memory per step of octo_adv_loss_fn grads for several candidate counts
+    fused vs the vmapped value head
+
+    :param settings: (num_samples, num_steps) pairs
+    """
+
+    import time
+    from pprint import pprint
+
+    rng = jax.random.PRNGKey(0)
+    results = {}
+    for num_samples, num_steps in settings:
+        for fused in [True, False]:
+            loss_fn = mk_octo_adv_loss(
+                model, beta=3.0, num_samples=num_samples, num_steps=num_steps, fused=fused
+            )
+            step = jax.jit(
+                lambda p, b, r: jax.grad(loss_fn, has_aux=True)(p, b, r, train=True)
+            )
+            compiled = step.lower(params, batch, rng).compile()
+            mem = compiled.memory_analysis()
+            mem = None if mem is None else mem.temp_size_in_bytes / 2**20
+
+            jax.block_until_ready(compiled(params, batch, rng))
+            tic = time.time()
+            for _ in range(n):
+                out = compiled(params, batch, rng)
+            jax.block_until_ready(out)
+
+            key = f"samples={num_samples} steps={num_steps} fused={fused}"
+            results[key] = {"ms/step": 1e3 * (time.time() - tic) / n, "temp MiB": mem}
+
+    pprint(results)
+    return results
+
+
 def mk_model_step(model, state):
 
     @lorax.lora
@@ -121,21 +221,10 @@ def mk_model_step(model, state):
             train=train,
         )
 
-        candidates = predict_actions(
-            bound.heads["action"],
-            embeds,
-            rng=state.rng,
-            train=False,
-            sample_shape=(5),
+        candidates = sample_candidates(
+            bound.heads["action"], embeds, state.rng, num_samples=5
         )
-
-        def toval(x):
-            return bound.heads["value"](embeds, x, train=False)
-
-        candidates = rearrange(candidates, "s b d w p a -> (s d) b w p a")
-
-        values = jax.vmap(toval)(candidates)  # (60, 64, 2, 4, 1)
-        values = values.squeeze(-1).mean(-1)[:, :, -1]  # (60,64)
+        _, values = score_candidates(bound.heads["value"], embeds, None, candidates)
 
         candidates = candidates[:, :, -1]  # (s d) b p a
         actions = candidates[values.argmax(0)]
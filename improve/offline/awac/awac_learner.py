@@ -15,8 +15,7 @@ from improve.jaxrl.networks import critic_net, policies
 from improve.jaxrl.networks.common import InfoDict, Model, PRNGKey
 
 
-@functools.partial(jax.jit, static_argnames=("update_target", "num_samples"))
-def _update_jit(
+def _update(
     rng: PRNGKey,
     actor: Model,
     critic: Model,
@@ -33,10 +32,16 @@ def _update_jit(
     new_critic, critic_info = sac_critic.update(
         key, actor, critic, target_critic, None, batch, discount, soft_critic=False
     )
-    if update_target:
-        new_target_critic = sac_critic.target_update(new_critic, target_critic, tau)
-    else:
-        new_target_critic = target_critic
+    if isinstance(update_target, bool):
+        if update_target:
+            new_target_critic = sac_critic.target_update(new_critic, target_critic, tau)
+        else:
+            new_target_critic = target_critic
+    else:  # traced inside a scan
+        updated = sac_critic.target_update(new_critic, target_critic, tau)
+        new_target_critic = jax.tree.map(
+            lambda a, b: jnp.where(update_target, a, b), updated, target_critic
+        )
 
     rng, key = jax.random.split(rng)
     new_actor, actor_info = awr_actor.update(
@@ -46,6 +51,91 @@ def _update_jit(
     return rng, new_actor, new_critic, new_target_critic, {**critic_info, **actor_info}
 
 
+_update_jit = jax.jit(_update, static_argnames=("update_target", "num_samples"))
+
+
+def _sample(data: Batch, key: PRNGKey, batch_size: int) -> Batch:
+    """uniform minibatch from a dataset that is already on device"""
+    size = len(jax.tree.leaves(data)[0])
+    idx = jax.random.randint(key, (batch_size,), 0, size)
+    return jax.tree.map(lambda x: x[idx], data)
+
+
+@functools.partial(
+    jax.jit,
+    static_argnames=("num_samples", "target_update_period", "k", "batch_size"),
+    donate_argnums=(1, 2, 3),
+)
+def _update_many_jit(
+    rng: PRNGKey,
+    actor: Model,
+    critic: Model,
+    target_critic: Model,
+    batches: Batch,
+    data: Batch,
+    step: jnp.ndarray,
+    discount: float,
+    tau: float,
+    num_samples: int,
+    beta: float,
+    target_update_period: int,
+    k: int,
+    batch_size: int,
+) -> Tuple[PRNGKey, Model, Model, Model, InfoDict]:
+    """k updates in one lax.scan over either stacked batches or minibatches
+    sampled on device from data. the train states are donated
+    """
+
+    def body(carry, batch):
+        rng, actor, critic, target_critic, step = carry
+        if batch is None:
+            rng, key = jax.random.split(rng)
+            batch = _sample(data, key, batch_size)
+
+        step = step + 1
+        rng, actor, critic, target_critic, info = _update(
+            rng,
+            actor,
+            critic,
+            target_critic,
+            batch,
+            discount,
+            tau,
+            num_samples,
+            beta,
+            step % target_update_period == 0,
+        )
+        return (rng, actor, critic, target_critic, step), info
+
+    carry = (rng, actor, critic, target_critic, step)
+    carry, info = jax.lax.scan(body, carry, batches, length=k)
+    rng, actor, critic, target_critic, _ = carry
+    return rng, actor, critic, target_critic, info
+
+
+class DeviceSampler(object):
+    """keeps an in-memory offline dataset on device
+    so minibatches are sampled inside the compiled update loop
+
+    :param dataset: jaxrl Dataset or anything with the Batch fields
+    """
+
+    def __init__(self, dataset):
+        self.data = jax.device_put(
+            Batch(
+                observations=dataset.observations,
+                actions=dataset.actions,
+                rewards=dataset.rewards,
+                masks=dataset.masks,
+                next_observations=dataset.next_observations,
+            )
+        )
+        self.size = len(jax.tree.leaves(self.data)[0])
+
+    def sample(self, key: PRNGKey, batch_size: int) -> Batch:
+        return _sample(self.data, key, batch_size)
+
+
 class AWACLearner(object):
 
     def __init__(
@@ -138,3 +228,93 @@ class AWACLearner(object):
         self.target_critic = new_target_network
 
         return info
+
+    def _update_many(self, batches, data, k, batch_size) -> InfoDict:
+        new_rng, new_actor, new_critic, new_target_network, info = _update_many_jit(
+            self.rng,
+            self.actor,
+            self.critic,
+            self.target_critic,
+            batches,
+            data,
+            jnp.asarray(self.step),
+            self.discount,
+            self.tau,
+            self.num_samples,
+            self.beta,
+            self.target_update_period,
+            k,
+            batch_size,
+        )
+        self.step += k
+
+        self.rng = new_rng
+        self.actor = new_actor
+        self.critic = new_critic
+        self.target_critic = new_target_network
+
+        return info
+
+    def update_many(self, batches: Batch) -> InfoDict:
+        """one update per batch in a single dispatch
+        :param batches: Batch stacked on a leading axis, or a list of Batch
+        :returns: info stacked on the leading axis
+        """
+
+        if isinstance(batches, (list, tuple)) and not isinstance(batches, Batch):
+            batches = jax.tree.map(lambda *x: np.stack(x), *batches)
+        k = len(jax.tree.leaves(batches)[0])
+        return self._update_many(batches, None, k, None)
+
+    def update_sampled(
+        self, sampler: DeviceSampler, k: int, batch_size: int = 256
+    ) -> InfoDict:
+        """k updates on minibatches sampled on device, nothing leaves the device"""
+        return self._update_many(None, sampler.data, k, batch_size)
+
+
+def main():
+    """updates/sec of update() vs update_sampled() for k in 1, 10, 100"""
+
+    import time
+    from pprint import pprint
+
+    n, obs_dim, act_dim, batch_size = 100_000, 32, 7, 256
+    rand = lambda *shape: np.random.rand(*shape).astype(np.float32)
+    dataset = Batch(
+        observations=rand(n, obs_dim),
+        actions=rand(n, act_dim) * 2 - 1,
+        rewards=rand(n),
+        masks=np.ones(n, dtype=np.float32),
+        next_observations=rand(n, obs_dim),
+    )
+
+    agent = AWACLearner(0, dataset.observations[:1], dataset.actions[:1])
+    sampler = DeviceSampler(dataset)
+    results = {}
+
+    def host_batch():
+        idx = np.random.randint(0, n, batch_size)
+        return Batch(*[x[idx] for x in dataset])
+
+    info = agent.update(host_batch())  # compile
+    jax.block_until_ready(info)
+    tic, nupdates = time.time(), 500
+    for _ in range(nupdates):
+        info = agent.update(host_batch())
+    jax.block_until_ready(info)
+    results["update"] = nupdates / (time.time() - tic)
+
+    for k in [1, 10, 100]:
+        jax.block_until_ready(agent.update_sampled(sampler, k, batch_size))  # compile
+        tic, ncalls = time.time(), max(500 // k, 5)
+        for _ in range(ncalls):
+            info = agent.update_sampled(sampler, k, batch_size)
+        jax.block_until_ready(info)
+        results[f"update_sampled k={k}"] = ncalls * k / (time.time() - tic)
+
+    pprint({k: f"{v:.0f} updates/sec" for k, v in results.items()})
+
+
+if __name__ == "__main__":
+    main()
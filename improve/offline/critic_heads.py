@@ -158,8 +158,11 @@ class ContinuousCriticHead(nn.Module, CriticHead):
         train: bool = True,
     ) -> jax.Array:
         """
+        Args:
+            actions: (..., batch_size, window_size, pred_horizon, action_dim)
+                leading dims score many action sets against one set of embeddings
         Returns:
-            mean: Predicted values w/ shape (batch_size, window_size, pred_horizon, dim)
+            mean: Predicted values w/ shape (..., batch_size, window_size, pred_horizon, dim)
         """
         token_group = transformer_outputs[self.readout_key]
 
@@ -180,15 +183,22 @@ class ContinuousCriticHead(nn.Module, CriticHead):
                 (bs, self.obs_horizon, self.pred_horizon, self.action_dim)
             )
 
-        actions = rearrange(actions, "b w p a -> b w (p a)")
-        act_emb = self.action_embed(actions)  # [bs, 2 , 384]
+        actions = rearrange(actions, "... b w p a -> ... b w (p a)")
+        act_emb = self.action_embed(actions)  # [..., bs, 2 , 384]
+
+        # pooled once, shared by every action set
+        embeddings = jnp.broadcast_to(
+            embeddings, (*act_emb.shape[:-1], embeddings.shape[-1])
+        )
 
-        # [bs, 2, 768]
+        # [..., bs, 2, 768]
         both = jnp.concatenate([embeddings, act_emb], axis=-1)
         output = self.dense1(both)
 
         mean = self.mean_proj(output)
-        mean = rearrange(mean, "b w (p a) -> b w p a", p=self.pred_horizon, a=self.dim)
+        mean = rearrange(
+            mean, "... b w (p a) -> ... b w p a", p=self.pred_horizon, a=self.dim
+        )
 
         mean = jnp.tanh(mean / self.max_critic) * self.max_critic
         return mean
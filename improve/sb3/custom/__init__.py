@@ -1,5 +1,6 @@
 from .chef import CHEF
 from .evaluation import evaluate_policy
+from .her import VecHerReplayBuffer
 from .ppo import PPO
 from .rp_sac import RP_SAC
 from .sac import SAC
@@ -22,6 +22,8 @@ from stable_baselines3.common.vec_env import VecEnv
 from stable_baselines3.her.her_replay_buffer import HerReplayBuffer
 from stable_baselines3.common.off_policy_algorithm import OffPolicyAlgorithm
 
+from improve.sb3.custom.her import VecHerReplayBuffer
+
 
 SelfOffPolicyAlgorithm = TypeVar("SelfOffPolicyAlgorithm", bound="OffPolicyAlgorithm")
 
@@ -253,6 +255,8 @@ class CHEF(BaseAlgorithm):
             self.replay_buffer.set_env(self.env)
             if truncate_last_traj:
                 self.replay_buffer.truncate_last_trajectory()
+        elif isinstance(self.replay_buffer, VecHerReplayBuffer) and truncate_last_traj:
+            self.replay_buffer.truncate_last_trajectory()
 
         # Update saved replay buffer device to match current setting, see GH#1561
         self.replay_buffer.device = self.device
@@ -371,6 +375,7 @@ class CHEF(BaseAlgorithm):
         learning_starts: int,
         action_noise: Optional[ActionNoise] = None,
         n_envs: int = 1,
+        obs: Optional[Union[np.ndarray, Dict[str, np.ndarray]]] = None,
     ) -> Tuple[np.ndarray, np.ndarray]:
         """
         Sample an action according to the exploration policy.
@@ -383,6 +388,7 @@ class CHEF(BaseAlgorithm):
             in addition to the stochastic policy for SAC.
         :param learning_starts: Number of steps before learning for the warm-up phase.
         :param n_envs:
+        :param obs: policy input, ``self._last_obs`` if None (a subset of the envs when async)
         :return: action to take in the environment
             and scaled action that will be stored in the replay buffer.
             The two differs when the action space is not normalized (bounds are not [-1, 1]).
@@ -402,7 +408,8 @@ class CHEF(BaseAlgorithm):
             # we assume that the policy uses tanh to scale the action
             # We use non-deterministic action in the case of SAC, for TD3, it does not matter
             assert self._last_obs is not None, "self._last_obs was not set"
-            unscaled_action, _ = self.predict(self._last_obs, deterministic=False)
+            obs = self._last_obs if obs is None else obs
+            unscaled_action, _ = self.predict(obs, deterministic=False)
 
         # Rescale the action from [low, high] to [-1, 1]
         if isinstance(self.action_space, spaces.Box):
@@ -0,0 +1,247 @@
+"""
+vectorized hindsight experience replay
+
+a drop-in for sb3's HerReplayBuffer with CHEF / SAC / TQC
+(replay_buffer_class=VecHerReplayBuffer, replay_buffer_kwargs={goal_selection_strategy, n_sampled_goal})
+
+    sb3                                         here
+    rewards via env.env_method("compute_reward")  goal_reward on the sampled arrays, no env round trip
+    real and virtual halves gathered, th.cat      one gather, goals overwritten in place
+    an info dict per stored transition            no infos, GoalEnvWrapper rewards only use goals
+    desired_goal stored in obs and next_obs       stored once, it is constant within an episode
+
+transitions of an env are contiguous in time, so an episode is the slice
+ep_start[i] .. ep_start[i] + ep_length[i] (mod buffer_size) of its env column
+"""
+
+import time
+from functools import partial
+from pprint import pprint
+
+import numpy as np
+from gymnasium import spaces
+from stable_baselines3.common.buffers import DictReplayBuffer
+from stable_baselines3.common.type_aliases import DictReplayBufferSamples
+
+from improve.wrapper.goalenv import goal_reward
+
+STRATEGIES = ["future", "final", "episode"]
+
+
+class VecHerReplayBuffer(DictReplayBuffer):
+    """
+    :param n_sampled_goal: virtual transitions per real one, her_ratio = 1 - 1 / (n + 1)
+    :param goal_selection_strategy: future, final or episode
+    :param compute_reward: (achieved [b, ...], desired [b, ...]) -> [b] rewards
+        defaults to GoalEnvWrapper's tolerance check over the goal dims
+    """
+
+    def __init__(
+        self,
+        buffer_size,
+        observation_space,
+        action_space,
+        device="auto",
+        n_envs=1,
+        optimize_memory_usage=False,
+        handle_timeout_termination=True,
+        n_sampled_goal=4,
+        goal_selection_strategy="future",
+        compute_reward=None,
+        env=None,  # unused, accepted so HerReplayBuffer configs still work
+    ):
+        assert not optimize_memory_usage, "HER needs next_observations"
+        assert isinstance(observation_space, spaces.Dict)
+        assert goal_selection_strategy in STRATEGIES, f"strategy must be one of {STRATEGIES}"
+        super().__init__(
+            buffer_size,
+            observation_space,
+            action_space,
+            device=device,
+            n_envs=n_envs,
+            handle_timeout_termination=handle_timeout_termination,
+        )
+        # DictReplayBuffer.add only writes the keys allocated here
+        del self.next_observations["desired_goal"]
+
+        self.n_sampled_goal = n_sampled_goal
+        self.her_ratio = 1 - (1.0 / (n_sampled_goal + 1))
+        self.strategy = goal_selection_strategy
+
+        ndim = len(observation_space["achieved_goal"].shape)
+        self.compute_reward = compute_reward or partial(goal_reward, ndim=ndim)
+
+        self.ep_start = np.zeros((self.buffer_size, self.n_envs), dtype=np.int64)
+        self.ep_length = np.zeros((self.buffer_size, self.n_envs), dtype=np.int64)
+        self._current_ep_start = np.zeros(self.n_envs, dtype=np.int64)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("env", None)
+        return state
+
+    def add(self, obs, next_obs, action, reward, done, infos):
+        # an episode is dropped whole as soon as its first transition is overwritten
+        for i in np.flatnonzero(self.ep_length[self.pos] > 0):
+            end = self.ep_start[self.pos, i] + self.ep_length[self.pos, i]
+            self.ep_length[np.arange(self.pos, end) % self.buffer_size, i] = 0
+
+        self.ep_start[self.pos] = self._current_ep_start
+        super().add(obs, next_obs, action, reward, done, infos)
+
+        for i in np.flatnonzero(done):
+            self._close_episode(i)
+
+    def _close_episode(self, i):
+        start, end = self._current_ep_start[i], self.pos
+        if end < start:  # wrapped around the end of the buffer
+            end += self.buffer_size
+        self.ep_length[np.arange(start, end) % self.buffer_size, i] = end - start
+        self._current_ep_start[i] = self.pos
+
+    def truncate_last_trajectory(self):
+        """ends the running episode of every env, ie: after loading a saved buffer"""
+        for i in np.flatnonzero(self._current_ep_start != self.pos):
+            self.dones[(self.pos - 1) % self.buffer_size, i] = True
+            self._close_episode(i)
+
+    def goal_indices(self, batch_inds, env_inds):
+        """buffer rows of the relabeling goals, one per sampled transition"""
+
+        start = self.ep_start[batch_inds, env_inds]
+        length = self.ep_length[batch_inds, env_inds]
+
+        if self.strategy == "final":
+            offset = length - 1
+        elif self.strategy == "future":  # inclusive of the current transition, like sb3
+            current = (batch_inds - start) % self.buffer_size
+            offset = np.random.randint(current, length)
+        else:  # episode
+            offset = np.random.randint(0, length)
+        return (start + offset) % self.buffer_size
+
+    def sample(self, batch_size, env=None):
+        valid = np.flatnonzero(self.ep_length > 0)
+        if not len(valid):
+            raise RuntimeError("no finished episode yet, learning_starts should be longer than an episode")
+
+        batch_inds, env_inds = np.unravel_index(
+            np.random.choice(valid, size=batch_size, replace=True), self.ep_length.shape
+        )
+        return self._get_samples(batch_inds, env_inds, env)
+
+    def _get_samples(self, batch_inds, env_inds, env=None):
+        """the first her_ratio of the batch is relabeled with hindsight goals"""
+
+        obs = {k: x[batch_inds, env_inds] for k, x in self.observations.items()}
+        next_obs = {k: x[batch_inds, env_inds] for k, x in self.next_observations.items()}
+        rewards = self.rewards[batch_inds, env_inds].astype(np.float32)
+
+        n = int(self.her_ratio * len(batch_inds))
+        if n:
+            goals = self.next_observations["achieved_goal"][self.goal_indices(batch_inds[:n], env_inds[:n]), env_inds[:n]]
+            obs["desired_goal"][:n] = goals
+            # r_t = reward(s_{t+1}, g), so the next achieved goal is compared
+            rewards[:n] = self.compute_reward(next_obs["achieved_goal"][:n], goals)
+        next_obs["desired_goal"] = obs["desired_goal"]
+
+        obs, next_obs = self._normalize_obs(obs, env), self._normalize_obs(next_obs, env)
+        dones = self.dones[batch_inds, env_inds] * (1 - self.timeouts[batch_inds, env_inds])
+        return DictReplayBufferSamples(
+            observations={k: self.to_torch(x) for k, x in obs.items()},
+            actions=self.to_torch(self.actions[batch_inds, env_inds]),
+            next_observations={k: self.to_torch(x) for k, x in next_obs.items()},
+            dones=self.to_torch(dones).reshape(-1, 1),
+            rewards=self.to_torch(self._normalize_reward(rewards.reshape(-1, 1), env)),
+        )
+
+
+#
+# bench
+#
+
+
+def fill(buffer, space, n, ep_len=60, seed=0):
+    """n vec steps of random episodes, the goal is hit 10% of the time"""
+
+    rng = np.random.default_rng(seed)
+    n_envs = buffer.n_envs
+
+    def _obs(goal=None):
+        obs = {k: np.stack([s.sample() for _ in range(n_envs)]) for k, s in space.spaces.items()}
+        if goal is not None:  # goals are fixed for an episode
+            obs["desired_goal"] = goal
+        return obs
+
+    obs = _obs()
+    action = np.zeros((n_envs, *buffer.action_space.shape), dtype=np.float32)
+    for t in range(n):
+        next_obs = _obs(obs["desired_goal"])
+        hit = rng.random(n_envs) < 0.1
+        next_obs["achieved_goal"][hit] = obs["desired_goal"][hit]
+        done = np.full(n_envs, (t + 1) % ep_len == 0)
+        infos = [{"is_success": h} for h in hit]
+        buffer.add(obs, next_obs, action, hit.astype(np.float32), done, infos)
+        obs = _obs() if done[0] else next_obs
+    return buffer
+
+
+def bench(goal_shape=(3,), n_envs=8, size=int(1e5), batch_size=256, n=200):
+    """sample() per second of sb3's HerReplayBuffer vs VecHerReplayBuffer
+
+    :param goal_shape: (3,) for positions, (h, w, 3) for image goals like simpler-img
+    """
+
+    import gymnasium as gym
+    from stable_baselines3 import HerReplayBuffer
+    from stable_baselines3.common.vec_env import SubprocVecEnv
+
+    dtype = np.uint8 if len(goal_shape) == 3 else np.float32
+    high = 255 if dtype == np.uint8 else 1
+    g = spaces.Box(0, high, goal_shape, dtype)
+    space = spaces.Dict({"obs": spaces.Box(-1, 1, (16,)), "achieved_goal": g, "desired_goal": g})
+    act = spaces.Box(-1, 1, (7,))
+
+    class Goal(gym.Env):  # sb3 calls compute_reward through the vec env
+        observation_space, action_space = space, act
+
+        def compute_reward(self, achieved_goal, desired_goal, info):
+            return goal_reward(achieved_goal, desired_goal, ndim=len(goal_shape))
+
+    # like make_envs, so compute_reward is a round trip to a worker
+    venv = SubprocVecEnv([Goal])
+    buffers = {
+        "sb3": HerReplayBuffer(size, space, act, env=venv, n_envs=n_envs, device="cpu"),
+        "vec": VecHerReplayBuffer(size, space, act, n_envs=n_envs, device="cpu"),
+    }
+
+    results = {}
+    for name, buffer in buffers.items():
+        fill(buffer, space, size // n_envs)
+        buffer.sample(batch_size)
+        tic = time.time()
+        for _ in range(n):
+            buffer.sample(batch_size)
+        results[name] = {
+            "samples/sec": round(n * batch_size / (time.time() - tic)),
+            "MiB": round(nbytes(buffer) / 2**20),
+        }
+    venv.close()
+    return results
+
+
+def nbytes(buffer):
+    """bytes of the stored arrays, python objects like sb3's infos not included"""
+    arrays = [x for x in vars(buffer).values() if isinstance(x, np.ndarray)]
+    arrays += [*buffer.observations.values(), *buffer.next_observations.values()]
+    return sum(x.nbytes for x in arrays)
+
+
+def main():
+    for shape in [(3,), (64, 64, 3)]:
+        print(shape)
+        pprint(bench(goal_shape=shape, size=int(1e5) if len(shape) == 1 else int(2e4)))
+
+
+if __name__ == "__main__":
+    main()
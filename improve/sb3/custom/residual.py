@@ -4,6 +4,7 @@ import pathlib
 import sys
 import time
 import warnings
+from collections import deque
 from copy import deepcopy
 from dataclasses import asdict, dataclass
 from typing import Any, Dict, List, Optional, Tuple, Type, TypeVar, Union
@@ -13,7 +14,9 @@ import torch as th
 from gymnasium import spaces
 from improve import cn
 from improve.env import ActionRescaler
+from improve.env.async_vec import AsyncVecEnv
 from improve.fm import build_foundation_model
+from improve.fm.rtx import RT1Policy
 from improve.sb3.custom import CHEF
 from stable_baselines3.common.base_class import BaseAlgorithm
 from stable_baselines3.common.buffers import DictReplayBuffer, ReplayBuffer
@@ -27,7 +30,8 @@ from stable_baselines3.common.type_aliases import (GymEnv, MaybeCallback,
                                                    TrainFreq,
                                                    TrainFrequencyUnit)
 from stable_baselines3.common.utils import safe_mean, should_collect_more_steps
-from stable_baselines3.common.vec_env import VecEnv
+from stable_baselines3.common.vec_env import (VecEnv, VecTransposeImage,
+                                              unwrap_vec_wrapper)
 from stable_baselines3.her.her_replay_buffer import HerReplayBuffer
 
 
@@ -55,6 +59,8 @@ class OffPolicyResidual(CHEF):
         self.fmcn = fmcn
         self.fm = build_foundation_model(self.fmcn)
         self.fm.reset(instructions)
+        if self.fmcn.warmup:
+            self.fm.warmup(self.fmcn.warmup)
 
         self.rescaler = ActionRescaler(
             strategy=self.fmcn.strategy, residual_scale=self.fmcn.residual_scale
@@ -145,6 +151,11 @@ class OffPolicyResidual(CHEF):
         :param log_interval: Log data every ``log_interval`` episodes
         :return:
         """
+        if isinstance(env.unwrapped, AsyncVecEnv) and env.unwrapped.batch_size < env.num_envs:
+            return self._collect_async(
+                env, callback, train_freq, replay_buffer, action_noise, learning_starts, log_interval
+            )
+
         # Switch to eval mode (this affects batch norm / dropout)
         self.policy.set_training_mode(False)
 
@@ -272,6 +283,130 @@ class OffPolicyResidual(CHEF):
             continue_training,
         )
 
+    def _collect_async(
+        self,
+        env: VecEnv,
+        callback: BaseCallback,
+        train_freq: TrainFreq,
+        replay_buffer: ReplayBuffer,
+        action_noise: Optional[ActionNoise] = None,
+        learning_starts: int = 0,
+        log_interval: Optional[int] = None,
+    ) -> RolloutReturn:
+        """collect_rollouts over the first M of N envs to finish a step, see AsyncVecEnv
+        every env keeps its own last obs, fm action and the action it is stepping,
+        so a transition pairs the obs, partial action and action of one env
+
+        transitions go to the buffer N at a time, in the order they come back.
+        a row of the buffer mixes envs, which HER and optimize_memory_usage cannot take
+        """
+
+        venv = env.unwrapped
+        assert isinstance(self.fm, RT1Policy), "the foundation model must step a subset of envs"
+        assert action_noise is None and not self.use_sde, "noise is per env step, not supported async"
+        assert self._vec_normalize_env is None, "VecNormalize does not see async steps"
+        assert not self.optimize_memory_usage and not isinstance(replay_buffer, HerReplayBuffer), (
+            "async rows mix envs, buffers that read episodes along a column do not work"
+        )
+        # send / recv skip the vec env wrappers, obs are transposed like SB3 does in step
+        transpose = unwrap_vec_wrapper(env, VecTransposeImage)
+
+        self.policy.set_training_mode(False)
+        num_collected_steps, num_collected_episodes = 0, 0  # transitions, not vec steps
+
+        # written in place below, must not be the array _last_obs (or the sync loop) holds
+        self.fm_act = np.array(self.fm_act, dtype=np.float32)
+
+        callback.on_rollout_start()
+        continue_training = True
+        while should_collect_more_steps(
+            train_freq, num_collected_steps // env.num_envs, num_collected_episodes
+        ):
+            # all of them on the first call and after an eval drained the env
+            idle = np.flatnonzero(~venv.busy)
+            if len(idle):
+                obs = {k: v[idle] for k, v in self._last_obs.items()}
+                actions, buffer_actions = self._sample_action(
+                    learning_starts, None, len(idle), obs=obs
+                )
+                self._buffer_actions[idle] = buffer_actions
+                actions = self.rescaler.compute_final_action(actions, self.fm_act[idle])
+                venv.send(actions, idle)
+
+            new_obs, rewards, dones, infos, ids = venv.recv()
+            if transpose is not None:
+                new_obs = transpose.transpose_observations(new_obs)
+                for i, done in enumerate(dones):
+                    if done and infos[i].get("terminal_observation") is not None:
+                        infos[i]["terminal_observation"] = transpose.transpose_observations(
+                            infos[i]["terminal_observation"]
+                        )
+
+            # BCHW -> BHWC, only the history of these envs moves
+            image = np.transpose(new_obs["simpler-img"], (0, 2, 3, 1))
+            raw, fm_act = self.fm.step(image, ids=ids)
+            self.fm_act[ids] = self.rescaler.dict2act(fm_act)
+
+            new_obs["agent_partial-action"] = self.fm_act[ids]
+            for i, done in enumerate(dones):
+                if done and infos[i].get("terminal_observation") is not None:
+                    infos[i]["terminal_observation"]["agent_partial-action"] = self.fm_act[ids[i]]
+            del new_obs["simpler-img"]
+
+            self.num_timesteps += len(ids)
+            num_collected_steps += len(ids)
+
+            callback.update_locals(locals())
+            if not callback.on_step():
+                return RolloutReturn(
+                    num_collected_steps, num_collected_episodes, continue_training=False
+                )
+
+            self._update_info_buffer(infos, dones)
+            self._store_async(replay_buffer, ids, new_obs, rewards, dones, infos)
+            self._update_current_progress_remaining(
+                self.num_timesteps, self._total_timesteps
+            )
+            self._on_step()
+
+            for done in dones:
+                if done:
+                    num_collected_episodes += 1
+                    self._episode_num += 1
+                    if log_interval is not None and self._episode_num % log_interval == 0:
+                        self._dump_logs()
+        callback.on_rollout_end()
+
+        return RolloutReturn(num_collected_steps, num_collected_episodes, continue_training)
+
+    def _store_async(self, replay_buffer, ids, new_obs, rewards, dones, infos):
+        """queues the transitions of envs ids and adds them to the buffer n_envs at a time"""
+
+        for j, i in enumerate(ids):
+            next_obs = {k: v[j] for k, v in new_obs.items()}
+            terminal = infos[j].get("terminal_observation")
+            if dones[j] and terminal is not None:
+                next_obs = {k: terminal[k] for k in next_obs}
+
+            last = {k: v[i].copy() for k, v in self._last_obs.items()}
+            action = self._buffer_actions[i].copy()
+            self._transitions.append((last, next_obs, action, rewards[j], dones[j], infos[j]))
+            for k, v in new_obs.items():
+                self._last_obs[k][i] = v[j]
+
+        while len(self._transitions) >= self.n_envs:
+            rows = [self._transitions.popleft() for _ in range(self.n_envs)]
+            obs, next_obs, actions, rews, dones_, infos_ = zip(*rows)
+            stack = lambda xs: {k: np.stack([x[k] for x in xs]) for k in xs[0]}
+            replay_buffer.add(
+                stack(obs),
+                stack(next_obs),
+                np.stack(actions),
+                np.array(rews),
+                np.array(dones_),
+                list(infos_),
+            )
+
     def _setup_learn(
         self,
         total_timesteps: int,
@@ -302,11 +437,15 @@ class OffPolicyResidual(CHEF):
         # Avoid resetting the environment when calling ``.learn()`` consecutive times
         if reset_num_timesteps or self._last_obs is None:
             self.fm_act = np.zeros((self.env.num_envs, 7), dtype=np.float32)
-            self._last_obs["agent_partial-action"] = self.fm_act
+            self._last_obs["agent_partial-action"] = self.fm_act.copy()
 
             print(self._last_obs)
             print(self._last_obs.keys())
             self.img = self._last_obs["simpler-img"]
             del self._last_obs["simpler-img"]
 
+            # per env state of _collect_async
+            self._buffer_actions = np.zeros((self.env.num_envs, *self.action_space.shape), dtype=np.float32)
+            self._transitions = deque()
+
         return things
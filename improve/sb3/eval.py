@@ -12,6 +12,7 @@ import numpy as np
 import simpler_env as simpler
 import stable_baselines3 as sb3
 import wandb
+from improve.env.render import renderer_kwargs
 from improve.log.wandb import WandbLogger
 from improve.sb3 import custom, util
 from improve.wrapper import dict_util as du
@@ -25,6 +26,7 @@ from improve.wrapper.simpler.misc import (DownscaleImgWrapper,
                                           FlattenKeysWrapper,
                                           GraspDenseRewardWrapper)
 from improve.wrapper.simpler.no_rotation import NoRotationWrapper
+from improve.wrapper.simpler.obs_cache import ObsCacheWrapper
 from improve.wrapper.simpler.reach_task import ReachTaskWrapper
 from improve.wrapper.simpler.rescale import RTXRescaleWrapper
 from improve.wrapper.wandb.vec import WandbVecMonitor
@@ -87,12 +89,10 @@ def make_env(cfg, max_episode_steps: int = None, record_dir: str = None):
             # cant find simpler-img if you specify the mode
             render_mode="cameras",
             max_episode_steps=max_episode_steps,
-            renderer_kwargs={
-                "offscreen_only": True,
-                "device": "cuda:0",
-            },
+            renderer_kwargs=renderer_kwargs(cfg.env.render),
             **extra,
         )
+        env = ObsCacheWrapper(env)
 
         if cfg.env.foundation.name:
             env = FoundationModelWrapper(
@@ -108,9 +108,9 @@ def make_env(cfg, max_episode_steps: int = None, record_dir: str = None):
 
         if cfg.env.seed.force:
             if cfg.env.seed.seeds is not None:
-                env = ForceSeedWrapper(env, seeds=cfg.env.seed.seeds, verbose=True)
+                env = ForceSeedWrapper(env, seeds=cfg.env.seed.seeds, verbose=True, cache=cfg.env.seed.cache)
             else:
-                env = ForceSeedWrapper(env, seed=cfg.env.seed.value, verbose=True)
+                env = ForceSeedWrapper(env, seed=cfg.env.seed.value, verbose=True, cache=cfg.env.seed.cache)
 
         env = FlattenKeysWrapper(env)
         if cfg.env.obs_keys:
@@ -186,6 +186,9 @@ def main(cfg):
         return _init
 
     eval_only = not cfg.train.use_train
+    # these envs are not SeedScheduleVecEnvs, see improve.env.make_envs
+    assert not cfg.env.seed.schedule.use, "seed scheduling runs through sb3/maniskill_ppo_example.py"
+
     # create eval environment
     record_dir = osp.join(log_dir, f"videos{'/eval' if eval_only else ''}")
 
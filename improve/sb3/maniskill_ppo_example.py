@@ -27,6 +27,7 @@ from improve.log.wandb import WandbLogger
 from improve.sb3 import util
 from improve.sb3.custom import AWAC, PPO, RP_SAC, SAC, TQC
 from improve.wrapper import dict_util as du
+from improve.wrapper.seed_scheduler import SeedScheduleCallback
 
 warnings.filterwarnings("ignore", category=UserWarning, module="gym")
 warnings.filterwarnings("ignore", category=UserWarning, module="gymnasium")
@@ -205,6 +206,9 @@ def main(cfg):
             )
             callbacks += [wandbCb]
 
+        if cfg.env.seed.schedule.use:  # env from make_envs is a SeedScheduleVecEnv
+            callbacks.append(SeedScheduleCallback(env, log_dir=log_dir))
+
         if cfg.train.use_zero_init:
             util.zero_init(model, cfg.algo.name)
 
@@ -0,0 +1,261 @@
+"""
+lora delta checkpoints
+
+only the trainable part of a lorax tree is saved: the a, b factors of every LoraWeight,
+the LORA_FULL leaves and the optimizer state. the frozen base is replaced by a fingerprint
+so a delta is never merged into the wrong base model
+
+    save_dir/
+        step-000100/
+            delta.npz       {"path/a", "path/b", "path"} trainable arrays
+            opt_state.npz   {"0", "1", ...} flat optimizer leaves
+            meta.json       step, alpha per lora leaf, base fingerprint
+
+the device -> host copy is done on the train thread since train_many donates the state
+serialization and file io run on a background thread
+"""
+
+import hashlib
+import json
+import os
+import os.path as osp
+import shutil
+import threading
+import time
+
+import jax
+import lorax
+import numpy as np
+
+VERSION = 1
+
+
+def is_lora(x):
+    return isinstance(x, lorax.LoraWeight)
+
+
+def _key(path):
+    return "/".join(str(getattr(k, "key", getattr(k, "idx", k))) for k in path)
+
+
+def _leaves(tree):
+    """[(flat key, leaf)] with LoraWeights as leaves"""
+    leaves, _ = jax.tree_util.tree_flatten_with_path(tree, is_leaf=is_lora)
+    return [(_key(p), x) for p, x in leaves]
+
+
+def fingerprint(params):
+    """sha1 of the frozen base, paths, shapes, dtypes and values
+    takes plain params or a lorax tree, LoraWeights count as their frozen w
+    """
+
+    h = hashlib.sha1()
+    for k, x in _leaves(params):
+        x = np.asarray(jax.device_get(x.w if is_lora(x) else x))
+        h.update(f"{k}:{x.shape}:{x.dtype}".encode())
+        h.update(np.ascontiguousarray(x).tobytes())
+    return h.hexdigest()
+
+
+def delta(params, spec):
+    """flat {key: array} of the trainable leaves, device arrays are not copied
+
+    :param params: lorax tree from lorax.init_lora
+    :param spec: the spec it was built with
+    """
+
+    out = {}
+    spec = dict(_leaves(spec))
+    for k, x in _leaves(params):
+        if is_lora(x):
+            out[f"{k}/a"], out[f"{k}/b"] = x.a, x.b
+        elif spec[k] == lorax.LORA_FULL:
+            out[k] = x
+    return out
+
+
+def snapshot(tree):
+    """device -> host copy, every transfer is started before waiting on any"""
+    for x in jax.tree.leaves(tree):
+        if isinstance(x, jax.Array):
+            x.copy_to_host_async()
+    return jax.device_get(tree)
+
+
+def _savez(path, arrays):
+    # np.savez appends .npz to names without it
+    tmp = path + ".tmp.npz"
+    np.savez(tmp, **arrays)
+    os.replace(tmp, path)
+
+
+class LoraCheckpointer:
+    """async delta checkpoints for MyTrainState-like states
+    one write is in flight at a time, a new save waits for the previous one
+
+    :param save_dir: one step-XXXXXX directory per save
+    :param spec: lora spec of the trained params
+    :param base: base model params, fingerprinted once here
+    :param keep: newest checkpoints kept on disk, None keeps all
+    """
+
+    def __init__(self, save_dir, spec, base, keep=3):
+        self.save_dir = save_dir
+        self.spec = spec
+        self.keep = keep
+        self.fingerprint = fingerprint(base)
+        self.thread = None
+        self.error = None
+        os.makedirs(save_dir, exist_ok=True)
+
+    def save(self, step, params, opt_state):
+        """blocks only for the device -> host copy of the delta
+
+        :returns: seconds spent on the train thread
+        """
+
+        tic = time.time()
+        self.wait()
+        host = snapshot({"delta": delta(params, self.spec), "opt_state": jax.tree.leaves(opt_state)})
+        alpha = {k: x.alpha for k, x in _leaves(params) if is_lora(x)}
+
+        self.thread = threading.Thread(
+            target=self._write, args=(step, host, alpha), daemon=True
+        )
+        self.thread.start()
+        return time.time() - tic
+
+    def _write(self, step, host, alpha):
+        try:
+            name = osp.join(self.save_dir, f"step-{step:06d}")
+            tmp = name + ".tmp"
+            shutil.rmtree(tmp, ignore_errors=True)
+            os.makedirs(tmp)
+
+            _savez(osp.join(tmp, "delta.npz"), host["delta"])
+            _savez(osp.join(tmp, "opt_state.npz"), {str(i): x for i, x in enumerate(host["opt_state"])})
+            meta = {
+                "version": VERSION,
+                "step": step,
+                "fingerprint": self.fingerprint,
+                "alpha": alpha,
+                "nbytes": sum(x.nbytes for x in host["delta"].values()),
+            }
+            with open(osp.join(tmp, "meta.json"), "w") as f:
+                json.dump(meta, f)
+
+            # readers never see half a checkpoint
+            shutil.rmtree(name, ignore_errors=True)
+            os.replace(tmp, name)
+            self._prune()
+        except Exception as e:  # raised on the train thread by wait()
+            self.error = e
+
+    def _prune(self):
+        if self.keep is None:
+            return
+        for step in steps(self.save_dir)[: -self.keep]:
+            shutil.rmtree(osp.join(self.save_dir, f"step-{step:06d}"), ignore_errors=True)
+
+    def wait(self):
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def restore(self, params, opt_state, step=None):
+        """loads a delta into the trained tree and optimizer state
+
+        :param params: lorax tree with the same base, ie: from lorax.init_lora
+        :param opt_state: template, ie: tx.init(params)
+        :returns: (step, params, opt_state)
+        """
+
+        self.wait()
+        step, d, leaves = load(self.save_dir, self.fingerprint, step)
+        params = apply_delta(params, self.spec, d)
+
+        treedef = jax.tree.structure(opt_state)
+        assert treedef.num_leaves == len(leaves), "optimizer state does not match"
+        return step, params, jax.tree.unflatten(treedef, leaves)
+
+
+def steps(save_dir):
+    """finished checkpoint steps, oldest first"""
+    names = os.listdir(save_dir) if osp.isdir(save_dir) else []
+    return sorted(int(n.split("-")[-1]) for n in names if n.startswith("step-") and not n.endswith(".tmp"))
+
+
+def load(save_dir, base_fingerprint=None, step=None):
+    """
+    :param base_fingerprint: checked against the one saved, None skips the check
+    :param step: latest by default
+    :returns: (step, {key: array}, [opt_state leaves])
+    """
+
+    if step is None:
+        found = steps(save_dir)
+        assert found, f"no checkpoints in {save_dir}"
+        step = found[-1]
+    name = osp.join(save_dir, f"step-{step:06d}")
+
+    with open(osp.join(name, "meta.json"), "r") as f:
+        meta = json.load(f)
+    assert meta["version"] == VERSION, f"checkpoint version {meta['version']} != {VERSION}"
+    if base_fingerprint is not None and meta["fingerprint"] != base_fingerprint:
+        raise ValueError(f"{name} was trained on another base model")
+
+    with np.load(osp.join(name, "delta.npz")) as f:
+        d = dict(f)
+    with np.load(osp.join(name, "opt_state.npz")) as f:
+        leaves = [f[str(i)] for i in range(len(f.files))]
+    return step, d, leaves
+
+
+def apply_delta(params, spec, d):
+    """replaces the trainable leaves of a lorax tree with the saved ones"""
+
+    spec = dict(_leaves(spec))
+    missing = []
+
+    def _apply(path, x):
+        k = _key(path)
+        if is_lora(x):
+            if f"{k}/a" not in d:
+                missing.append(k)
+                return x
+            return lorax.LoraWeight(w=x.w, a=d[f"{k}/a"], b=d[f"{k}/b"], alpha=x.alpha)
+        if spec[k] == lorax.LORA_FULL:
+            if k not in d:
+                missing.append(k)
+                return x
+            return d[k]
+        return x
+
+    params = jax.tree_util.tree_map_with_path(_apply, params, is_leaf=is_lora)
+    assert not missing, f"delta is missing {missing[:5]}"
+    return params
+
+
+def load_merged(save_dir, base, spec, step=None):
+    """base params with a saved delta merged in, for inference without lorax
+
+    :param base: plain params of the base model, ie: OctoModel.params
+    :returns: merged params, same tree as base
+    """
+
+    step, d, _ = load(save_dir, fingerprint(base), step)
+    with open(osp.join(save_dir, f"step-{step:06d}", "meta.json"), "r") as f:
+        alpha = json.load(f)["alpha"]
+
+    # the init rng does not matter, every factor is overwritten
+    params = lorax.init_lora(base, spec, jax.random.PRNGKey(0))
+    params = jax.tree_util.tree_map_with_path(
+        lambda p, x: lorax.LoraWeight(w=x.w, a=x.a, b=x.b, alpha=alpha[_key(p)]) if is_lora(x) else x,
+        params,
+        is_leaf=is_lora,
+    )
+    params = apply_delta(params, spec, d)
+    return lorax.merge_params(params, destructive=False)
@@ -1,5 +1,8 @@
-import torch
+import queue
+import threading
 from time import time
+
+import torch
 from improve.wrapper import dict_util as du
 
 class DataPrefetcher:
@@ -39,3 +42,39 @@ class DataPrefetcher:
         return batch, time
 
 
+
+
+class JaxPrefetcher:
+    """moves batches from a host iterator onto device in a background thread
+    keeps up to size batches in flight so the train step never waits on the loader
+
+    :param it: iterator of host batches
+    :param sharding: jax sharding (or a pytree prefix of shardings) for each batch
+    :param size: number of batches kept on device
+    """
+
+    def __init__(self, it, sharding=None, size=2):
+        self.it = it
+        self.sharding = sharding
+        self.queue = queue.Queue(maxsize=size)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        import jax
+
+        try:
+            for batch in self.it:
+                self.queue.put(jax.device_put(batch, self.sharding))
+            self.queue.put(StopIteration())
+        except Exception as e:
+            self.queue.put(e)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        batch = self.queue.get()
+        if isinstance(batch, Exception):
+            raise batch
+        return batch
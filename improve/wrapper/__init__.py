@@ -5,11 +5,13 @@ from .sb3.successinfo import SuccessInfoWrapper
 # simpler
 from .simpler import (ActionSpaceWrapper, ExtraObservationWrapper,
                       FoundationModelWrapper)
+from .simpler.action_replay import ActionReplayWrapper
 from .simpler.awac_reward import AwacRewardWrapper
 from .simpler.drawer import DrawerWrapper
 from .simpler.misc import (DownscaleImgWrapper, FilterKeysWrapper,
                            FlattenKeysWrapper, GraspDenseRewardWrapper)
 from .simpler.no_rotation import NoRotationWrapper
+from .simpler.obs_cache import ObsCache, ObsCacheWrapper
 from .simpler.reach_task import ReachTaskWrapper
 from .simpler.rescale import ActionRescaleWrapper, RTXRescaleWrapper
 from .simpler.source_target import SourceTargetWrapper
@@ -6,6 +6,8 @@ import numpy as np
 from gymnasium import spaces
 from mani_skill2_real2sim.utils.sapien_utils import get_entity_by_name
 
+from improve.wrapper.reset_cache import ResetCache
+
 
 class ForceSeedWrapper(gym.Wrapper):
     """
@@ -15,11 +17,15 @@ class ForceSeedWrapper(gym.Wrapper):
     :param seed: the seed to force
     :param seeds: a list of seeds to cycle through
     :verbose: print the seed that is being forced
+    :param cache: restore seen seeds from SAPIEN state snapshots, see reset_cache
+    next_seed, set by SeedScheduleVecEnv, overrides both for one reset
     """
 
-    def __init__(self, env, seed=0, seeds=None, verbose=False):
+    def __init__(self, env, seed=0, seeds=None, verbose=False, cache=False):
         super().__init__(env)
 
+        self.reset_cache = ResetCache(env.unwrapped) if cache else None
+
         self.seed = seed
 
         if seeds is not None:
@@ -31,10 +37,16 @@ class ForceSeedWrapper(gym.Wrapper):
             self.seeds = None
 
         self.verbose = verbose
+        self.next_seed = None
+
+    def set_next_seed(self, seed):
+        self.next_seed = seed
 
     def reset(self, **kwargs):
 
-        if self.seeds is not None:
+        if self.next_seed is not None:
+            kwargs["seed"], self.next_seed = self.next_seed, None
+        elif self.seeds is not None:
             kwargs["seed"] = next(self.seeds)
         else:
             kwargs["seed"] = self.seed
@@ -17,6 +17,16 @@ from omegaconf import OmegaConf as OC
 import improve
 import improve.wrapper.dict_util as du
 
+
+def goal_reward(achieved_goal, desired_goal, ndim=1, atol=0.01):
+    """1 where achieved equals desired up to atol over the last ndim goal dims
+    takes one goal or a batch [..., *goal_shape], returns float32 of the batch shape
+    """
+
+    eq = np.isclose(achieved_goal, desired_goal, atol=atol)
+    return np.all(eq, axis=tuple(range(-ndim, 0))).astype(np.float32)
+
+
 class GoalEnvWrapper(ObservationWrapper, RewardWrapper, ActionWrapper, Wrapper):
 
     def __init__(self, env, goalkey):
@@ -41,6 +51,7 @@ class GoalEnvWrapper(ObservationWrapper, RewardWrapper, ActionWrapper, Wrapper):
         self.goals = [self.goal]
         self.goal_buffer_size = 10
         self.goalkey = goalkey
+        self.goal_ndim = len(obspace[goalkey].shape)
 
     def reset(self, *, seed: Optional[int] = None, options: Optional[dict] = None):
         """Reset the environment.
@@ -82,14 +93,10 @@ class GoalEnvWrapper(ObservationWrapper, RewardWrapper, ActionWrapper, Wrapper):
 
 
     def compute_reward(self, achieved_goal, desired_goal, info):
-        """give small tolerance in case simulator gets weird"""
-
-        if len(achieved_goal.shape) == 4:
-            eq = np.isclose(achieved_goal, desired_goal, atol=0.01)
-            eq = np.all(eq, axis=(1, 2, 3))
-        else:
-            eq = np.array(np.allclose(achieved_goal, desired_goal, atol=0.01))
-        return eq.astype(np.float32)
+        """give small tolerance in case simulator gets weird
+        vectorized, also takes a batch of goals like HER relabeling does
+        """
+        return goal_reward(achieved_goal, desired_goal, ndim=self.goal_ndim)
 
     def compute_terminated(self, achieved_goal, desired_goal, info):
         return info["is_success"]
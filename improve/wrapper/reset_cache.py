@@ -0,0 +1,160 @@
+"""
+reset cache for seeded SIMPLER episodes
+
+a full maniskill2 reset re-randomizes and settles the scene, which is a large share
+of wall clock for 60-80 step episodes. the first reset with a seed runs the full path
+and snapshots the SAPIEN state, the plain python task state (episode stats, rngs, goals)
+and the initial obs. later resets with that seed restore the snapshot instead
+
+only the unwrapped reset is replaced so every wrapper still sees a normal reset
+"""
+
+import copy
+import time
+from pprint import pprint
+
+import numpy as np
+
+# python values that belong to the episode and are safe to deepcopy
+PLAIN = (bool, int, float, str, bytes, type(None), np.ndarray, np.generic, np.random.RandomState)
+
+
+def _plain(x):
+    if isinstance(x, (list, tuple)):
+        return all(_plain(v) for v in x)
+    if isinstance(x, dict):
+        return all(isinstance(k, str) and _plain(v) for k, v in x.items())
+    return isinstance(x, PLAIN)
+
+
+def _scene(base):
+    """actors and articulations of the current scene, a snapshot only fits the same scene"""
+    scene = base._scene
+    return (
+        tuple(a.name for a in scene.get_all_actors()),
+        tuple(a.name for a in scene.get_all_articulations()),
+    )
+
+
+def mismatch(a, b, prefix=""):
+    """keys of two nested obs that are not bit for bit equal"""
+
+    if isinstance(a, dict) and isinstance(b, dict):
+        out = [f"{prefix}{k}" for k in a.keys() ^ b.keys()]
+        for k in a.keys() & b.keys():
+            out += mismatch(a[k], b[k], f"{prefix}{k}/")
+        return out
+    a, b = np.asarray(a), np.asarray(b)
+    same = a.shape == b.shape and a.dtype == b.dtype and a.tobytes() == b.tobytes()
+    return [] if same else [prefix.rstrip("/")]
+
+
+class ResetCache:
+    """replaces base.reset with a cached restore for seeds it has seen
+
+    :param base: the unwrapped maniskill2 env
+    :param max_size: seeds kept, the oldest is dropped first
+    """
+
+    def __init__(self, base, max_size=256):
+        self.base = base
+        self.max_size = max_size
+        self.snapshots = {}
+        self.hits = self.misses = 0
+
+        self._reset = base.reset  # bound class method
+        base.reset = self.reset
+
+    def reset(self, seed=None, options=None):
+        options = {} if options is None else options
+        # simpler resets can also pin object and robot init options
+        key = (seed, repr(sorted(options.items())))
+        snap = self.snapshots.get(key)
+        if seed is None or options.get("reconfigure") or snap is None or snap["scene"] != _scene(self.base):
+            self.misses += 1
+            obs, info = self._reset(seed=seed, options=options)
+            if seed is not None:
+                self.snapshots[key] = self.snapshot(obs, info)
+                if len(self.snapshots) > self.max_size:
+                    self.snapshots.pop(next(iter(self.snapshots)))
+            return obs, info
+
+        self.hits += 1
+        self.restore(snap)
+        return copy.deepcopy(snap["obs"]), copy.deepcopy(snap["info"])
+
+    def snapshot(self, obs, info):
+        base = self.base
+        return {
+            "scene": _scene(base),
+            "state": np.array(base.get_state(), copy=True),
+            "attrs": copy.deepcopy({k: v for k, v in vars(base).items() if _plain(v)}),
+            "obs": copy.deepcopy(obs),
+            "info": copy.deepcopy(info),
+        }
+
+    def restore(self, snap):
+        base = self.base
+        vars(base).update(copy.deepcopy(snap["attrs"]))
+        base.set_state(snap["state"])
+        # drive targets are not part of the sim state
+        base.agent.controller.reset()
+
+    def validate(self, seed):
+        """restored vs fresh obs for seed
+
+        :returns: keys that differ, [] is a bit for bit match
+        """
+
+        cached, _ = self.reset(seed=seed)
+        restored = copy.deepcopy(self.base.get_obs())
+        fresh, _ = self._reset(seed=seed, options={})
+        return mismatch(cached, fresh) + mismatch(restored, fresh)
+
+
+def bench(env, seeds, n=50):
+    """resets/sec of the full reset path vs the cache, on a ForceSeedWrapper env
+
+    :param seeds: seeds validated and timed, each is reset n // len(seeds) times
+    """
+
+    cache = env.get_wrapper_attr("reset_cache")
+
+    results = {}
+    tic = time.time()
+    for i in range(n):
+        cache._reset(seed=seeds[i % len(seeds)])
+    results["full"] = n / (time.time() - tic)
+
+    for s in seeds:  # fill
+        cache.reset(seed=s)
+    tic = time.time()
+    for i in range(n):
+        cache.reset(seed=seeds[i % len(seeds)])
+    results["cached"] = n / (time.time() - tic)
+
+    bad = {s: m for s in seeds if (m := cache.validate(s))}
+    pprint({k: f"{v:.1f} resets/sec" for k, v in results.items()})
+    pprint({"mismatch": bad or None, "hits": cache.hits, "misses": cache.misses})
+    return results, bad
+
+
+import hydra
+import improve
+import improve.hydra.resolver
+
+
+@hydra.main(config_path=improve.CONFIG, config_name="config", version_base="1.3.2")
+def main(cfg):
+    """validates and times the reset cache for the configured env"""
+
+    from improve.env import make_env
+
+    cfg.env.seed.force, cfg.env.seed.cache = True, True
+    seeds = cfg.env.seed.seeds or 10
+    env = make_env(cfg)()
+    bench(env, list(range(seeds)) if isinstance(seeds, int) else list(seeds))
+
+
+if __name__ == "__main__":
+    main()
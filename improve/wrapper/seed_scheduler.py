@@ -0,0 +1,278 @@
+"""
+adaptive seed scheduling, like prioritized level replay
+
+ForceSeedWrapper cycles a shuffled seed list, so seeds the policy already solves
+cost as many SIMPLER rollouts as the ones it is still learning. SeedScheduler keeps
+per-seed success, return and td error in the main process and samples the next seed
+of every worker from them. SeedScheduleVecEnv hands the seeds to the workers
+
+    uniform     every seed alike, what cycling does
+    failure     seeds that fail more, 1 - success
+    progress    seeds whose success is changing, |fast - slow| success ema
+    td          seeds with large |advantage|, PPO only (see SeedScheduleCallback)
+
+scores are sharpened with a temperature and mixed with staleness so no seed
+is forgotten. unseen seeds go first
+"""
+
+import json
+import os
+import os.path as osp
+from pprint import pprint
+
+import numpy as np
+from stable_baselines3.common.callbacks import BaseCallback
+from stable_baselines3.common.vec_env import VecEnvWrapper, unwrap_vec_wrapper
+
+STRATEGIES = ["uniform", "failure", "progress", "td"]
+
+
+class SeedScheduler:
+    """
+    :param seeds: list of seeds or n for range(n)
+    :param strategy: one of STRATEGIES
+    :param temperature: scores are raised to 1 / temperature, lower is greedier
+    :param staleness: share of the probability that goes to seeds not played in a while
+    :param ema: rate of the fast success ema, the slow one is ema / 4
+    """
+
+    def __init__(self, seeds, strategy="failure", temperature=1.0, staleness=0.3, ema=0.2, seed=0):
+        assert strategy in STRATEGIES, f"strategy must be one of {STRATEGIES}"
+        self.seeds = np.array(list(range(seeds)) if isinstance(seeds, int) else list(seeds))
+        self.index = {s: i for i, s in enumerate(self.seeds.tolist())}
+        self.strategy = strategy
+        self.temperature = temperature
+        self.staleness = staleness
+        self.ema = ema
+        self.rng = np.random.default_rng(seed)
+
+        n = len(self.seeds)
+        self.count = np.zeros(n, dtype=np.int64)  # finished episodes
+        self.pending = np.zeros(n, dtype=np.int64)  # handed out, not finished
+        self.fast = np.zeros(n)
+        self.slow = np.zeros(n)
+        self.ret = np.zeros(n)
+        self.td = np.zeros(n)
+        self.last = np.zeros(n, dtype=np.int64)  # episode count at the last visit
+        self.episodes = 0
+
+    def scores(self):
+        if self.strategy == "failure":
+            return 1 - self.fast
+        if self.strategy == "progress":
+            return np.abs(self.fast - self.slow)
+        if self.strategy == "td":
+            return self.td
+        return np.ones(len(self.seeds))
+
+    def probs(self):
+        unseen = (self.count + self.pending) == 0
+        if unseen.any():
+            return unseen / unseen.sum()
+
+        # proportional, a rank transform lets tiny leftover scores beat every 0
+        h = self.scores() ** (1 / self.temperature)
+        p = h / h.sum() if h.sum() > 0 else np.full(len(h), 1 / len(h))
+
+        stale = (self.episodes - self.last).astype(np.float64)
+        if self.staleness and stale.sum() > 0:
+            p = (1 - self.staleness) * p + self.staleness * stale / stale.sum()
+        return p
+
+    def sample(self):
+        i = self.rng.choice(len(self.seeds), p=self.probs())
+        self.pending[i] += 1
+        return int(self.seeds[i])
+
+    def cancel(self, seed):
+        """a handed out seed that will not finish, ie: the vec env was reset"""
+        i = self.index[seed]
+        self.pending[i] = max(self.pending[i] - 1, 0)
+
+    def update(self, seed, success, ret):
+        i = self.index[seed]
+        self.pending[i] = max(self.pending[i] - 1, 0)
+        if self.count[i] == 0:
+            self.fast[i] = self.slow[i] = success
+            self.ret[i] = ret
+        else:
+            self.fast[i] += self.ema * (success - self.fast[i])
+            self.slow[i] += self.ema / 4 * (success - self.slow[i])
+            self.ret[i] += self.ema * (ret - self.ret[i])
+        self.count[i] += 1
+        self.last[i] = self.episodes
+        self.episodes += 1
+
+    def update_td(self, seeds, errors):
+        """mean |td error| per seed of a batch of transitions"""
+        seeds, errors = np.asarray(seeds), np.abs(np.asarray(errors))
+        for s in np.unique(seeds):
+            i = self.index[int(s)]
+            err = errors[seeds == s].mean()
+            self.td[i] = err if self.td[i] == 0 else self.td[i] + self.ema * (err - self.td[i])
+
+    def summary(self):
+        p = self.probs()
+        seen = self.count > 0
+        return {
+            "coverage": seen.mean(),
+            "success": self.fast[seen].mean() if seen.any() else 0.0,
+            "entropy": float(-(p[p > 0] * np.log(p[p > 0])).sum() / np.log(len(p))) if len(p) > 1 else 0.0,
+            "max_prob": p.max(),
+        }
+
+    def table(self):
+        """per-seed statistics"""
+        p = self.probs()
+        return [
+            {
+                "seed": int(s),
+                "episodes": int(self.count[i]),
+                "success": float(self.fast[i]),
+                "progress": float(abs(self.fast[i] - self.slow[i])),
+                "return": float(self.ret[i]),
+                "td": float(self.td[i]),
+                "prob": float(p[i]),
+            }
+            for i, s in enumerate(self.seeds)
+        ]
+
+
+class SeedScheduleVecEnv(VecEnvWrapper):
+    """picks the seed of every episode in the main process
+    the workers need ForceSeedWrapper, which resets with the seed set by set_next_seed
+
+    a worker resets as soon as its episode ends, before this sees the done,
+    so the seed of the episode after the running one is always queued
+    goes outside VecMonitor so finished episodes carry their return
+    """
+
+    def __init__(self, venv, scheduler):
+        super().__init__(venv)
+        self.scheduler = scheduler
+        self.current = np.zeros(self.num_envs, dtype=np.int64)  # seed of the running episode
+        self.queued = np.zeros(self.num_envs, dtype=np.int64)
+        self.step_seeds = self.current.copy()  # seed of each transition of the last step
+        self.started = False
+
+    def _queue(self, i):
+        self.queued[i] = self.scheduler.sample()
+        self.venv.env_method("set_next_seed", int(self.queued[i]), indices=[i])
+
+    def reset(self):
+        if self.started:  # running and queued episodes are dropped
+            for s in [*self.current, *self.queued]:
+                self.scheduler.cancel(int(s))
+
+        for i in range(self.num_envs):
+            self._queue(i)
+        obs = self.venv.reset()
+        self.current = self.queued.copy()
+        for i in range(self.num_envs):
+            self._queue(i)
+        self.started = True
+        return obs
+
+    def step_wait(self):
+        obs, rewards, dones, infos = self.venv.step_wait()
+        self.step_seeds = self.current.copy()
+
+        for i in np.flatnonzero(dones):
+            seed = int(self.current[i])
+            success = float(infos[i].get("is_success", False))
+            ret = infos[i].get("episode", {}).get("r", rewards[i])
+            self.scheduler.update(seed, success, float(ret))
+            infos[i]["seed"] = seed
+
+            self.current[i] = self.queued[i]
+            self._queue(i)
+        return obs, rewards, dones, infos
+
+
+class SeedScheduleCallback(BaseCallback):
+    """feeds PPO advantages to the scheduler as td errors and logs seed statistics
+
+    :param log_dir: per-seed table written to log_dir/seeds.json every rollout
+    """
+
+    def __init__(self, venv, log_dir=None, verbose=0):
+        super().__init__(verbose)
+        self.wrapper = unwrap_vec_wrapper(venv, SeedScheduleVecEnv)
+        assert self.wrapper is not None, "venv is not wrapped with SeedScheduleVecEnv"
+        self.scheduler = self.wrapper.scheduler
+        self.log_dir = log_dir
+        self.seeds = []
+
+    def _on_step(self):
+        self.seeds.append(self.wrapper.step_seeds.copy())
+        return True
+
+    def _on_rollout_end(self):
+        # on policy algos have the advantages of the rollout by now
+        buffer = getattr(self.model, "rollout_buffer", None)
+        if buffer is not None and len(self.seeds) >= buffer.buffer_size:
+            seeds = np.stack(self.seeds[-buffer.buffer_size :])
+            self.scheduler.update_td(seeds.reshape(-1), buffer.advantages.reshape(-1))
+        self.seeds = []
+
+        for k, v in self.scheduler.summary().items():
+            self.logger.record(f"seed/{k}", float(v))
+        if self.log_dir is not None:
+            os.makedirs(self.log_dir, exist_ok=True)
+            with open(osp.join(self.log_dir, "seeds.json"), "w") as f:
+                json.dump(self.scheduler.table(), f)
+
+
+#
+# bench
+#
+
+
+def simulate(strategy, n_seeds=50, target=0.8, max_episodes=20000, seed=0):
+    """episodes until the learnable seeds reach target success on a toy learner
+    most seeds are easy, a tenth are impossible. a seed is learned the most where it
+    sometimes succeeds (sparse reward) and a little of it transfers to every seed
+
+    :returns: episodes needed, max_episodes if never
+    """
+
+    rng = np.random.default_rng(seed)
+    difficulty = rng.exponential(10, n_seeds)
+    impossible = rng.random(n_seeds) < 0.1
+    skill = np.zeros(n_seeds)
+
+    def p_success():
+        p = 1 / (1 + np.exp(-(skill - difficulty) / 4))
+        return np.where(impossible, 0.0, p)
+
+    if strategy == "cycle":  # ForceSeedWrapper
+        order = rng.permutation(n_seeds)
+        next_seed = lambda t: int(order[t % n_seeds])
+        update = lambda s, success: None
+    else:
+        scheduler = SeedScheduler(n_seeds, strategy=strategy, seed=seed)
+        next_seed = lambda t: scheduler.sample()
+        update = lambda s, success: scheduler.update(s, success, success)
+
+    for t in range(max_episodes):
+        s = next_seed(t)
+        p = p_success()[s]
+        update(s, float(rng.random() < p))
+        gain = 0.02 + 4 * p * (1 - p)
+        skill[s] += gain
+        skill += 0.02 * gain
+        if p_success()[~impossible].mean() >= target:
+            return t + 1
+    return max_episodes
+
+
+def main():
+    results = {}
+    for strategy in ["cycle", "uniform", "failure", "progress"]:
+        runs = [simulate(strategy, seed=s) for s in range(8)]
+        results[strategy] = {"episodes to 80%": int(np.mean(runs))}
+    pprint(results)
+
+
+if __name__ == "__main__":
+    main()
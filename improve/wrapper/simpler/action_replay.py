@@ -0,0 +1,101 @@
+import itertools
+import json
+import os
+import os.path as osp
+import time
+
+import gymnasium as gym
+import numpy as np
+
+# per step (or per checkpoint) arrays of an episode file, meta holds the rest
+ARRAYS = ["actions", "rewards", "terminated", "truncated", "steps", "states"]
+
+# envs of one process (multi scene, pipelined spare) need their own file names
+_IDS = itertools.count()
+
+
+def _json(o):
+    """numpy reset options as lists, anything else in cfg.env (enums, classes) as str"""
+    return o.tolist() if isinstance(o, (np.ndarray, np.generic)) else str(o)
+
+
+class ActionReplayWrapper(gym.Wrapper):
+    """records episodes as seed, reset options and actions instead of images
+    simpler is deterministic given those, so improve.data.replay re-renders any
+    camera or resolution from them later
+
+    goes right after ObsCacheWrapper so the actions are the ones the sim executed,
+    after the foundation model, rescaling and the sticky gripper
+
+    :param root: output directory, one {id}.npz per episode
+    :param task: simpler task
+    :param make_kwargs: simpler.make kwargs of this env, to rebuild it for replay
+    :param every: sim state checkpoint every n steps, None for only the initial state
+    :param config: cfg.env, stored for reference
+    """
+
+    def __init__(self, env, root, task, make_kwargs, every=20, config=None):
+        super().__init__(env)
+
+        self.root = root
+        self.every = every
+        self.meta = {"task": task, "make_kwargs": make_kwargs, "every": every, "config": config}
+        os.makedirs(root, exist_ok=True)
+
+        self.prefix = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(_IDS)}"
+        self.count = 0
+        self.episode = None
+
+    def reset(self, **kwargs):
+        self.flush()  # an episode cut short by a reset is kept
+        obs, info = self.env.reset(**kwargs)
+
+        base = self.env.unwrapped
+        self.episode = {
+            "seed": int(base._episode_seed),
+            "options": kwargs.get("options") or {},
+            "actions": [],
+            "rewards": [],
+            "terminated": [],
+            "truncated": [],
+            "steps": [0],
+            "states": [np.array(base.get_state(), copy=True)],
+        }
+        return obs, info
+
+    def step(self, action):
+        obs, reward, terminated, truncated, info = self.env.step(action)
+
+        ep = self.episode
+        # as executed, a float32 cast changes the controller targets and the replay drifts
+        ep["actions"].append(np.array(action, copy=True))
+        ep["rewards"].append(float(reward))
+        ep["terminated"].append(bool(terminated))
+        ep["truncated"].append(bool(truncated))
+
+        n = len(ep["actions"])
+        if self.every and n % self.every == 0:
+            ep["steps"].append(n)
+            ep["states"].append(np.array(self.env.unwrapped.get_state(), copy=True))
+
+        if terminated or truncated:
+            self.flush()
+        return obs, reward, terminated, truncated, info
+
+    def flush(self):
+        ep = self.episode
+        if not ep or not ep["actions"]:
+            return
+
+        meta = {**self.meta, "seed": ep["seed"], "options": ep["options"]}
+        np.savez_compressed(
+            osp.join(self.root, f"{self.prefix}-{self.count:06d}.npz"),
+            meta=json.dumps(meta, default=_json),
+            **{k: np.stack(ep[k]) for k in ARRAYS},
+        )
+        self.count += 1
+        self.episode = None
+
+    def close(self):
+        self.flush()
+        return super().close()
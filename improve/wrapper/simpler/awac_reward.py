@@ -1,5 +1,8 @@
 from gymnasium.core import Wrapper
 
+from improve.wrapper.simpler import reward as rewards
+
+
 class AwacRewardWrapper(Wrapper):
     def __init__(self, 
                  env):
@@ -10,5 +13,5 @@ class AwacRewardWrapper(Wrapper):
         obs, reward, success, truncated, info = self.env.step(action)
         
         # change reward dist from [0, 1] --> [-1, 0]
-        reward = -1 if reward == 0 else 0 if reward == 1 else reward
-        return obs, reward, success, truncated, info
\ No newline at end of file
+        reward = rewards.awac(reward).item()
+        return obs, reward, success, truncated, info
@@ -2,6 +2,7 @@ import gymnasium as gym
 import numpy as np
 from gymnasium.core import Wrapper
 import improve.hydra.resolver
+from improve.wrapper.simpler.obs_cache import find_cache, setlazy
 
 class DrawerWrapper(Wrapper):
     def __init__(self, env):
@@ -16,17 +17,18 @@ class DrawerWrapper(Wrapper):
         self.observation_space["drawer-pose-wrt-eef"] = gym.spaces.Box(
             low=-np.inf, high=np.inf, shape=(3,), dtype=np.float32
         )
+
+        self.obs_cache, self.owns_cache = find_cache(self.env)
         
     def drawer_wrt_eef(self):
         """Get the drawer pose with respect to the end-effector frame"""
-        return self.drawer_obj.pose.p - self.get_tcp().pose.p
+        return self.obs_cache.wrt_eef("drawer")
    
     def observation(self, observation):
-        drawer_pos = self.drawer_obj.pose
-        drawer_pos = np.hstack((drawer_pos.p, drawer_pos.q))
-        
-        observation["drawer-pose"] = drawer_pos
-        observation["drawer-pose-wrt-eef"] = self.drawer_wrt_eef()
+        if self.owns_cache:
+            self.obs_cache.invalidate(observation)
+        setlazy(observation, "drawer-pose", lambda: self.obs_cache.pose("drawer"))
+        setlazy(observation, "drawer-pose-wrt-eef", self.drawer_wrt_eef)
         
         return observation
     
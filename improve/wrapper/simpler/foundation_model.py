@@ -1,5 +1,7 @@
 from __future__ import annotations
 
+import copy
+from collections import deque
 from pprint import pprint
 
 import gymnasium as gym
@@ -16,6 +18,7 @@ from simpler_env.utils.env.observation_utils import \
     get_image_from_maniskill2_obs_dict
 
 import improve.wrapper.dict_util as du
+from improve.wrapper.simpler.obs_cache import find_cache, setlazy
 
 
 class ExtraObservationWrapper(Wrapper):
@@ -39,6 +42,8 @@ class ExtraObservationWrapper(Wrapper):
             "obj-pose": mk_space((7,)),
         }
 
+        # eggplant env tracks its object as the source obj
+        self.obj_name = "obj"
         if "eggplant" not in env.get_language_instruction():
             try:
                 obj = self.env.obj
@@ -50,6 +55,7 @@ class ExtraObservationWrapper(Wrapper):
                 print("env has no obj")
         else:
             self.has_obj = True
+            self.obj_name = "src"
 
         for k, v in additions.items():
             self.observation_space[k] = v
@@ -61,28 +67,26 @@ class ExtraObservationWrapper(Wrapper):
                 low=0, high=255, shape=image.shape, dtype=np.uint8
             )
 
+        self.obs_cache, self.owns_cache = find_cache(self.env)
+
     def observation(self, observation):
         """Returns a modified observation."""
 
-        # add sin and cos of qpos
-        qpos = observation["agent"]["qpos"]
-        observation["agent"]["qpos-sin"] = np.sin(qpos)
-        observation["agent"]["qpos-cos"] = np.cos(qpos)
+        if self.owns_cache:
+            self.obs_cache.invalidate(observation)
 
-        if self.use_image:
-            observation["simpler-img"] = self.get_image(observation)
+        # thunks, only computed if a key survives FilterKeysWrapper
+        agent = observation["agent"]
+        setlazy(agent, "qpos-sin", lambda: np.sin(agent["qpos"]))
+        setlazy(agent, "qpos-cos", lambda: np.cos(agent["qpos"]))
 
+        cache = self.obs_cache
         if self.has_obj:
-            if "eggplant" in self.env.get_language_instruction():
-                obj = self.env.source_obj_pose
-            else:
-                obj = self.env.obj
-            observation["obj-pose"] = np.array([*obj.p, *obj.q])
-            observation["obj-wrt-eef"] = np.array(self.obj_wrt_eef())
+            setlazy(observation, "obj-pose", lambda: cache.pose(self.obj_name))
+            setlazy(observation, "obj-wrt-eef", lambda: cache.wrt_eef(self.obj_name))
 
-        tcp = self.get_tcp().pose
-        observation["eef-pose"] = np.array([*tcp.p, *tcp.q])
-        observation["simpler-img"] = self.get_image(observation)
+        setlazy(observation, "eef-pose", lambda: cache.pose("tcp"))
+        setlazy(observation, "simpler-img", cache.image)
 
         return observation
 
@@ -112,7 +116,7 @@ class ExtraObservationWrapper(Wrapper):
 
     def obj_wrt_eef(self):
         """Get the object pose with respect to the end-effector frame"""
-        return self.obj_pose.p - self.get_tcp().pose.p
+        return self.obs_cache.wrt_eef(self.obj_name)
 
     def get_image(self, obs):
         """show the right observation for video depending on the robot architecture"""
@@ -150,6 +154,23 @@ class ActionSpaceWrapper(Wrapper):
         return self.env.step(action)
 
 
+# loaded policies per process, shared by the scenes of a MultiSceneVecEnv
+MODELS = {}
+
+
+def _episodic(v):
+    """per-episode state of a policy, ie: image history or action ensembler"""
+    return isinstance(v, (list, dict, deque, np.ndarray)) or hasattr(v, "reset")
+
+
+def share(model):
+    """copy of a loaded policy with its own episode state
+    weights, compiled functions and everything else are shared
+    """
+    memo = {id(v): v for v in vars(model).values() if not _episodic(v)}
+    return copy.deepcopy(model, memo)
+
+
 class FoundationModelWrapper(Wrapper):
     """
     uses model (Octo or RTX) to predict initial action
@@ -160,11 +181,28 @@ class FoundationModelWrapper(Wrapper):
     :param policy: policy name
     :param ckpt: checkpoint path
     :param residual_scale: residual policy weight
+    :param compile_cache: persistent xla cache dir shared by subproc workers
+    :param warmup: steps the model once per process before the first env step if set
+        simpler models are unbatched, so the batch sizes themselves are not used
     """
 
-    def __init__(self, env, task, policy, ckpt, residual_scale=1.0, strategy="clip"):
+    def __init__(
+        self,
+        env,
+        task,
+        policy,
+        ckpt,
+        residual_scale=1.0,
+        strategy="clip",
+        compile_cache=None,
+        warmup=None,
+    ):
         super().__init__(env)
 
+        from improve.fm.warmup import init_compile_cache
+
+        init_compile_cache(compile_cache)
+
         if policy in ["octo-base", "octo-small"]:
             if ckpt in [None, "None"] or "rt_1_x" in ckpt:
                 ckpt = policy
@@ -173,6 +211,7 @@ class FoundationModelWrapper(Wrapper):
         self.policy = policy
         self.ckpt = ckpt
         self.residual_scale = 1.0
+        self.warmup_sizes = warmup
 
         assert strategy in ["dynamic", "clip", None]
         self.strategy = strategy
@@ -197,6 +236,7 @@ class FoundationModelWrapper(Wrapper):
         # ie: w_fm + w_rp = 1
 
         self.build_model()
+        self.obs_cache, self.owns_cache = find_cache(self.env)
 
         self.observation_space["agent_partial-action"] = Box(
             low=-1, high=1, shape=(7,), dtype=np.float32
@@ -222,6 +262,11 @@ class FoundationModelWrapper(Wrapper):
         else:
             raise NotImplementedError()
 
+        key = (self.policy, self.ckpt, policy_setup)
+        if key in MODELS:
+            self.model = share(MODELS[key])
+            return
+
         if self.policy == "rt1":
             from simpler_env.policies.rt1.rt1_model import RT1Inference
 
@@ -239,6 +284,27 @@ class FoundationModelWrapper(Wrapper):
         else:
             raise NotImplementedError()
 
+        if self.warmup_sizes:
+            self.warmup()
+        MODELS[key] = self.model
+
+    def warmup(self, n=5):
+        """the first step traces and compiles the model, do it on a blank camera frame
+        instead of inside the first env step. copies made by share reuse the compiled fns
+        """
+
+        from improve.fm import warmup
+
+        image = self.get_image(self.observation_space.sample())
+        image = np.zeros_like(image)
+        step = lambda image: self.model.step(image, self.instruction)
+
+        self.model.reset(self.instruction)
+        report = warmup.warmup(step, lambda bs: (image,), [1], n=n)
+        self.model.reset(self.instruction)  # drop the blank frames from the history
+        warmup.show(type(self.model).__name__, report)
+        return report
+
     def reset(self, **kwargs):
         self.model.reset(self.instruction)
         obs, info = super().reset(**kwargs)
@@ -315,7 +381,7 @@ class FoundationModelWrapper(Wrapper):
         # reward = self.compute_reward(action, reward)
 
         obs = self.observation(obs)
-        self.image = self.get_image(obs)
+        self.image = self.obs_cache.image()
         info["agent_partial-action"] = {
             k: v
             for k, v in zip(
@@ -331,7 +397,9 @@ class FoundationModelWrapper(Wrapper):
     def observation(self, observation):
         """Returns a modified observation."""
 
-        image = self.get_image(observation)
+        if self.owns_cache:
+            self.obs_cache.invalidate(observation)
+        image = self.obs_cache.image()
 
         _, action = self.model.step(image, self.instruction)
         # self.maybe_advance()
@@ -3,14 +3,21 @@ import numpy as np
 from gymnasium import spaces
 from gymnasium.spaces.dict import Dict
 from improve.wrapper import dict_util as du
+from improve.wrapper.simpler import reward as rewards
+from improve.wrapper.simpler.obs_cache import LazyObs, find_cache
 from mani_skill2_real2sim.utils.sapien_utils import get_entity_by_name
 from scipy.ndimage import zoom
 
 
 class FlattenKeysWrapper(gym.Wrapper):
+    """
+    :param lazy: pass LazyObs thunks through, set by FilterKeysWrapper
+        otherwise everything is computed before the obs leaves this step
+    """
 
-    def __init__(self, env):
+    def __init__(self, env, lazy=False):
         super().__init__(env)
+        self.lazy = lazy
 
         spaces = du.flatten(du.todict(self.observation_space))
         self.observation_space = Dict(spaces)
@@ -20,6 +27,10 @@ class FlattenKeysWrapper(gym.Wrapper):
         return self.observation(obs), info
 
     def observation(self, observation):
+        if isinstance(observation, LazyObs):
+            flat = observation.flatten()
+            # thunks read the ObsCache, which is stale after the next step/reset
+            return flat if self.lazy else dict(flat.items())
         observation = du.flatten(du.todict(observation))
         return observation
 
@@ -30,6 +41,9 @@ class FlattenKeysWrapper(gym.Wrapper):
 
 
 class FilterKeysWrapper(gym.Wrapper):
+    """keeps only keys, which are the only ones ever computed
+    the key set is declared to the ObsCache so state-only configs never render
+    """
 
     def __init__(self, env, keys=None):
         assert isinstance(
@@ -42,11 +56,20 @@ class FilterKeysWrapper(gym.Wrapper):
         spaces = {k: v for k, v in self.env.observation_space.items() if k in self.keys}
         self.observation_space = Dict(spaces)
 
+        self.env.lazy = True
+        try:
+            self.obs_cache = self.get_wrapper_attr("obs_cache")
+            self.obs_cache.need(self.keys)
+        except AttributeError:
+            self.obs_cache = None  # no ObsCacheWrapper, everything is computed anyway
+
     def reset(self, **kwargs):
         obs, info = super().reset(**kwargs)
         return self.observation(obs), info
 
     def observation(self, observation):
+        if self.obs_cache is not None and self.obs_cache.batched:
+            return observation.subset(self.keys)  # computed by MultiSceneVecEnv
         observation = {k: observation[k] for k in observation if k in self.keys}
         return observation
 
@@ -61,9 +84,18 @@ class GraspDenseRewardWrapper(gym.Wrapper):
     def __init__(self, env, clip=0.2):
         super().__init__(env)
         self.clip = clip
+        self.obs_cache, self.owns_cache = find_cache(self.env)
+
+    def reset(self, **kwargs):
+        observation, info = super().reset(**kwargs)
+        if self.owns_cache:
+            self.obs_cache.invalidate(observation)
+        return observation, info
 
     def step(self, action):
         observation, reward, terminated, truncated, info = super().step(action)
+        if self.owns_cache:
+            self.obs_cache.invalidate(observation)
         reward = self.compute_reward(
             observation, action, reward, terminated, truncated, info
         )
@@ -72,16 +104,14 @@ class GraspDenseRewardWrapper(gym.Wrapper):
     def compute_reward(self, observation, action, reward, terminated, truncated, info):
 
         dist = self.obj_wrt_eef()
-        dist_reward = np.clip(1 - np.tanh(10 * np.linalg.norm(dist)), -1, self.clip)
-
-        return 10 * reward + ((1e-2) * dist_reward) + (1 * info["is_grasped"])
+        return float(rewards.grasp_dense(dist, reward, info["is_grasped"], self.clip))
 
         # + int(info["lifted_object"])
         # + ( (1e-3) * sum(action) if self.model is not None else 0)  # RP shouldnt help too much
 
     def obj_wrt_eef(self):
         """Get the object pose with respect to the end-effector frame"""
-        return self.obj_pose.p - self.get_tcp().pose.p
+        return self.obs_cache.wrt_eef("obj")
 
 
 def _scale_image(image, scale):
@@ -127,6 +157,15 @@ class DownscaleImgWrapper(gym.Wrapper):
         return self.observation(obs), info
 
     def observation(self, observation):
+        if isinstance(observation, LazyObs):
+            # images that were not rendered yet are scaled when they are
+            out, pending = LazyObs(), observation.pending()
+            for k in observation:
+                if k in pending:
+                    out.lazy(k, lambda k=k: du.apply(observation[k], self.scale_image))
+                else:
+                    out[k] = du.apply(observation[k], self.scale_image)
+            return out
         return du.apply(observation, self.scale_image)
 
     def step(self, action):
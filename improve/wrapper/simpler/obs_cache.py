@@ -0,0 +1,338 @@
+from collections import OrderedDict, defaultdict
+from pprint import pprint
+
+import numpy as np
+from gymnasium.core import Wrapper
+from mani_skill2_real2sim.utils.sapien_utils import get_entity_by_name
+from simpler_env.utils.env.observation_utils import \
+    get_image_from_maniskill2_obs_dict
+
+
+# raw maniskill2 keys that need the cameras to be rendered
+RENDER_KEYS = ("image", "camera_param")
+
+
+class Thunk:
+    __slots__ = ("fn",)
+
+    def __init__(self, fn):
+        self.fn = fn
+
+
+class LazyObs(dict):
+    """observation dict whose values can be registered as thunks
+    a thunk is computed on first access and replaced by its value
+    iterating keys never computes, items() and values() compute everything
+    so consumers that expect a plain dict still get one
+    """
+
+    def lazy(self, key, fn):
+        dict.__setitem__(self, key, Thunk(fn))
+
+    def __getitem__(self, key):
+        v = dict.__getitem__(self, key)
+        if isinstance(v, Thunk):
+            v = v.fn()
+            dict.__setitem__(self, key, v)
+        return v
+
+    # overriding __iter__ stops {**obs} and dict(obs) from copying raw thunks
+    def __iter__(self):
+        return dict.__iter__(self)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def pop(self, key, *default):
+        if key in self:
+            v = self[key]
+            dict.__delitem__(self, key)
+            return v
+        return dict.pop(self, key, *default)
+
+    def items(self):
+        return [(k, self[k]) for k in self]
+
+    def values(self):
+        return [self[k] for k in self]
+
+    def copy(self):
+        out = LazyObs()
+        dict.update(out, dict.items(self))
+        return out
+
+    def subset(self, keys):
+        """only keys, thunks stay thunks"""
+        out = LazyObs()
+        for k in self:
+            if k in keys:
+                dict.__setitem__(out, k, dict.__getitem__(self, k))
+        return out
+
+    def pending(self):
+        """keys that were never computed"""
+        return [k for k, v in dict.items(self) if isinstance(v, Thunk)]
+
+    def flatten(self, delim="_"):
+        """like dict_util.flatten but thunks stay thunks"""
+        out = LazyObs()
+        for k, v in dict.items(self):
+            if isinstance(v, LazyObs):
+                for kk, vv in dict.items(v.flatten(delim)):
+                    dict.__setitem__(out, k + delim + kk, vv)
+            else:
+                dict.__setitem__(out, k, v)
+        return out
+
+    @classmethod
+    def wrap(cls, obs):
+        """nested dicts to nested LazyObs"""
+        if isinstance(obs, dict):
+            return cls({k: cls.wrap(v) for k, v in obs.items()})
+        return obs
+
+
+def setlazy(obs, key, fn):
+    """registers key as a thunk, plain dicts compute it now"""
+    if isinstance(obs, LazyObs):
+        obs.lazy(key, fn)
+    else:
+        obs[key] = fn()
+
+
+class ObsCache:
+    """per-step cache for the expensive parts of a SIMPLER observation
+    images, SAPIEN poses and their derived features are computed lazily
+    the first time a wrapper asks for them and memoized until the next step/reset
+
+    :param env: the unwrapped (or lightly wrapped) SIMPLER env
+    """
+
+    def __init__(self, env):
+        self.env = env
+        self.obs = None
+        self.memo = {}
+        self.needs = None  # flat obs keys kept by FilterKeysWrapper, None is all
+        self.deferred = False  # cameras are rendered on demand, see need()
+        self.batched = False  # images are read by a multi-scene vec env, see batch()
+
+        self.nsteps = 0
+        self.requests = defaultdict(int)
+        self.computes = defaultdict(int)
+
+    def invalidate(self, obs):
+        """called once per step/reset with the raw maniskill2 obs"""
+        self.obs = obs
+        self.memo = {}
+        self.nsteps += 1
+
+    def cached(self, key, fn):
+        """returns memo[key], computing it with fn() on the first request this step"""
+        self.requests[key] += 1
+        if key not in self.memo:
+            self.computes[key] += 1
+            self.memo[key] = fn()
+        return self.memo[key]
+
+    def need(self, keys):
+        """declares the flat obs keys that are ever read
+        without raw camera keys the maniskill2 obs skips rendering
+        and images are only rendered when a wrapper asks for image()
+        """
+
+        self.needs = set(keys)
+        if not any(k.startswith(RENDER_KEYS) for k in self.needs):
+            self.defer_render()
+
+    def defer_render(self):
+        base = self.env.unwrapped
+        if not hasattr(base, "_get_obs_state_dict"):
+            return  # unknown env, keep rendering every step
+
+        def _get_obs():
+            obs = base._get_obs_state_dict()
+            # empty so the rgbd observation wrapper has nothing to convert
+            obs["camera_param"], obs["image"] = OrderedDict(), OrderedDict()
+            return obs
+
+        base.get_obs = _get_obs
+        self.deferred = True
+
+    def batch(self):
+        """lets a vec env render this scene together with others
+        obs keep their thunks past FilterKeysWrapper and the vec env computes them
+        after every scene has called submit()
+
+        :returns: whether images of this scene can be batched
+        """
+
+        self.batched = self.deferred
+        return self.batched
+
+    def submit(self):
+        """starts rendering the cameras, images are read by render()"""
+
+        def _submit():
+            base = self.env.unwrapped
+            base.update_render()
+            base.take_picture()
+            return True
+
+        return self.cached("submit", _submit)
+
+    def render(self):
+        """rendered camera images in the rgbd obs layout, for deferred obs"""
+
+        def _render():
+            base = self.env.unwrapped
+            self.submit()
+            images = OrderedDict()
+            for cam, textures in base.get_images().items():
+                images[cam] = OrderedDict()
+                for k, x in textures.items():
+                    if k == "Color":
+                        images[cam]["rgb"] = np.clip(x[..., :3] * 255, 0, 255).astype(np.uint8)
+                    elif k == "Position":
+                        images[cam]["depth"] = -x[..., [2]]
+                    else:
+                        images[cam][k] = x
+            return images
+
+        return self.cached("render", _render)
+
+    def image(self):
+        """show the right observation for video depending on the robot architecture"""
+
+        def _image():
+            obs = self.obs
+            if self.deferred and not obs["image"]:
+                # only the images, copying obs would compute its thunks
+                obs = {"image": self.render()}
+            return get_image_from_maniskill2_obs_dict(self.env, obs)
+
+        return self.cached("image", _image)
+
+    def tcp(self):
+        """tool-center point, usually the midpoint between the gripper fingers"""
+
+        def _tcp():
+            agent = self.env.agent
+            eef = agent.config.ee_link_name
+            return get_entity_by_name(agent.robot.get_links(), eef).pose
+
+        return self.cached("tcp", _tcp)
+
+    def obj(self):
+        """actor pose of the object (not its center of mass), source_obj_pose if the env has no obj
+        same as ExtraObservationWrapper.obj_pose so observations do not change
+        """
+
+        def _obj():
+            try:
+                return self.env.obj.pose
+            except:
+                return self.env.source_obj_pose
+
+        return self.cached("obj", _obj)
+
+    def src(self):
+        return self.cached("src", lambda: self.env.source_obj_pose)
+
+    def tgt(self):
+        return self.cached("tgt", lambda: self.env.target_obj_pose)
+
+    def drawer(self):
+        return self.cached("drawer", lambda: self.env.drawer_obj.pose)
+
+    def pose(self, name):
+        """pose of name as a (7,) array of [*p, *q]"""
+
+        def _pose():
+            pose = getattr(self, name)()
+            return np.hstack((pose.p, pose.q))
+
+        return self.cached(f"{name}-pose", _pose)
+
+    def wrt_eef(self, name):
+        """Get the pose of name with respect to the end-effector frame"""
+
+        def _wrt_eef():
+            return getattr(self, name)().p - self.tcp().p
+
+        return self.cached(f"{name}-wrt-eef", _wrt_eef)
+
+    def report(self):
+        """per-step requests vs actual computations for each cached key
+        saved is the number of redundant SAPIEN/render calls eliminated per step
+        """
+        n = max(self.nsteps, 1)
+        return {
+            k: {
+                "requests": self.requests[k] / n,
+                "computes": self.computes[k] / n,
+                "saved": (self.requests[k] - self.computes[k]) / n,
+            }
+            for k in self.requests
+        }
+
+
+def find_cache(env):
+    """the ObsCache of the wrapper chain
+    without an ObsCacheWrapper the caller gets a cache of its own and must call
+    invalidate with the raw obs on every step/reset, outer wrappers then find that one
+
+    :returns: (cache, owned)
+    """
+
+    try:
+        return env.get_wrapper_attr("obs_cache"), False
+    except AttributeError:
+        return ObsCache(env), True
+
+
+class ObsCacheWrapper(Wrapper):
+    """owns the ObsCache shared by all wrappers in the chain
+    should be the innermost wrapper so it sees every step/reset first
+    other wrappers find it with env.get_wrapper_attr("obs_cache")
+
+    observations leave as LazyObs so outer wrappers can add keys as thunks
+    """
+
+    def __init__(self, env):
+        super().__init__(env)
+        self.obs_cache = ObsCache(env)
+
+    def reset(self, **kwargs):
+        obs, info = self.env.reset(**kwargs)
+        obs = LazyObs.wrap(obs)
+        self.obs_cache.invalidate(obs)
+        return obs, info
+
+    def step(self, action):
+        obs, reward, terminated, truncated, info = self.env.step(action)
+        obs = LazyObs.wrap(obs)
+        self.obs_cache.invalidate(obs)
+        return obs, reward, terminated, truncated, info
+
+
+import hydra
+import improve
+import improve.hydra.resolver
+
+
+@hydra.main(config_path=improve.CONFIG, config_name="config", version_base="1.3.2")
+def main(cfg):
+    """prints the per-step cost report for the configured wrapper chain"""
+
+    from improve.env import make_env
+
+    env = make_env(cfg)()
+    env.reset()
+    for _ in range(cfg.env.max_episode_steps):
+        env.step(env.action_space.sample())
+
+    pprint(env.get_wrapper_attr("obs_cache").report())
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,9 @@ import simpler_env as simpler
 from gymnasium import spaces
 from mani_skill2_real2sim.utils.sapien_utils import get_entity_by_name
 
+from improve.wrapper.simpler import reward
+from improve.wrapper.simpler.obs_cache import ObsCacheWrapper, find_cache
+
 # import hydra
 # import improve
 # from omegaconf import OmegaConf
@@ -33,11 +36,20 @@ class ReachTaskWrapper(gym.Wrapper):
         self.use_sparse_reward = use_sparse_reward
         self.reward_clip = reward_clip
         self.thresh = thresh
+        self.obs_cache, self.owns_cache = find_cache(self.env)
 
         # assert env.obs_mode == "state_dict", "obs_mode must be state_dict"
 
+    def reset(self, **kwargs):
+        obs, info = self.env.reset(**kwargs)
+        if self.owns_cache:
+            self.obs_cache.invalidate(obs)
+        return obs, info
+
     def step(self, action):
         obs, rew, success, truncated, info = self.env.step(action)
+        if self.owns_cache:
+            self.obs_cache.invalidate(obs)
         rew, success, info = self.compute_success(obs, info)
         return obs, rew, success, truncated, info
 
@@ -49,18 +61,13 @@ class ReachTaskWrapper(gym.Wrapper):
         # dist = np.abs(obs["extra_tcp_to_obj_pos"])
 
         dist = self.obj_wrt_eef()
-        reached = dist < self.thresh
-        reached = np.all(reached)
+        rew, reached = reward.reach(dist, self.thresh, self.use_sparse_reward, self.reward_clip)
+        reached = bool(reached)
 
         info["success"] = reached
         info["reached"] = reached
         success = info["success"]
-
-        if self.use_sparse_reward:
-            rew = 1.0 if success else 0.0
-        else:
-            rew = np.clip(1 - np.tanh(10 * np.linalg.norm(dist)), -1, self.reward_clip)
-            rew = rew if not success else 1.0
+        rew = float(rew)
 
         return rew, success, info
 
@@ -72,7 +79,7 @@ class ReachTaskWrapper(gym.Wrapper):
 
     def obj_wrt_eef(self):
         """Get the object pose with respect to the end-effector frame"""
-        return self.obj_pose.p - self.get_tcp().pose.p
+        return self.obs_cache.wrt_eef("obj")
 
 
 # @hydra.main(config_path=improve.CONFIG, config_name="config", version_base="1.3.2")
@@ -105,6 +112,7 @@ def main():
         render_mode="human",
     )
 
+    env = ObsCacheWrapper(env)
     env = ReachTaskWrapper(env, use_sparse_reward=False)
     obs, info = env.reset()
     print(obs)
@@ -0,0 +1,46 @@
+"""
+batch reward functions shared by the reward wrappers and improve.data.relabel
+
+each takes arrays with any leading shape, a single step [3] or a stored episode [n, 3]
+so the online wrappers and offline relabeling compute the same rewards
+"""
+
+import numpy as np
+
+
+def wrt_eef(obj_pose, eef_pose):
+    """obj-wrt-eef from the obj-pose and eef-pose obs, like ObsCache.wrt_eef"""
+    return np.asarray(obj_pose)[..., :3] - np.asarray(eef_pose)[..., :3]
+
+
+def dist_reward(dist, clip):
+    """dense reach shaping in [-1, clip], 1 at the object"""
+    return np.clip(1 - np.tanh(10 * np.linalg.norm(dist, axis=-1)), -1, clip)
+
+
+def reach(dist, thresh=0.1, sparse=True, clip=0.5):
+    """ReachTaskWrapper
+
+    :param dist: [..., 3] obj-wrt-eef
+    :returns: rewards, success
+    """
+
+    # signed, as ReachTaskWrapper has always compared it
+    success = np.all(dist < thresh, axis=-1)
+    if sparse:
+        return success.astype(np.float32), success
+    return np.where(success, 1.0, dist_reward(dist, clip)).astype(np.float32), success
+
+
+def grasp_dense(dist, reward, is_grasped, clip=0.2):
+    """GraspDenseRewardWrapper
+
+    :param reward: the sparse env reward, 1 on success
+    """
+    return 10 * np.asarray(reward) + 1e-2 * dist_reward(dist, clip) + 1 * np.asarray(is_grasped)
+
+
+def awac(reward):
+    """AwacRewardWrapper, sparse rewards from [0, 1] to [-1, 0]"""
+    reward = np.asarray(reward)
+    return np.where(reward == 0, -1, np.where(reward == 1, 0, reward))
@@ -2,6 +2,8 @@ import gymnasium as gym
 import numpy as np
 from gymnasium.core import Wrapper
 
+from improve.wrapper.simpler.obs_cache import find_cache, setlazy
+
 
 class SourceTargetWrapper(Wrapper):
     def __init__(self, env):
@@ -22,23 +24,19 @@ class SourceTargetWrapper(Wrapper):
                 low=-np.inf, high=np.inf, shape=(dim,), dtype=np.float32
             )
 
-    def wrt_eef(self, obj_pose):
-        """Get the object pose with respect to the end-effector frame"""
-        return obj_pose.p - self.get_tcp().pose.p
+        self.obs_cache, self.owns_cache = find_cache(self.env)
 
     def observation(self, observation):
+        if self.owns_cache:
+            self.obs_cache.invalidate(observation)
+        cache = self.obs_cache
         # get src and target object pose
-        src_pose, tgt_pose = self.source_obj_pose, self.target_obj_pose
-        src_pose, tgt_pose = np.hstack((src_pose.p, src_pose.q)), np.hstack(
-            (tgt_pose.p, tgt_pose.q)
-        )
-
-        observation["src-pose"] = src_pose
-        observation["tgt-pose"] = tgt_pose
+        setlazy(observation, "src-pose", lambda: cache.pose("src"))
+        setlazy(observation, "tgt-pose", lambda: cache.pose("tgt"))
 
         # calculate the distance wrt to eef
-        observation["src-wrt-eef"] = self.wrt_eef(self.source_obj_pose)
-        observation["tgt-wrt-eef"] = self.wrt_eef(self.target_obj_pose)
+        setlazy(observation, "src-wrt-eef", lambda: cache.wrt_eef("src"))
+        setlazy(observation, "tgt-wrt-eef", lambda: cache.wrt_eef("tgt"))
 
         return observation
 
@@ -20,6 +20,7 @@ import wandb
 from absl import app, flags, logging
 from flax import struct
 from improve import cn, lora_octo
+from improve.data import stats
 from improve.env.action_rescale import ActionRescaler
 from improve.offline.awac import mk_model_step, mk_octo_adv_loss
 from improve.offline.critic_heads import MSECriticHead
@@ -119,56 +120,8 @@ class OXE2SimplerProcesser:
 
         self.action_scale = 1
 
-        if dataset_id == "bridge_dataset":
-            self.action_mean = np.array(
-                [
-                    0.00021161,
-                    0.00012614,
-                    -0.00017022,
-                    -0.00015062,
-                    -0.00023831,
-                    0.00025646,
-                    0.0,
-                ]
-            )
-            self.action_std = np.array(
-                [
-                    0.00963721,
-                    0.0135066,
-                    0.01251861,
-                    0.02806791,
-                    0.03016905,
-                    0.07632624,
-                    1.0,
-                ]
-            )
-        elif dataset_id == "fractal20220817_data":
-            self.action_mean = np.array(
-                [
-                    0.00696389,
-                    0.00627008,
-                    -0.01263256,
-                    0.04330839,
-                    -0.00570499,
-                    0.00089247,
-                    0.0,
-                ]
-            )
-            self.action_std = np.array(
-                [
-                    0.06925472,
-                    0.06019009,
-                    0.07354742,
-                    0.15605888,
-                    0.1316399,
-                    0.14593437,
-                    1.0,
-                ]
-            )
-        else:
-            raise NotImplementedError(
-                f"{dataset_id} not supported yet for custom octo model checkpoints."
-            )
+        action = stats.octo(dataset_id)["action"]
+        self.action_mean, self.action_std = action["mean"], action["std"]
         self.automatic_task_creation = False
 
         self.batch_size = batch_size
@@ -370,21 +323,25 @@ def mk_envs(n_envs=cfg.inference_size):
     from stable_baselines3.common.vec_env import (DummyVecEnv, SubprocVecEnv,
                                                   VecMonitor, VecVideoRecorder)
 
+    from improve.env.render import renderer_kwargs
+    from omegaconf import OmegaConf as OC
+
     from octo.utils import gym_wrappers as GW
 
-    def _init() -> gym.Env:
+    # MyConfig is a plain dataclass, render.backend etc need attribute access
+    render = OC.create(cfg.env.render)
+
+    def _init(rank=0) -> gym.Env:
 
         env = simpler.make(
             cfg.task,
             # cant find simpler-img if you specify the mode
             render_mode="cameras",
             # max_episode_steps=max_episode_steps,
-            renderer_kwargs={
-                "offscreen_only": True,
-                "device": "cuda:0",
-            },
+            renderer_kwargs=renderer_kwargs(render, rank),
             # **extra,
         )
+        env = W.ObsCacheWrapper(env)
 
         # oxes does this
         # env = W.ActionRescaleWrapper(env)
@@ -407,7 +364,7 @@ def mk_envs(n_envs=cfg.inference_size):
         return env
 
     # batch must match n_envs :(
-    venv = SubprocVecEnv([_init for _ in range(n_envs)])
+    venv = SubprocVecEnv([partial(_init, rank) for rank in range(n_envs)])
     # venv = VecMonitor(venv)  # attach this so SB3 can log reward metrics
 
     venv.seed(0)
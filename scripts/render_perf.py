@@ -0,0 +1,70 @@
+"""
+SIMPLER render throughput per backend, like simpler_perf.py does for success rates
+
+    python scripts/render_perf.py env.foundation.task=google_robot_pick_coke_can
+
+frames/sec is update_render + take_picture + get_images of the task cameras
+steps/sec is a full env step with the configured (image) obs
+each backend runs in a fresh process since vulkan picks its driver once per process
+"""
+
+import multiprocessing as mp
+import time
+from pprint import pprint
+
+import hydra
+import numpy as np
+from omegaconf import OmegaConf as OC
+
+import improve
+import improve.hydra.resolver
+
+BACKENDS = ["gpu", "cpu"]
+
+
+def perf(cfg, backend, n=100):
+    from improve.env import make_env
+
+    cfg = OC.create(cfg)
+    cfg.env.render.backend = backend
+    env = make_env(cfg)()
+    base = env.unwrapped
+    env.reset(seed=0)
+
+    tic = time.time()
+    for _ in range(n):
+        base.update_render()
+        base.take_picture()
+        base.get_images()
+    frames = n / (time.time() - tic)
+
+    tic = time.time()
+    for _ in range(n):
+        env.step(env.action_space.sample())
+    steps = n / (time.time() - tic)
+
+    env.close()
+    return {"frames/sec": np.round(frames, 1), "steps/sec": np.round(steps, 1)}
+
+
+def _perf(args):
+    try:
+        return perf(*args)
+    except Exception as e:  # backend not available on this machine
+        return {"error": repr(e)}
+
+
+@hydra.main(config_path=improve.CONFIG, config_name="config", version_base="1.3.2")
+def main(cfg):
+    cfg = OC.to_container(cfg, resolve=True)
+    ctx = mp.get_context("spawn")
+
+    results = {}
+    for backend in BACKENDS:
+        with ctx.Pool(1) as pool:
+            results[backend] = pool.apply(_perf, ((cfg, backend),))
+    pprint(results)
+
+
+if __name__ == "__main__":
+    main()